@@ -0,0 +1,308 @@
+from os import getenv, environ
+
+from time import perf_counter, time
+
+from decimal import Decimal
+
+from random import Random
+from json import load, dump
+
+from tempfile import mkdtemp
+from threading import Lock
+from multiprocessing import Process, Queue, Event
+from subprocess import run
+from resource import getrusage, RUSAGE_SELF
+
+from tinyflux import TinyFlux
+
+from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
+
+from utils.logging import info, error
+from utils.constants import ZERO_ADDRESS, BOB_TOKEN_ADDRESS
+from utils.abi import get_abi, ABI
+
+from balances.db.balances import BalancesDB
+from balances.db.models import DBAConfig
+from balances.token import decode_transfer_log, TRANSFER_TOPIC, _checksum_address
+
+# BENCHMARK=balances replays a monthly partition of the transfers timeseries db
+# to compare the cost of applying one transfer to the balances kept as normalized
+# decimal strings (the representation used before) and as integers of wei.
+#
+# BENCHMARK=decoder validates the specialized Transfer decoder against web3's
+# processLog and measures logs/sec of both. The logs are read from LOGS_CORPUS
+# (JSON list of logs as returned by eth_getLogs) or generated if it is not set.
+#
+# BENCHMARK=indexer runs Indexer.discover_balance_updates until the head is
+# achieved against the RPC stand-in serving a synthetic chain with
+# INDEXER_TRANSFERS Transfers between INDEXER_HOLDERS holders, INDEXER_TRANSFERS_PER_BLOCK
+# in every block. The stand-in runs in a separate process so its memory is not
+# counted in the peak RSS. Throughput, peak RSS and the time split between
+# log fetch, timestamps lookup, decoding, TransfersDB and BalancesDB are logged
+# and written to BENCHMARK_OUTPUT as JSON. The stages of fetching and applying
+# logs overlap if INDEXER_PREFETCH_DEPTH > 0 so their sum can exceed the total.
+
+BENCHMARK = getenv('BENCHMARK', 'balances')
+TSDB_DIR = getenv('TSDB_DIR', 'tsdb')
+TSDB_FILE_SUFFIX = getenv('TSDB_FILE_SUFFIX', 'bob-transfers.csv')
+CHAIN = getenv('CHAIN', 'pol')
+MONTH = getenv('MONTH', '202301')
+LOGS_CORPUS = getenv('LOGS_CORPUS', '')
+SYNTHETIC_LOGS = int(getenv('SYNTHETIC_LOGS', 100000))
+INDEXER_TRANSFERS = int(getenv('INDEXER_TRANSFERS', 100000))
+INDEXER_HOLDERS = int(getenv('INDEXER_HOLDERS', 20000))
+INDEXER_TRANSFERS_PER_BLOCK = int(getenv('INDEXER_TRANSFERS_PER_BLOCK', 10))
+INDEXER_BLOCK_RANGE = int(getenv('INDEXER_BLOCK_RANGE', 2000))
+INDEXER_PREFETCH_DEPTH = int(getenv('INDEXER_PREFETCH_DEPTH', 3))
+INDEXER_RPC_LATENCY = float(getenv('INDEXER_RPC_LATENCY', 0))
+BENCHMARK_OUTPUT = getenv('BENCHMARK_OUTPUT', 'benchmark-indexer.json')
+BOB_TOKEN_DENOMINATOR = Decimal(10) ** 18
+
+def from_1bln_base(fields: dict) -> int:
+    retval = 0
+    for a in ('a3', 'a2', 'a1', 'a0'):
+        retval = retval * (10 ** 9) + int(fields[a])
+    return retval
+
+def change_balance_with_decimals(balances: dict, account: str, value: Decimal):
+    prev_balance = Decimal(0)
+    if account in balances:
+        prev_balance = Decimal(balances[account])
+    new_balance = prev_balance + value
+    if new_balance == 0:
+        del balances[account]
+    else:
+        balances[account] = str(new_balance)
+
+def apply_with_decimals(logs: list) -> dict:
+    balances = {}
+    for log in logs:
+        value = Decimal(log['fields']['value']) / BOB_TOKEN_DENOMINATOR
+        if value != 0:
+            if log['tags']['from'] != ZERO_ADDRESS:
+                change_balance_with_decimals(balances, log['tags']['from'], -value)
+            if log['tags']['to'] != ZERO_ADDRESS:
+                change_balance_with_decimals(balances, log['tags']['to'], value)
+    return balances
+
+def apply_with_integers(logs: list) -> dict:
+    db = BalancesDB(DBAConfig(
+        chainid=CHAIN,
+        snapshot_dir=mkdtemp(),
+        snapshot_file_suffix='benchmark.json',
+        init_block=0
+    ))
+    # the snapshot does not exist in the fresh directory so it starts empty
+    db.load()
+    for log in logs:
+        db.register_log(log)
+    return db._snapshot['balances']
+
+def measure(name: str, func, logs: list) -> dict:
+    start = perf_counter()
+    balances = func(logs)
+    duration = perf_counter() - start
+    info(f'{name}: {len(logs)} transfers in {duration:.3f} secs, {duration / max(len(logs), 1) * 10 ** 6:.2f} usecs per transfer')
+    return balances
+
+def synthetic_transfer_logs(amount: int, seed: int = 1) -> list:
+    rnd = Random(seed)
+    accounts = ['0x' + '00' * 12 + rnd.randbytes(20).hex() for _ in range(max(amount // 5, 1))]
+    logs = []
+    for i in range(amount):
+        logs.append({
+            'address': BOB_TOKEN_ADDRESS,
+            'topics': [Web3.toHex(TRANSFER_TOPIC), rnd.choice(accounts), rnd.choice(accounts)],
+            'data': '0x' + rnd.randrange(10 ** 24).to_bytes(32, 'big').hex(),
+            'blockNumber': hex(1000000 + i // 10),
+            'blockHash': '0x' + rnd.randbytes(32).hex(),
+            'transactionHash': '0x' + rnd.randbytes(32).hex(),
+            'transactionIndex': hex(i % 10),
+            'logIndex': hex(i % 10),
+            'removed': False
+        })
+    return logs
+
+def decoder_benchmark():
+    if LOGS_CORPUS:
+        info(f'Reading {LOGS_CORPUS}')
+        with open(LOGS_CORPUS) as f:
+            raw_logs = load(f)
+    else:
+        info(f'Generating {SYNTHETIC_LOGS} logs')
+        raw_logs = synthetic_transfer_logs(SYNTHETIC_LOGS)
+    logs = [log_entry_formatter(l) for l in raw_logs]
+
+    event = Web3().eth.contract(abi=get_abi(ABI.ERC20), address=BOB_TOKEN_ADDRESS).events.Transfer()
+    def by_process_log(l) -> dict:
+        pl = event.processLog(l)
+        return {
+            "logIndex": pl.logIndex,
+            "transactionIndex": pl.transactionIndex,
+            "transactionHash": Web3.toHex(pl.transactionHash),
+            "blockHash": Web3.toHex(pl.blockHash),
+            "blockNumber": pl.blockNumber,
+            "from": pl.args['from'],
+            "to": pl.args['to'],
+            "value": pl.args['value']
+        }
+
+    start = perf_counter()
+    expected = [by_process_log(l) for l in logs]
+    duration_abi = perf_counter() - start
+
+    _checksum_address.cache_clear()
+    start = perf_counter()
+    decoded = [decode_transfer_log(l) for l in logs]
+    duration_fast = perf_counter() - start
+
+    mismatches = [i for i in range(len(logs)) if expected[i] != decoded[i]]
+    for i in mismatches[:10]:
+        error(f'log #{i} decoded differently: {expected[i]} != {decoded[i]}')
+    info(f'{len(logs)} logs, {len(mismatches)} decoded differently')
+    info(f'processLog: {len(logs) / duration_abi:.0f} logs/sec')
+    info(f'specialized decoder: {len(logs) / duration_fast:.0f} logs/sec')
+
+def balances_benchmark():
+    db_file = f'{TSDB_DIR}/{CHAIN}-{MONTH}-{TSDB_FILE_SUFFIX}'
+    info(f'Reading {db_file}')
+    with TinyFlux(db_file) as tsdb:
+        logs = [{
+            'tags': {'from': p.tags['from'], 'to': p.tags['to']},
+            'fields': {'value': from_1bln_base(p.fields)}
+        } for p in tsdb]
+
+    decimals = measure('decimal strings', apply_with_decimals, logs)
+    integers = measure('integer wei', apply_with_integers, logs)
+
+    mismatches = [a for a in integers if Decimal(integers[a]) / BOB_TOKEN_DENOMINATOR != Decimal(decimals.get(a, 0))]
+    info(f'{len(integers)} accounts, {len(mismatches)} balances differ between representations')
+
+class StageTimer:
+    # accumulates time spent in the wrapped methods, they can be called
+    # from several threads
+    durations: dict
+    _lock: Lock
+
+    def __init__(self):
+        self.durations = {}
+        self._lock = Lock()
+
+    def wrap(self, obj, method: str, stage: str):
+        func = getattr(obj, method)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.durations[stage] = self.durations.get(stage, 0) + perf_counter() - start
+        setattr(obj, method, timed)
+
+def _serve_synthetic_chain(blocks: int, ports: Queue, stop: Event):
+    from rpcstandin.server import RPCStandIn
+    from rpcstandin.synthetic import SyntheticChain
+
+    chain = SyntheticChain(
+        blocks=blocks,
+        transfers_per_block=INDEXER_TRANSFERS_PER_BLOCK,
+        trades_per_block=0,
+        holders=INDEXER_HOLDERS,
+        max_logs_range=INDEXER_BLOCK_RANGE
+    )
+    server = RPCStandIn(chain=chain, latency=INDEXER_RPC_LATENCY).start()
+    ports.put((server.server_address[1], chain.start_block, chain.head))
+    # the server is served by a thread started by the stand-in
+    stop.wait()
+    server.shutdown()
+    server.server_close()
+
+def _commit() -> str:
+    try:
+        return run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return ''
+
+def indexer_benchmark():
+    blocks = max(INDEXER_TRANSFERS // max(INDEXER_TRANSFERS_PER_BLOCK, 1), 1)
+    ports = Queue()
+    stop = Event()
+    standin = Process(target=_serve_synthetic_chain, args=(blocks, ports, stop), daemon=True)
+    standin.start()
+    (port, start_block, head) = ports.get()
+
+    workdir = mkdtemp(prefix='indexer-benchmark-')
+    info(f'Indexing {blocks} blocks in {workdir}')
+    with open(f'{workdir}/deployments.json', 'w') as f:
+        dump({'chains': {CHAIN: {
+            'name': 'synthetic',
+            'finalization': 0,
+            'events_pull_interval': 0,
+            'rpc': {'url': f'http://127.0.0.1:{port}', 'history_block_range': INDEXER_BLOCK_RANGE},
+            'token': {'start_block': start_block}
+        }}}, f)
+    environ['TOKEN_DEPOLOYMENTS_INFO'] = f'{workdir}/deployments.json'
+    environ['SNAPSHOT_DIR'] = workdir
+    environ['TSDB_DIR'] = workdir
+    environ['LOGS_PREFETCH_DEPTH'] = str(INDEXER_PREFETCH_DEPTH)
+
+    from balances.settings import Settings
+    from balances.indexer import Indexer
+
+    indexer = Indexer(CHAIN, Settings.get())
+    timer = StageTimer()
+    timer.wrap(indexer._w3prov, 'get_logs', 'log fetch')
+    timer.wrap(indexer._w3prov, 'get_timestamps_by_blockhashes', 'timestamps lookup')
+    timer.wrap(indexer._token, 'process_transfer_log', 'decode')
+    for method in ('prepare_transaction', 'register_log', 'finish_transaction'):
+        timer.wrap(indexer._db._transfers, method, 'TransfersDB write')
+    timer.wrap(indexer._db._balances, 'register_log', 'BalancesDB update')
+    timer.wrap(indexer._db._balances, 'sync', 'BalancesDB sync')
+
+    start = perf_counter()
+    head_achieved = False
+    while not head_achieved:
+        head_achieved = indexer.discover_balance_updates()[1]
+    duration = perf_counter() - start
+    stop.set()
+    standin.join(5)
+    if standin.is_alive():
+        standin.terminate()
+
+    transfers = blocks * INDEXER_TRANSFERS_PER_BLOCK
+    result = {
+        'benchmark': 'indexer',
+        'commit': _commit(),
+        'timestamp': int(time()),
+        'params': {
+            'transfers': transfers,
+            'holders': INDEXER_HOLDERS,
+            'blocks': head - start_block + 1,
+            'transfers_per_block': INDEXER_TRANSFERS_PER_BLOCK,
+            'block_range': INDEXER_BLOCK_RANGE,
+            'prefetch_depth': INDEXER_PREFETCH_DEPTH,
+            'rpc_latency': INDEXER_RPC_LATENCY
+        },
+        'duration': duration,
+        'logs_per_sec': transfers / duration,
+        'blocks_per_sec': (head - start_block + 1) / duration,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': getrusage(RUSAGE_SELF).ru_maxrss / 1024,
+        'stages': timer.durations
+    }
+    info(f"{transfers} transfers in {duration:.2f} secs: {result['logs_per_sec']:.0f} logs/sec, " +
+         f"{result['blocks_per_sec']:.0f} blocks/sec, peak RSS {result['peak_rss_mb']:.0f} MB")
+    for stage in timer.durations:
+        info(f'{stage}: {timer.durations[stage]:.2f} secs')
+    with open(BENCHMARK_OUTPUT, 'w') as f:
+        dump(result, f, indent=2)
+    info(f'Results are stored to {BENCHMARK_OUTPUT}')
+
+if __name__ == '__main__':
+    if BENCHMARK == 'decoder':
+        decoder_benchmark()
+    elif BENCHMARK == 'indexer':
+        indexer_benchmark()
+    else:
+        balances_benchmark()
@@ -1,8 +1,11 @@
-from decimal import Decimal
+from decimal import Decimal, localcontext
+from typing import Set, Dict, Union, Optional
 
-from json import load, dump
+import os
 
-from utils.logging import info
+from json import load, dump, dumps, loads
+
+from utils.logging import info, warning
 from utils.constants import ZERO_ADDRESS
 
 from .models import DBAConfig
@@ -11,14 +14,26 @@ from .exceptions import NotInitialized
 class BalancesDB:
     _chain: str
     _snapshot_fn: str
+    _journal_fn: str
+    _metadata_fn: str
+    _journal_threshold: int
     _token_start_block: int
+    _token_decimals: int
     _snapshot: int
+    _changed: Set[str]
+    _total: int
 
     def __init__(self, config: DBAConfig):
         self._chain = config.chainid
         self._snapshot_fn = f'{config.snapshot_dir}/{config.chainid}-{config.snapshot_file_suffix}'
+        self._journal_fn = f'{self._snapshot_fn}.journal'
+        self._metadata_fn = f'{self._snapshot_fn}.meta'
+        self._journal_threshold = config.journal_threshold if config.journal_threshold else 0
         self._token_start_block = config.init_block
+        self._token_decimals = config.token_decimals
         self._snapshot = None
+        self._changed = set()
+        self._total = 0
 
     def _empty_snapshot(self) -> dict:
         return {
@@ -27,6 +42,64 @@ class BalancesDB:
             "balances": {}
         }
 
+    def _to_wei(self, balance: Union[int, str]) -> int:
+        # balances are kept as integers of the smallest token units. Snapshots
+        # and journals made by previous versions contain normalized decimal strings
+        if type(balance) == int:
+            return balance
+        with localcontext() as ctx:
+            ctx.prec = 78
+            return int(Decimal(balance).scaleb(self._token_decimals))
+
+    def _migrate(self):
+        balances = self._snapshot['balances']
+        legacy = [a for a in balances if type(balances[a]) != int]
+        if len(legacy) > 0:
+            info(f'{self._chain}: converting {len(legacy)} normalized balances to integers')
+            for a in legacy:
+                balances[a] = self._to_wei(balances[a])
+
+    def _replay_journal(self):
+        # Every journal record contains the resulting balances of the accounts
+        # changed within a block range, so the records are applied as is.
+        # Records made before the latest compaction are skipped. Replaying stops
+        # at a record torn by a crash. The writer, the only one configured with
+        # a journal threshold, cuts it off together with everything after it,
+        # otherwise the next record would be appended to the same line. Other
+        # services must not modify the journal of the running writer
+        try:
+            with open(self._journal_fn, 'rb') as journal_file:
+                records = 0
+                offset = 0
+                torn_at = None
+                for line in journal_file:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError
+                        record = loads(line)
+                    except ValueError:
+                        torn_at = offset
+                        break
+                    offset += len(line)
+                    if record['last_block'] <= self._snapshot['last_block']:
+                        continue
+                    for (account, balance) in record['balances'].items():
+                        if balance == None:
+                            self._snapshot['balances'].pop(account, None)
+                        else:
+                            self._snapshot['balances'][account] = self._to_wei(balance)
+                    self._snapshot['last_block'] = record['last_block']
+                    records += 1
+        except IOError:
+            return
+        if torn_at != None:
+            if self._journal_threshold > 0:
+                warning(f'{self._chain}: incomplete journal record found, truncating journal to {torn_at} bytes')
+                os.truncate(self._journal_fn, torn_at)
+            else:
+                warning(f'{self._chain}: incomplete journal record found, the rest of the journal is skipped')
+        info(f'{self._chain}: {records} journal records applied to balances snapshot')
+
     def load(self):
         info(f'{self._chain}: reading balances snapshot')
         try:
@@ -35,40 +108,100 @@ class BalancesDB:
         except IOError:
             info(f'{self._chain}: empty snapshot will be used')
             self._snapshot = self._empty_snapshot()
+        self._migrate()
+        self._replay_journal()
+        self._changed = set()
+        self._total = sum(self._snapshot['balances'].values())
 
     def get_last_block(self) -> int:
         if not self._snapshot:
             self.load()
         return self._snapshot['last_block']
 
+    def get_metadata(self) -> Optional[dict]:
+        # small record maintained by the writer along with the snapshot
+        # to avoid reading all balances by other services
+        try:
+            with open(self._metadata_fn, 'r') as json_file:
+                return load(json_file)
+        except (IOError, ValueError):
+            return None
+
     def get_holders_count(self) -> int:
+        if self._snapshot:
+            return len(self._snapshot['balances'])
+        metadata = self.get_metadata()
+        if metadata:
+            return metadata['holders']
+        info(f'{self._chain}: no balances metadata found')
+        self.load()
+        holders = len(self._snapshot['balances'])
+        self.clean()
+        return holders
+
+    def get_balances(self) -> Dict[str, Decimal]:
         if not self._snapshot:
             self.load()
-        return len(self._snapshot['balances'])
-
-    def _change_balance(self, account: str, value: Decimal):
-        prev_balance = Decimal(0)
-        if account in self._snapshot['balances']:
-            prev_balance = self._snapshot['balances'][account]
-            if not type(prev_balance) == str:
-                prev_balance = str(prev_balance)
-            prev_balance = Decimal(prev_balance)
-        new_balance = prev_balance + value
+        denominator = Decimal(10) ** self._token_decimals
+        balances = self._snapshot['balances']
+        return dict([(a, Decimal(balances[a]) / denominator) for a in balances])
+
+    def _change_balance(self, account: str, value: int):
+        balances = self._snapshot['balances']
+        new_balance = balances.get(account, 0) + value
         if new_balance == 0:
-            del self._snapshot['balances'][account]
+            del balances[account]
         else:
-            self._snapshot['balances'][account] = str(new_balance)
+            balances[account] = new_balance
+        self._changed.add(account)
+        self._total += value
     
     def register_log(self, log: dict):
         sender = log['tags']['from']
         reciever = log['tags']['to']
-        value = log['methods']['denominate'](log['fields']['value'])
+        value = log['fields']['value']
         if  value != 0:
             if sender != ZERO_ADDRESS:
                 self._change_balance(sender, -value)
             if reciever != ZERO_ADDRESS:
                 self._change_balance(reciever, value)
 
+    def _write_snapshot(self):
+        # the snapshot is replaced atomically since it is read by other services
+        tmp_fn = f'{self._snapshot_fn}.tmp'
+        with open(tmp_fn, 'w') as json_file:
+            dump(self._snapshot, json_file)
+        os.replace(tmp_fn, self._snapshot_fn)
+
+    def _write_metadata(self):
+        metadata = {
+            "last_block": self._snapshot['last_block'],
+            "holders": len(self._snapshot['balances']),
+            "total_balance": self._total
+        }
+        tmp_fn = f'{self._metadata_fn}.tmp'
+        with open(tmp_fn, 'w') as json_file:
+            dump(metadata, json_file)
+        os.replace(tmp_fn, self._metadata_fn)
+
+    def _append_journal(self):
+        balances = self._snapshot['balances']
+        record = {
+            "last_block": self._snapshot['last_block'],
+            "balances": dict([(a, balances.get(a)) for a in self._changed])
+        }
+        with open(self._journal_fn, 'a') as journal_file:
+            journal_file.write(dumps(record) + '\n')
+
+    def compact(self):
+        if not self._snapshot:
+            raise NotInitialized()
+
+        info(f'{self._chain}: compacting balances journal into snapshot')
+        self._write_snapshot()
+        with open(self._journal_fn, 'w'):
+            pass
+
     def sync(self, new_last_block: int, clean: bool = True):
         if not self._snapshot:
             raise NotInitialized()
@@ -76,11 +209,21 @@ class BalancesDB:
         self._snapshot['last_block'] = new_last_block
         info(f'{self._chain}: Updating snapshot with new last block {new_last_block}')
 
-        with open(self._snapshot_fn, 'w') as json_file:
-            dump(self._snapshot, json_file)
+        if self._journal_threshold > 0:
+            self._append_journal()
+            self._changed = set()
+            if os.path.getsize(self._journal_fn) >= self._journal_threshold:
+                self.compact()
+            self._write_metadata()
+            # the snapshot is kept in memory since the journal is replayed on load only
+            return
+
+        self._write_snapshot()
+        self._write_metadata()
         
         if clean:
             self.clean()
 
     def clean(self):
         self._snapshot = None
+        self._changed = set()
@@ -1,10 +1,15 @@
 from pydantic import BaseModel
 from typing import Optional
 
+from utils.tsdb import TINYFLUX_ENGINE
+
 class DBAConfig(BaseModel):
     chainid: str
     snapshot_dir: str
     snapshot_file_suffix: str
     init_block: int
+    token_decimals: int = 18
     tsdb_dir: Optional[str]
     tsdb_file_suffix: Optional[str]
+    tsdb_engine: str = TINYFLUX_ENGINE
+    journal_threshold: Optional[int]
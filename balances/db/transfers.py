@@ -6,9 +6,10 @@ from copy import copy
 from time import gmtime, strftime
 from datetime import datetime
 
-from tinyflux import TinyFlux, Point
+from tinyflux import Point
 
 from utils.logging import info
+from utils.tsdb import get_storage
 
 from .models import DBAConfig
 from .exceptions import NotInitialized
@@ -30,6 +31,7 @@ class TransfersDB:
     _chain: str
     _tsdb_dir: str
     _tsdb_file_sufix: str
+    _tsdb_engine: str
     _points: Dict[str, List[Point]]
 
     def __init__(self, config: DBAConfig):
@@ -38,6 +40,7 @@ class TransfersDB:
             raise NotInitialized()
         self._tsdb_dir = config.tsdb_dir
         self._tsdb_file_sufix = config.tsdb_file_suffix
+        self._tsdb_engine = config.tsdb_engine
 
     def prepare_transaction(self):
         self._points = {}
@@ -65,5 +68,5 @@ class TransfersDB:
     def finish_transaction(self):
         info(f'{self._chain}: storing {sum([len(self._points[g]) for g in self._points])} to timeseries db')
         for grp in self._points:
-            with TinyFlux(f'{self._tsdb_dir}/{self._chain}-{grp}-{self._tsdb_file_sufix}') as tsdb:
-                tsdb.insert_multiple(self._points[grp])
+            tsdb = get_storage(f'{self._tsdb_dir}/{self._chain}-{grp}-{self._tsdb_file_sufix}', self._tsdb_engine)
+            tsdb.insert(self._points[grp])
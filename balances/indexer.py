@@ -1,6 +1,9 @@
 
 from typing import Tuple
 
+from queue import Queue, Full
+from threading import Thread, Event
+
 from utils.logging import info, error
 
 from .settings import Settings
@@ -14,9 +17,13 @@ class Indexer:
     _w3prov: Web3ProviderExt
     _token: BobTokenContract
     _db: DBAdapter
+    _prefetch_depth: int
+    _prefetch_ranges: int
 
     def __init__(self, chainid: str, settings: Settings):
         self._chain = chainid
+        self._prefetch_depth = settings.logs_prefetch_depth
+        self._prefetch_ranges = max(settings.logs_prefetch_ranges, 1)
         self._w3prov = settings.w3_providers[chainid]
         self._token = BobTokenContract(self._w3prov)
         self._db = DBAdapter(DBAConfig(
@@ -25,7 +32,9 @@ class Indexer:
             snapshot_file_suffix=settings.snapshot_file_suffix,
             init_block=settings.chains[chainid].token.start_block,
             tsdb_dir=settings.tsdb_dir,
-            tsdb_file_suffix=settings.tsdb_file_suffix
+            tsdb_file_suffix=settings.tsdb_file_suffix,
+            tsdb_engine=settings.tsdb_engine,
+            journal_threshold=settings.snapshot_journal_threshold
         ))
 
     def discover_balance_updates(self) -> Tuple[bool, bool]:
@@ -40,6 +49,9 @@ class Indexer:
         if last_block < start_block:
             error(f'{self._chain}: something wrong with RPC endpoit')
             return storages_updated, head_achieved
+
+        if self._prefetch_depth > 0:
+            return self._discover_pipelined(start_block, last_block)
         
         achieved_block, logs = self._token.get_transfer_logs(start_block, last_block)
 
@@ -47,4 +59,57 @@ class Indexer:
 
         storages_updated = self._db.update(achieved_block, logs)
             
+        return storages_updated, head_achieved
+
+    def _discover_pipelined(self, start_block: int, last_block: int) -> Tuple[bool, bool]:
+        # Ranges are fetched from RPC by a separate thread and applied to the databases
+        # in the order they were fetched. The next range starts right after the block
+        # achieved by the previous one, so the strict block order is kept.
+        # Not more than `logs_prefetch_ranges` ranges are fetched in one pass
+        # to return to the worker loop regularly while the backlog is caught up
+        ranges = Queue(maxsize=self._prefetch_depth)
+        stop = Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    ranges.put(item, timeout=1)
+                    return
+                except Full:
+                    pass
+
+        def producer():
+            from_block = start_block
+            fetched = 0
+            try:
+                while (from_block <= last_block) and (fetched < self._prefetch_ranges) and not stop.is_set():
+                    achieved_block, logs = self._token.get_transfer_logs(from_block, last_block)
+                    put((achieved_block, logs))
+                    from_block = achieved_block + 1
+                    fetched += 1
+            except Exception as e:
+                put(e)
+            put(None)
+
+        info(f'{self._chain}: prefetching up to {self._prefetch_depth} ranges ahead')
+        fetcher = Thread(target=producer, daemon=True, name=f'{self._chain}-prefetcher')
+        fetcher.start()
+
+        storages_updated = False
+        head_achieved = False
+        try:
+            while True:
+                item = ranges.get()
+                if item == None:
+                    break
+                if isinstance(item, Exception):
+                    error(f'{self._chain}: not able to fetch logs: {item}')
+                    raise item
+                achieved_block, logs = item
+                storages_updated |= self._db.update(achieved_block, logs)
+                head_achieved = last_block == achieved_block
+        finally:
+            stop.set()
+            fetcher.join()
+
         return storages_updated, head_achieved
\ No newline at end of file
@@ -6,7 +6,8 @@ from web3 import Web3
 from time import sleep, time
 
 from json import load, dump
-from tinyflux import TinyFlux
+
+from utils.tsdb import open_storage, storage_filename
 
 from decimal import Decimal
 
@@ -23,12 +24,14 @@ SNAPSHOT_DIR = getenv('SNAPSHOT_DIR', 'snapshots')
 SNAPSHOT_FILE_SUFFIX = getenv('SNAPSHOT_FILE_SUFFIX', 'bob-holders-snaphsot.json')
 TSDB_DIR = getenv('TSDB_DIR', 'tsdb')
 TSDB_FILE_SUFFIX = getenv('TSDB_FILE_SUFFIX', 'bob-transfers.csv')
+TSDB_ENGINE = getenv('TSDB_ENGINE', 'tinyflux')
 LIST_OF_CHAINS = getenv('LIST_OF_CHAINS', 'bsc eth opt pol')
 
 info(f'SNAPSHOT_DIR = {SNAPSHOT_DIR}')
 info(f'SNAPSHOT_FILE_SUFFIX = {SNAPSHOT_FILE_SUFFIX}')
 info(f'TSDB_DIR = {TSDB_DIR}')
 info(f'TSDB_FILE_SUFFIX = {TSDB_FILE_SUFFIX}')
+info(f'TSDB_ENGINE = {TSDB_ENGINE}')
 info(f'LIST_OF_CHAINS = {LIST_OF_CHAINS}')
 
 req_chains = LIST_OF_CHAINS.split()
@@ -87,8 +90,20 @@ def change_balance(_balances, _transfer):
                 _balances[_transfer['to']] = str(new_balance)
 
 def write_balances_snapshot_for_chain(_chain, _snapshot):
-    with open(f'{SNAPSHOT_DIR}/{_chain}-{SNAPSHOT_FILE_SUFFIX}', 'w') as json_file:
+    snapshot_fn = f'{SNAPSHOT_DIR}/{_chain}-{SNAPSHOT_FILE_SUFFIX}'
+    with open(snapshot_fn, 'w') as json_file:
         dump(_snapshot, json_file)
+    # the journal of the indexer was made on top of the previous balances,
+    # its records must not be replayed over the recalculated ones
+    if os.path.isfile(f'{snapshot_fn}.journal'):
+        os.remove(f'{snapshot_fn}.journal')
+    total = sum([int(Decimal(b) * BOB_TOKEN_DENOMINATOR) for b in _snapshot['balances'].values()])
+    with open(f'{snapshot_fn}.meta', 'w') as json_file:
+        dump({
+            "last_block": _snapshot['last_block'],
+            "holders": len(_snapshot['balances']),
+            "total_balance": total
+        }, json_file)
 
 def get_amount_from_fields(_fields):
     return from_1bln_base(_fields['a3'], _fields['a2'], _fields['a1'], _fields['a0'])
@@ -97,7 +112,7 @@ for _chain in req_chains:
     first_month_discovered = False
     for _month in months:
         db_file = f'{TSDB_DIR}/{_chain}-{_month}-{TSDB_FILE_SUFFIX}'
-        if not os.path.isfile(db_file):
+        if not os.path.isfile(storage_filename(db_file, TSDB_ENGINE)):
             warning(f'Cannot open "{_chain}" data for {_month}')
         else:
             info(f'{_chain}: Reading snapshot')
@@ -107,9 +122,9 @@ for _chain in req_chains:
                 snapshot['balances'] = {}
                 first_month_discovered = True
             info(f'{_chain}: Open {db_file}')
-            tsdb=TinyFlux(db_file)
+            tsdb=open_storage(db_file, TSDB_ENGINE)
             counter = 0
-            for point in tsdb:
+            for point in tsdb.points():
                 value = normalise_amount(get_amount_from_fields(point.fields))
                 
                 change_balance(
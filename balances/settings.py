@@ -2,15 +2,24 @@ from typing import Dict
 
 from utils.settings.common import CommonSettings
 from utils.logging import info
+from utils.tsdb import TINYFLUX_ENGINE
 from .web3 import Web3ProviderExt
 
 class Settings(CommonSettings):
     snapshot_dir: str = '.'
     snapshot_file_suffix: str = 'bob-holders-snaphsot.json'
+    snapshot_journal_threshold: int = 16 * 1024 * 1024
     tsdb_dir: str = '.'
+    # tinyflux or sqlite, see tsdb-migrate.py to convert existing dbs
+    tsdb_engine: str = TINYFLUX_ENGINE
     tsdb_file_suffix: str = 'bob-transfers.csv'
     default_measurements_interval: int = 5
     threads_liveness_interval: int = 60
+    timestamps_batch_size: int = 100
+    logs_per_request_target: int = 2000
+    logs_prefetch_depth: int = 3
+    # ranges fetched in one indexing pass when prefetching is enabled
+    logs_prefetch_ranges: int = 20
     w3_providers: dict = {}
 
     def __init__(self):
@@ -25,13 +34,28 @@ class Settings(CommonSettings):
                     self.web3_retry_attemtps,
                     self.web3_retry_delay,
                     self.chains[chainid].finalization,
-                    self.chains[chainid].rpc.history_block_range
+                    self.chains[chainid].rpc.history_block_range,
+                    self.timestamps_batch_size,
+                    self.chains[chainid].rpc.max_history_block_range,
+                    self.logs_per_request_target,
+                    self.timestamps_cache_dir,
+                    self.timestamps_cache_size,
+                    self.web3_endpoint_failure_threshold,
+                    self.web3_endpoint_eject_time,
+                    self.web3_hedge_delay,
+                    self.web3_rate_limit,
+                    self.web3_rate_limit_burst,
+                    self.web3_rate_limit_lock_dir,
+                    self.web3_responses_cache_dir,
+                    self.web3_responses_cache_memory_size,
+                    self.web3_responses_cache_disk_size,
+                    self.web3_cassette_dir
                 )
 
         def web3_providers_formatter(w3_providers: Dict[str, Web3ProviderExt]) -> str:
             providers_to_str = {}
             for c in w3_providers:
-                providers_to_str[c] = w3_providers[c].w3.provider.endpoint_uri
+                providers_to_str[c] = [ep.url for ep in w3_providers[c].w3.provider.endpoints]
 
             return str(providers_to_str)
         
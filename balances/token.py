@@ -1,4 +1,5 @@
-from functools import cache
+from functools import cache, lru_cache
+from typing import Union
 
 from web3 import Web3
 
@@ -8,6 +9,45 @@ from utils.constants import BOB_TOKEN_ADDRESS
 
 from .web3 import Web3ProviderExt
 
+TRANSFER_TOPIC = Web3.keccak(text='Transfer(address,address,uint256)')
+
+def _as_bytes(value: Union[bytes, str]) -> bytes:
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:])
+    return value
+
+def _as_hex(value: Union[bytes, str]) -> str:
+    if isinstance(value, str):
+        return value.lower()
+    return '0x' + bytes.hex(value)
+
+def _as_int(value: Union[int, str]) -> int:
+    if isinstance(value, str):
+        return int(value, 16)
+    return value
+
+@lru_cache(maxsize=1000000)
+def _checksum_address(topic: bytes) -> str:
+    return Web3.toChecksumAddress(topic[-20:])
+
+def decode_transfer_log(_event) -> dict:
+    # ERC-20 Transfer has the fixed layout: `from` and `to` are the second
+    # and the third topics, `value` is the only word in data. It allows to
+    # avoid full ABI decoding done by web3's processLog
+    topics = _event['topics']
+    if (len(topics) != 3) or (_as_bytes(topics[0]) != TRANSFER_TOPIC):
+        raise ValueError('not an ERC-20 Transfer log')
+    return {
+        "logIndex": _as_int(_event['logIndex']),
+        "transactionIndex": _as_int(_event['transactionIndex']),
+        "transactionHash": _as_hex(_event['transactionHash']),
+        "blockHash": _as_hex(_event['blockHash']),
+        "blockNumber": _as_int(_event['blockNumber']),
+        "from": _checksum_address(_as_bytes(topics[1])),
+        "to": _checksum_address(_as_bytes(topics[2])),
+        "value": int.from_bytes(_as_bytes(_event['data']), 'big')
+    }
+
 @cache
 class BobTokenContract(ERC20Token):
     _transfer_filter: any
@@ -16,29 +56,48 @@ class BobTokenContract(ERC20Token):
         super().__init__(w3_provider, BOB_TOKEN_ADDRESS)
         self._transfer_filter = self.contract.events.Transfer.build_filter()
 
-    def process_transfer_log(self, _event):
-        pl = self.contract.events.Transfer().processLog(_event)
-        blockhash = Web3.toHex(pl.blockHash)
+    def process_transfer_log(self, _event, timestamps: dict = None):
+        try:
+            pl = decode_transfer_log(_event)
+        except ValueError:
+            pl = self._process_transfer_log_by_abi(_event)
+        blockhash = pl['blockHash']
         l = { 
             'tags': {
-                "logIndex": str(pl.logIndex),
-                "transactionIndex": str(pl.transactionIndex),
-                "transactionHash": Web3.toHex(pl.transactionHash),
+                "logIndex": str(pl['logIndex']),
+                "transactionIndex": str(pl['transactionIndex']),
+                "transactionHash": pl['transactionHash'],
                 "blockHash": blockhash,
-                "blockNumber": str(pl.blockNumber),
-                "from": pl.args['from'],
-                "to": pl.args['to']
+                "blockNumber": str(pl['blockNumber']),
+                "from": pl['from'],
+                "to": pl['to']
             },
             'fields': {
-                'value': pl.args['value']
+                'value': pl['value']
             },
             'methods': {
                 'denominate': self.normalize
             }
         }
-        l['timestamp'] = self.w3_provider.get_timestamp_by_blockhash(blockhash)
+        if timestamps and blockhash in timestamps:
+            l['timestamp'] = timestamps[blockhash]
+        else:
+            l['timestamp'] = self.w3_provider.get_timestamp_by_blockhash(blockhash)
         return l
 
+    def _process_transfer_log_by_abi(self, _event) -> dict:
+        pl = self.contract.events.Transfer().processLog(_event)
+        return {
+            "logIndex": pl.logIndex,
+            "transactionIndex": pl.transactionIndex,
+            "transactionHash": Web3.toHex(pl.transactionHash),
+            "blockHash": Web3.toHex(pl.blockHash),
+            "blockNumber": pl.blockNumber,
+            "from": pl.args['from'],
+            "to": pl.args['to'],
+            "value": pl.args['value']
+        }
+
     def get_transfer_logs(self, _from_block, _to_block):
         raw_logs, finish_block = self.w3_provider.get_logs(
             _from_block,
@@ -49,7 +108,10 @@ class BobTokenContract(ERC20Token):
         len_raw_logs = len(raw_logs)
         info(f"{self.w3_provider.chainid}: Found {len_raw_logs} of {self._transfer_filter.event_abi['name']} events")
         if len_raw_logs > 0:
-            logs = [self.process_transfer_log(e) for e in raw_logs]
+            timestamps = self.w3_provider.get_timestamps_by_blockhashes(
+                [_as_hex(e['blockHash']) for e in raw_logs]
+            )
+            logs = [self.process_transfer_log(e, timestamps) for e in raw_logs]
         else:
             logs = []
             
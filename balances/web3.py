@@ -1,50 +1,169 @@
-from functools import cache
-from typing import Tuple
+from typing import Tuple, Optional, Union, List
+
+from requests.exceptions import Timeout
 
 from utils.web3 import Web3Provider
-from utils.logging import info, debug
+from utils.logging import info, debug, warning
+from utils.ratelimit import is_rate_limited
+
+# substrings of provider errors meaning that the requested range is too wide
+# for a single eth_getLogs response
+RANGE_TOO_WIDE_ERRORS = [
+    'query returned more than',         # Infura, geth-based nodes
+    'log response size exceeded',       # Alchemy
+    'is limited to a',                  # QuickNode: "eth_getLogs is limited to a 10,000 range"
+    'exceed maximum block range',       # BSC, Ankr
+    'block range is too wide',
+    'block range is too large',
+    'block range too large',
+    'range is too large',
+    'query timeout exceeded'            # Erigon
+]
+
+def _is_range_too_wide(e: Exception) -> bool:
+    # throttled requests are repeated by the common retry policy
+    if is_rate_limited(e):
+        return False
+    if isinstance(e, Timeout):
+        return True
+    msg = str(e).lower()
+    for m in RANGE_TOO_WIDE_ERRORS:
+        if m in msg:
+            return True
+    return False
+
+class LogsRangeController:
+    # Window is the amount of blocks requested in addition to the first one,
+    # that is the same meaning as `history_block_range` has
+    _window: int
+    _max_window: int
+    _failed_window: Optional[int]
+    _successes: int
+    _logs_target: int
+
+    # amount of successful requests after that the refused width can be tried again
+    FAILURE_MEMORY = 100
+
+    def __init__(self, initial_window: int, max_window: int, logs_target: int):
+        self._window = max(initial_window, 0)
+        self._max_window = max(max_window, self._window)
+        self._failed_window = None
+        self._successes = 0
+        self._logs_target = logs_target
+
+    def window(self) -> int:
+        return self._window
+
+    def shrink(self) -> bool:
+        if self._window == 0:
+            return False
+        self._failed_window = self._window
+        self._successes = 0
+        self._window = self._window // 2
+        return True
+
+    def adjust(self, logs_found: int):
+        self._successes += 1
+        if self._successes > self.FAILURE_MEMORY:
+            self._failed_window = None
+        # the window grows only if the range was sparse and
+        # never reaches the width the provider refused to serve
+        if logs_found * 2 < self._logs_target:
+            limit = self._max_window
+            if self._failed_window != None:
+                # approach the refused width by halving the distance to it
+                limit = min(limit, (self._window + self._failed_window) // 2)
+            self._window = max(self._window, min(self._window * 2 + 1, limit))
+        elif logs_found > self._logs_target:
+            self._window = self._window // 2
 
 class Web3ProviderExt(Web3Provider):
     _finalization_delay: int
-    _block_range: int
+    _range: LogsRangeController
 
     def __init__(
         self,
         chainid: str,
-        url: str,
+        url: Union[str, List[str]],
         retry_attemtps: int,
         retry_delay: int,
         finalization_delay: int,
-        block_range_limit: int
+        block_range_limit: int,
+        timestamps_batch_size: int = 100,
+        max_block_range_limit: int = None,
+        logs_per_request_target: int = 2000,
+        timestamps_cache_dir: str = None,
+        timestamps_cache_size: int = 100000,
+        endpoint_failure_threshold: int = 3,
+        endpoint_eject_time: int = 60,
+        hedge_delay: float = 0,
+        rate_limit: float = 0,
+        rate_limit_burst: int = 10,
+        rate_limit_lock_dir: str = '',
+        responses_cache_dir: str = None,
+        responses_cache_memory_size: int = 64 * 1024 * 1024,
+        responses_cache_disk_size: int = 1024 * 1024 * 1024,
+        cassette_dir: str = None
     ):
-        super().__init__(chainid, url, retry_attemtps, retry_delay)
+        super().__init__(
+            chainid,
+            url,
+            retry_attemtps,
+            retry_delay,
+            timestamps_cache_dir,
+            timestamps_cache_size,
+            timestamps_batch_size,
+            endpoint_failure_threshold=endpoint_failure_threshold,
+            endpoint_eject_time=endpoint_eject_time,
+            hedge_delay=hedge_delay,
+            rate_limit=rate_limit,
+            rate_limit_burst=rate_limit_burst,
+            rate_limit_lock_dir=rate_limit_lock_dir,
+            finalization_delay=finalization_delay,
+            responses_cache_dir=responses_cache_dir,
+            responses_cache_memory_size=responses_cache_memory_size,
+            responses_cache_disk_size=responses_cache_disk_size,
+            cassette_dir=cassette_dir
+        )
         self._finalization_delay = finalization_delay
-        self._block_range = block_range_limit
+        if not max_block_range_limit:
+            max_block_range_limit = block_range_limit
+        self._range = LogsRangeController(block_range_limit, max_block_range_limit, logs_per_request_target)
 
     def get_logs(self, block_from: int, block_to: int, emitter: str, topics: list) -> Tuple[list, int]:
         info(f'{self.chainid}: Assuming to look for logs within [{block_from}, {block_to}]')
         start_block = block_from
-        finish_block = min(start_block + self._block_range, block_to)
-        if finish_block != block_to:
-            info(f'{self.chainid}: Looking for logs within a smaler range [{start_block}, {finish_block}]')
-        logs = self.make_call(
-            self.w3.eth.getLogs,
-            {
+        while True:
+            finish_block = min(start_block + self._range.window(), block_to)
+            if finish_block != block_to:
+                info(f'{self.chainid}: Looking for logs within a smaler range [{start_block}, {finish_block}]')
+            filter_params = {
                 'fromBlock': start_block, 
                 'toBlock': finish_block, 
                 'address': emitter, 
                 'topics': topics
             }
-        )
+            rejected = []
+            def request():
+                try:
+                    return self.w3.eth.getLogs(filter_params)
+                except Exception as e:
+                    # a too wide range is requested again with a narrower window,
+                    # other errors are handled by the common retry policy
+                    if _is_range_too_wide(e) and self._range.window() > 0:
+                        rejected.append(e)
+                        return None
+                    raise e
+            logs = self.make_call(request)
+            if len(rejected) > 0:
+                self._range.shrink()
+                warning(f'{self.chainid}: range [{start_block}, {finish_block}] rejected ({rejected[0]}), window reduced to {self._range.window()}')
+                continue
+            break
+        self._range.adjust(len(logs))
+        debug(f'{self.chainid}: logs window is {self._range.window()} blocks')
         return logs, finish_block
 
-    @cache
-    def get_timestamp_by_blockhash(self, blockhash: str) -> int:
-        debug(f'Getting timestamp for {blockhash}')
-        resp = self.make_call(self.w3.eth.get_block, blockhash).timestamp
-        debug(f'Timestamp {resp}')
-        return resp
-    
     def get_finalized_block(self) -> int:
         latest_block = self.make_call(self.w3.eth.get_block, 'latest').number
         return latest_block - self._finalization_delay
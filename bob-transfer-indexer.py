@@ -9,6 +9,7 @@ from utils.misc import every
 
 from balances.settings import Settings
 from balances.indexer import Indexer
+from balances.web3 import Web3ProviderExt
 
 class IndexerWorker:
     _chain: str
@@ -16,11 +17,13 @@ class IndexerWorker:
     _pull_interval: int
     _last_pull: int
     _head_achieved: bool
+    _w3prov: Web3ProviderExt
 
     def __init__(self, chainid: str, settings: Settings):
         self._chain = chainid
         self._indexer = Indexer(chainid, settings)
         self._pull_interval = settings.chains[chainid].events_pull_interval
+        self._w3prov = settings.w3_providers[chainid]
 
     def prepare(self):
         self._head_achieved = False
@@ -33,11 +36,17 @@ class IndexerWorker:
                 if not self._head_achieved:
                     info(f'{self._chain}: more historical events discovered, increasing pulling frequency')
                 self._last_pull = curtime
+                self._w3prov.timestamps.report()
+                self._w3prov.responses.report()
+                self._w3prov.report_endpoints()
         else:
             self._head_achieved = self._indexer.discover_balance_updates()[1]
             if self._head_achieved:
                 info(f'{self._chain}: historical events received, reducing pulling frequency')
                 self._last_pull = curtime
+            self._w3prov.timestamps.report()
+            self._w3prov.responses.report()
+            self._w3prov.report_endpoints()
 
 class BalancesIndexer():
     _workers: Dict[str, IndexerWorker]
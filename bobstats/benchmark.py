@@ -0,0 +1,141 @@
+from os import getenv, makedirs
+from os.path import exists
+
+from time import perf_counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from random import Random
+
+from tinyflux import TinyFlux, Point, TimeQuery
+
+from utils.logging import info, error
+from utils.constants import ONE_DAY
+from utils.tsdb import TINYFLUX_ENGINE, get_storage
+
+from bobstats.db import DBAdapter, _get_nearest_to_timespot, INVENTORY_FEES_TABLE, COMPOUNDING_INTEREST_TABLE
+
+# Compares lookups of the composed stats near a timespot done by scanning the
+# timeseries db (the approach used before) and through the in-memory time index.
+# The dbs with YEARS of measurements taken every MEASUREMENTS_INTERVAL seconds
+# for every of CHAINS are generated in TSDB_DIR unless they exist there already.
+# LOOKUPS random timespots are looked up by both approaches, SCAN_LOOKUPS of them
+# by scanning since it takes seconds per lookup on large dbs.
+
+TSDB_DIR = getenv('TSDB_DIR', 'tsdb-benchmark')
+YEARS = int(getenv('YEARS', 3))
+MEASUREMENTS_INTERVAL = int(getenv('MEASUREMENTS_INTERVAL', 60 * 60 * 2))
+CHAINS = getenv('CHAINS', 'pol,opt,eth,arb1,bsc').split(',')
+LOOKUPS = int(getenv('LOOKUPS', 1000))
+SCAN_LOOKUPS = int(getenv('SCAN_LOOKUPS', 10))
+START_TS = 1640995200
+
+def generate_dbs(settings: SimpleNamespace):
+    composed_fn = f'{settings.tsdb_dir}/{settings.bob_composed_stat_db}'
+    yield_fn = f'{settings.tsdb_dir}/{settings.bob_composed_fees_stat_db}'
+    if exists(composed_fn) and exists(yield_fn):
+        info(f'Using existing dbs in {settings.tsdb_dir}')
+        return
+    makedirs(settings.tsdb_dir, exist_ok=True)
+    rnd = Random(1)
+    main_points = []
+    yield_points = []
+    for ts in range(START_TS, START_TS + YEARS * 365 * ONE_DAY, MEASUREMENTS_INTERVAL):
+        # measurements take some time so points do not fall on exact intervals
+        dt = datetime.fromtimestamp(ts + rnd.randrange(60), timezone.utc)
+        for chain in CHAINS:
+            main_points.append(Point(time=dt, tags={'chain': chain}, fields={
+                'totalSupply': rnd.uniform(10 ** 6, 10 ** 7),
+                'colCirculatingSupply': rnd.uniform(10 ** 6, 10 ** 7),
+                'volumeUSD': rnd.uniform(0, 10 ** 6),
+                'holders': rnd.randrange(1000, 10000)
+            }))
+            yield_points.append(Point(measurement=INVENTORY_FEES_TABLE, time=dt, tags={'chain': chain}, fields={
+                'BOB': rnd.uniform(0, 1000), 'USDC': rnd.uniform(0, 1000)
+            }))
+            yield_points.append(Point(measurement=COMPOUNDING_INTEREST_TABLE, time=dt, tags={'chain': chain}, fields={
+                'USDC': rnd.uniform(0, 1000)
+            }))
+    info(f'Generating {len(main_points)} composed stats points and {len(yield_points)} yield points')
+    with TinyFlux(composed_fn) as db:
+        db.insert_multiple(main_points)
+    with TinyFlux(yield_fn) as db:
+        db.insert_multiple(yield_points)
+
+def scanning_get_nearest_to_timespot(
+        tsdb_fn: str,
+        required_ts: int,
+        exploration_step: int,
+        table: str = "_default"
+) -> list:
+    exploration_half_range = exploration_step
+    with TinyFlux(tsdb_fn) as dbase:
+        qtime = TimeQuery()
+        toi = dbase.measurement(table)
+        earliest_point = None
+        for point in toi:
+            earliest_point = point.time
+            break
+        if not earliest_point:
+            return []
+        while True:
+            left_dt = datetime.fromtimestamp(required_ts - exploration_half_range)
+            right_dt = datetime.fromtimestamp(required_ts + exploration_half_range)
+            query_left = qtime >= left_dt
+            query_right = qtime <= right_dt
+            if toi.contains(query_left & query_right):
+                break
+            if right_dt.astimezone(earliest_point.tzinfo) < earliest_point:
+                return []
+            exploration_half_range = exploration_half_range + exploration_step
+        suitable_time = 0
+        for p in toi.search(query_left & query_right):
+            p_ts = datetime.timestamp(p.time)
+            if abs(required_ts - p_ts) < abs(required_ts - suitable_time) and \
+                abs(required_ts - p_ts) < ONE_DAY // 2:
+                suitable_time = p_ts
+        if suitable_time == 0:
+            return []
+        return toi.search(qtime == datetime.fromtimestamp(suitable_time))
+
+def measure(name: str, func, timespots: list) -> list:
+    start = perf_counter()
+    results = [func(ts) for ts in timespots]
+    duration = perf_counter() - start
+    info(f'{name}: {len(timespots)} lookups in {duration:.3f} secs, {duration / max(len(timespots), 1) * 1000:.3f} msecs per lookup')
+    return results
+
+def as_comparable(points: list) -> list:
+    return sorted([(p.time, p.tags['chain'], sorted(p.fields.items())) for p in points], key=lambda p: p[1])
+
+if __name__ == '__main__':
+    settings = SimpleNamespace(
+        tsdb_dir=TSDB_DIR,
+        bob_composed_stat_db='bobstat_composed.csv',
+        bob_composed_fees_stat_db='bobstat_comp_yield.csv',
+        tsdb_engine=TINYFLUX_ENGINE,
+        measurements_interval=MEASUREMENTS_INTERVAL - 30
+    )
+    generate_dbs(settings)
+    composed_fn = f'{settings.tsdb_dir}/{settings.bob_composed_stat_db}'
+    composed_db = get_storage(composed_fn, settings.tsdb_engine)
+    step = settings.measurements_interval // 2
+
+    rnd = Random(2)
+    # some timespots are out of the stored interval on purpose
+    timespots = [rnd.randrange(START_TS - ONE_DAY, START_TS + YEARS * 365 * ONE_DAY + ONE_DAY) for _ in range(LOOKUPS)]
+
+    start = perf_counter()
+    _get_nearest_to_timespot(composed_db, timespots[0], step)
+    info(f'Time index built in {perf_counter() - start:.3f} secs')
+
+    scanned = measure('scanning', lambda ts: scanning_get_nearest_to_timespot(composed_fn, ts, step), timespots[:SCAN_LOOKUPS])
+    indexed = measure('time index', lambda ts: _get_nearest_to_timespot(composed_db, ts, step), timespots)
+    mismatches = [timespots[i] for i in range(len(scanned)) if as_comparable(scanned[i]) != as_comparable(indexed[i])]
+    if len(mismatches) > 0:
+        error(f'Results differ for timespots {mismatches}')
+    else:
+        info(f'Results match for {len(scanned)} timespots')
+
+    db = DBAdapter(settings)
+    measure('composed stats with yield', db.get_nearest_to_timespot, timespots)
@@ -5,10 +5,11 @@ from dataclasses import dataclass
 from time import gmtime, strftime
 from datetime import datetime
 
-from tinyflux import TinyFlux, Point, TimeQuery
+from tinyflux import Point
 
 from utils.logging import info, error
-from utils.constants import ONE_DAY, ZERO_DATETIME
+from utils.constants import ONE_DAY
+from utils.tsdb import SeriesStorage, get_storage
 
 from .settings import Settings
 from .common import StatsByChains, ChainStats, GainStats, YieldSet, OneTokenAcc
@@ -95,116 +96,77 @@ def _find_datapoint_by_chain(dpts: List[Point], chain: str) -> Union[Point, None
             break
     return retval
 
-def _is_empty(tsdb_fn: str) -> bool:
-    retval = True
-    with TinyFlux(tsdb_fn) as dbase:
-        qtime = TimeQuery()
-        if dbase.contains(qtime > ZERO_DATETIME):
-            retval = False
-    return retval
-
 def _get_nearest_to_timespot(
-        tsdb_fn: str,
+        tsdb: SeriesStorage,
         required_ts: int,
         exploration_step: int,
         table: str = "_default"
 ) -> List[Point]:
+    tsdb_fn = tsdb.filename
     info(f"db:{tsdb_fn}: looking for data points near {strftime('%Y-%m-%d %H:%M:%S', gmtime(required_ts))}")
-    exploration_half_range = exploration_step
 
-    dpts = []
-
-    if _is_empty(tsdb_fn):
+    if tsdb.empty():
         error(f'db:{tsdb_fn}: database does not contain points')
         return []
-    
-    with TinyFlux(tsdb_fn) as dbase:
-        qtime = TimeQuery()
-        
-        toi = dbase.measurement(table)
-        earliest_point = None
-        for point in toi:
-            # assuming that points are inserted chronologically
-            earliest_point = point.time
-            break
-        if not earliest_point:
-            error(f'db:{tsdb_fn}: database does not contain points for {table}')
-            return []
-
-        while True:
-            left_dt = required_ts - exploration_half_range
-            right_dt = required_ts + exploration_half_range
-            info(f"db:{tsdb_fn}: data points extending exploration interval is {strftime('%Y-%m-%d %H:%M:%S', gmtime(left_dt))} - {strftime('%Y-%m-%d %H:%M:%S', gmtime(right_dt))}")
-            left_dt = datetime.fromtimestamp(left_dt)
-            right_dt = datetime.fromtimestamp(right_dt)
-
-            query_left = qtime >= left_dt
-            query_right = qtime <= right_dt
-            if toi.contains(query_left & query_right):
-                break
 
-            if right_dt.astimezone(earliest_point.tzinfo) < earliest_point:
-                error(f'db:{tsdb_fn}: all points are after required timespot')
-                return []
+    earliest_point = tsdb.earliest(table)
+    if earliest_point == None:
+        error(f'db:{tsdb_fn}: database does not contain points for {table}')
+        return []
 
-            exploration_half_range = exploration_half_range + exploration_step
+    if required_ts + exploration_step < earliest_point:
+        error(f'db:{tsdb_fn}: all points are after required timespot')
+        return []
 
-        points = toi.search(query_left & query_right)
-        suitable_time = 0
-        # if there are two sets of points in the time interval
-        # it is necessary to choose the set closest to the required timespot
-        for p in points:
-            p_ts = datetime.timestamp(p.time)
-            if abs(required_ts - p_ts) < abs(required_ts - suitable_time) and \
-                abs(required_ts - p_ts) < ONE_DAY // 2:
-                suitable_time = p_ts
+    suitable_time = tsdb.nearest(table, required_ts)
+    if abs(required_ts - suitable_time) >= ONE_DAY // 2:
+        error(f'db:{tsdb_fn}: found data points are out 12 hrs threshold')
+        return []
 
-        if suitable_time == 0:
-            error(f'db:{tsdb_fn}: found data points are out 12 hrs threshold')
-            return []
-            
-        dpts = toi.search(qtime == datetime.fromtimestamp(suitable_time))
-        info(f"db:{tsdb_fn}: found {len(dpts)} records at {strftime('%Y-%m-%d %H:%M:%S', gmtime(suitable_time))}")
+    dpts = tsdb.points_at(table, suitable_time)
+    info(f"db:{tsdb_fn}: found {len(dpts)} records at {strftime('%Y-%m-%d %H:%M:%S', gmtime(suitable_time))}")
     return dpts
 
 def _find_exact_or_nearest(
-        tsdb_fn: str,
+        tsdb: SeriesStorage,
         required_ts: int,
         exploration_step: int,
         table: str = "_default"
 ) -> List[Point]:
-    suitable_time = datetime.fromtimestamp(required_ts)
+    tsdb_fn = tsdb.filename
 
     dpts = []
-    if _is_empty(tsdb_fn):
+    if tsdb.empty():
         error(f'db:{tsdb_fn}: database does not contain points')
     else:
-        with TinyFlux(tsdb_fn) as dbase:
-            qtime = TimeQuery()
-            
-            toi = dbase.measurement(table)
-            dpts = toi.search(qtime == suitable_time)
-
-            if len(dpts) == 0:
-                dpts = _get_nearest_to_timespot(
-                    tsdb_fn,
-                    required_ts,
-                    exploration_step,
-                    table = table,
-                )
-            else:
-                info(f"db:{tsdb_fn}: found {len(dpts)} records at {suitable_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        dpts = tsdb.points_at(table, required_ts)
+
+        if len(dpts) == 0:
+            dpts = _get_nearest_to_timespot(
+                tsdb,
+                required_ts,
+                exploration_step,
+                table = table,
+            )
+        else:
+            info(f"db:{tsdb_fn}: found {len(dpts)} records at {strftime('%Y-%m-%d %H:%M:%S', gmtime(required_ts))}")
     return dpts
 
 class DBAdapter:
-    _composed_stats_filename: str
-    _composed_fee_stats_filename: str
+    _composed_stats: SeriesStorage
+    _composed_fee_stats: SeriesStorage
     _measurements_range: int
 
     def __init__(self, settings: Settings):
         self._measurements_range = settings.measurements_interval
-        self._composed_stats_filename = settings.tsdb_dir + '/' + settings.bob_composed_stat_db
-        self._composed_fee_stats_filename = settings.tsdb_dir + '/' + settings.bob_composed_fees_stat_db
+        self._composed_stats = get_storage(
+            settings.tsdb_dir + '/' + settings.bob_composed_stat_db,
+            settings.tsdb_engine
+        )
+        self._composed_fee_stats = get_storage(
+            settings.tsdb_dir + '/' + settings.bob_composed_fees_stat_db,
+            settings.tsdb_engine
+        )
 
     def store(self, stats: StatsByChains):
         info('db: storing data to timeseries db')
@@ -219,17 +181,15 @@ class DBAdapter:
                 comp_yield_points.append(stats_dps.interest)
 
         if len(composed_points) > 0:
-            with TinyFlux(self._composed_stats_filename) as composed_db:
-                composed_db.insert_multiple(composed_points)
+            self._composed_stats.insert(composed_points)
         if len(comp_yield_points) > 0:
-            with TinyFlux(self._composed_fee_stats_filename) as comp_fees_db:
-                comp_fees_db.insert_multiple(comp_yield_points)
+            self._composed_fee_stats.insert(comp_yield_points)
 
         info('db: timeseries db updated successfully')
 
     def get_nearest_to_timespot(self, required_ts: int) -> StatsByChains:
         dpts = _get_nearest_to_timespot(
-            self._composed_stats_filename,
+            self._composed_stats,
             required_ts,
             self._measurements_range // 2
         )
@@ -238,13 +198,13 @@ class DBAdapter:
         interest_dpts = []
         if len(dpts) > 0:
             fees_dpts = _find_exact_or_nearest(
-                self._composed_fee_stats_filename,
+                self._composed_fee_stats,
                 datetime.timestamp(dpts[0].time),
                 self._measurements_range // 2,
                 table = INVENTORY_FEES_TABLE
             )
             interest_dpts = _find_exact_or_nearest(
-                self._composed_fee_stats_filename,
+                self._composed_fee_stats,
                 datetime.timestamp(dpts[0].time),
                 self._measurements_range // 2,
                 table = COMPOUNDING_INTEREST_TABLE
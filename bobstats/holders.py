@@ -11,31 +11,26 @@ from balances.db.adapter import DBAdapter
 from balances.db.models import DBAConfig
 
 class Holders:
-    _chains: Dict[str, int]
-    _snapshot_dir: str
-    _file_suffix: str
+    _dbs: Dict[str, DBAdapter]
 
     def __init__(self, settings: Settings):
-        self._snapshot_dir = settings.snapshot_dir
-        self._file_suffix = settings.balances_snapshot_file_suffix
-        self._chains = {}
+        self._dbs = {}
         for ch in settings.chains:
-            self._chains[ch] = settings.chains[ch].token.start_block
+            self._dbs[ch] = DBAdapter(DBAConfig(
+                chainid=ch,
+                snapshot_dir=settings.snapshot_dir,
+                snapshot_file_suffix=settings.balances_snapshot_file_suffix,
+                init_block=settings.chains[ch].token.start_block
+            ))
 
     def get_bob_holders_amount(self) -> Dict[str, int]:
-        # Due to disk IO operations to read big (potentially) blob of data it does not
-        # make sense to read files in separate threads to preserve consequent reads of
-        # data blocks
+        # The amount of holders is read from the metadata record maintained
+        # by the balances indexer, the snapshot itself is read only if the
+        # record does not exist yet
         ret = {}
         info(f'Getting amounf of token holders for {BOB_TOKEN_ADDRESS}')
-        for chainid in self._chains:
-            db = DBAdapter(DBAConfig(
-                chainid=chainid,
-                snapshot_dir=self._snapshot_dir,
-                snapshot_file_suffix=self._file_suffix,
-                init_block=self._chains[chainid]
-            ))
-            holders_num = db.get_holders_count()
+        for chainid in self._dbs:
+            holders_num = self._dbs[chainid].get_holders_count()
             info(f'{chainid}: number of token holders {holders_num}')
             ret[chainid] = holders_num
         return ret
\ No newline at end of file
@@ -102,7 +102,11 @@ class InterestStats:
                         settings.chains[chainid].rpc.history_block_range
                     ),
                     w3prov=settings.w3_providers[chainid],
-                    db=DBAdapter(poolid, f'{settings.tsdb_dir}/{poolid}-{settings.bobvault_fees_db_suffix}')
+                    db=DBAdapter(
+                        poolid,
+                        f'{settings.tsdb_dir}/{poolid}-{settings.bobvault_fees_db_suffix}',
+                        settings.tsdb_engine
+                    )
                 )
 
             self._discovery_step = settings.measurements_interval
@@ -122,23 +126,26 @@ class InterestStats:
 
             tokens = _get_bobvault_tokens(self._vaults[ch].registrar_fn, log_prefix)
             
-            for t in tokens:
+            collaterals = bv_contract.get_collaterals_and_stats(
+                [t for t in tokens if t != BOB_TOKEN_ADDRESS]
+            )
+            for t in collaterals:
                 symbol = tokens[t]
-                if t != BOB_TOKEN_ADDRESS:
-                    if bv_contract.get_collateral(t).yield_addr != ZERO_ADDRESS:
-                        farmed = bv_contract.get_stat(t).farmed
-                        if farmed > 0:
-                            fees = _get_fees(dba, curtime, self._discovery_step, log_prefix)
-                            # it is possible to get interest only if fees amount is known
-                            if len(fees) > 0:
-                                token_fees = _get_fees_for_token(fees, symbol)
-                                if token_fees:
-                                    interest = ERC20Token(w3prov, t).normalize(farmed) - token_fees
-                                    info(f'{log_prefix}: {symbol}: {interest}')
-                                    retval[ch][poolid].append(OneTokenAcc(
-                                        symbol=symbol,
-                                        amount=interest
-                                    ))
-                                else:
-                                    error(f'{log_prefix}: no fees found for {symbol}')
+                (collateral, stat) = collaterals[t]
+                if collateral.yield_addr != ZERO_ADDRESS:
+                    farmed = stat.farmed
+                    if farmed > 0:
+                        fees = _get_fees(dba, curtime, self._discovery_step, log_prefix)
+                        # it is possible to get interest only if fees amount is known
+                        if len(fees) > 0:
+                            token_fees = _get_fees_for_token(fees, symbol)
+                            if token_fees:
+                                interest = ERC20Token(w3prov, t).normalize(farmed) - token_fees
+                                info(f'{log_prefix}: {symbol}: {interest}')
+                                retval[ch][poolid].append(OneTokenAcc(
+                                    symbol=symbol,
+                                    amount=interest
+                                ))
+                            else:
+                                error(f'{log_prefix}: no fees found for {symbol}')
         return retval
\ No newline at end of file
@@ -15,12 +15,13 @@ from utils.web3 import Web3Provider, CachedERC20Token as ERC20Token
 from utils.settings.models import BobVaultInventory
 from utils.constants import BOB_TOKEN_ADDRESS
 from utils.logging import info, error
+from utils.tsdb import TINYFLUX_ENGINE
 
 from .common import BaseInventoryStats, InventoryHandler, BobVaultInventoryStats
 
 class DBAdapter(DBGenericAdapter):
-    def __init__(self, pool_id: str, full_fn: str):
-        super().__init__()
+    def __init__(self, pool_id: str, full_fn: str, tsdb_engine: str = TINYFLUX_ENGINE):
+        super().__init__(tsdb_engine)
         self._pool_id = pool_id
         self._log_prefix = f'db:{pool_id}'
         self._fees_stats_filename = full_fn
@@ -41,7 +42,11 @@ class BobVaultInventoryHandler(InventoryHandler):
         self.w3prov = w3_provider
         self.vault_addr = vault_addr
         self.pool_id = poolid
-        self._db = DBAdapter(poolid, f'{settings.tsdb_dir}/{poolid}-{settings.bobvault_fees_db_suffix}')
+        self._db = DBAdapter(
+            poolid,
+            f'{settings.tsdb_dir}/{poolid}-{settings.bobvault_fees_db_suffix}',
+            settings.tsdb_engine
+        )
         self._db.discover_time_of_latest_point(settings.measurements_interval)
 
     @classmethod
@@ -0,0 +1,87 @@
+import os
+
+from functools import cache
+from typing import Dict, List, Optional
+from pydantic import BaseModel, validator
+
+from json import dump
+
+from threading import Lock
+
+from utils.logging import info, error
+
+class OwnerPositions(BaseModel):
+    # ids of positions owned at last_block
+    last_block: int = -1
+    positions: List[int] = []
+
+    @validator('positions', pre=True)
+    def ids_only(cls, v):
+        # catalogs saved before kept details of positions keyed by ids
+        if isinstance(v, dict):
+            return [int(pos_id) for pos_id in v]
+        return v
+
+class PositionsCatalogData(BaseModel):
+    # keys are '<positions manager>/<owner>'
+    owners: Dict[str, OwnerPositions] = {}
+    # keys are '<positions manager>/<token0>/<token1>/<fee>'
+    pools: Dict[str, str] = {}
+
+@cache
+class PositionsCatalog:
+    # Ids of LP positions owned by the inventory owners and addresses of the
+    # pools, which never change, persisted between measurement cycles. Details
+    # of positions are not kept since liquidity and fees are read by the same
+    # call as the rest of them
+    _chainid: str
+    _full_filename: str
+    _data: PositionsCatalogData
+    _lock: Lock
+
+    def __init__(self, chainid: str, snapshot_dir: str, catalog_suffix: str):
+        self._chainid = chainid
+        self._full_filename = f'{snapshot_dir}/{chainid}-{catalog_suffix}'
+        self._lock = Lock()
+        self._data = self._load()
+
+    def _load(self) -> PositionsCatalogData:
+        info(f'{self._chainid}: looking for positions catalog {self._full_filename}')
+        try:
+            data = PositionsCatalogData.parse_file(self._full_filename)
+        except IOError:
+            info(f'{self._chainid}: positions catalog not found')
+            data = PositionsCatalogData()
+        except Exception as e:
+            error(f'{self._chainid}: cannot load positions catalog: {e}')
+            data = PositionsCatalogData()
+        return data
+
+    def save(self):
+        with self._lock:
+            tmp_fn = f'{self._full_filename}.tmp'
+            try:
+                with open(tmp_fn, 'w') as json_file:
+                    dump(self._data.dict(), json_file)
+                os.replace(tmp_fn, self._full_filename)
+            except Exception as e:
+                error(f'{self._chainid}: cannot save positions catalog: {e}')
+
+    def get_owner(self, pos_manager: str, owner: str) -> OwnerPositions:
+        with self._lock:
+            return self._data.owners.setdefault(f'{pos_manager}/{owner}', OwnerPositions(positions=[]))
+
+    def reset_owner(self, pos_manager: str, owner: str, pos_ids: List[int], last_block: int):
+        with self._lock:
+            self._data.owners[f'{pos_manager}/{owner}'] = OwnerPositions(
+                last_block=last_block,
+                positions=pos_ids
+            )
+
+    def get_pool(self, pos_manager: str, pool_key: tuple) -> Optional[str]:
+        with self._lock:
+            return self._data.pools.get('/'.join([pos_manager] + [str(k) for k in pool_key]))
+
+    def set_pool(self, pos_manager: str, pool_key: tuple, pool: str):
+        with self._lock:
+            self._data.pools['/'.join([pos_manager] + [str(k) for k in pool_key])] = pool
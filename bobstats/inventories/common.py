@@ -1,28 +1,62 @@
+from abc import ABC, abstractmethod
+
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 from decimal import Decimal
 
 from web3 import Web3
+from web3.eth import Contract
 
 from bobstats.settings import Settings
 
-from utils.web3 import Web3Provider, CachedERC20Token as ERC20Token
+from utils.web3 import Web3Provider, CachedERC20Token as ERC20Token, prefetch_tokens_info
 from utils.settings.models import UniswapLikeInventory
-from utils.logging import error
+from utils.logging import info, error, warning
+from utils.abi import get_abi, ABI
+
+from .catalog import PositionsCatalog
+
+# TVL and fees of positions are taken from the simulated calls of the positions
+# manager or calculated off-chain from the state of the pools
+SIMULATION_ENGINE = 'simulation'
+TICKMATH_ENGINE = 'tickmath'
+
+NFT_TRANSFER_TOPIC = Web3.toHex(Web3.keccak(text='Transfer(address,address,uint256)'))
+# positions are enumerated again if the catalog is behind the chain
+# for more than this number of getLogs windows
+MAX_TRANSFERS_WINDOWS = 10
 
 def fields_as_list(model: BaseModel) -> List[str]:
     return list(model.schema()['properties'].keys())
 
-class Position:
+class Position(ABC):
     pos_id: int
     token0_addr: str
     token1_addr: str
     fee: int
+    liquidity: int
+    tickLower: int
+    tickUpper: int
     token0_tvl: int = 0
     token1_tvl: int = 0
     token0_fees: int = 0 
     token1_fees: int = 0
 
+    def pool_key(self) -> tuple:
+        return (self.token0_addr, self.token1_addr, self.fee)
+
+    @abstractmethod
+    def positions_call(self):
+        pass
+
+    @abstractmethod
+    def set_raw_details(self, position_details: list):
+        pass
+
+    @abstractmethod
+    def apply_tickmath(self, pool_state: BaseModel):
+        pass
+
 class BaseInventoryStats(BaseModel):
     symbol: str
     tvl: Decimal
@@ -38,12 +72,179 @@ class BobVaultInventoryStats(BaseModel):
 class InventoryHolderStats(BaseModel):
     token0: BaseInventoryStats
 
-class UniswapLikePositionsManager:
+class UniswapLikePositionsManager(ABC):
+    w3prov: Web3Provider
+    owner: str
+    pm: Contract
     postions: List[Position] = []
     fee_denominator: int = 0
+    engine: str = SIMULATION_ENGINE
+    catalog: Optional[PositionsCatalog] = None
+    block_range: int = 0
+    protocol: str = ''
+    factory_abi: ABI
+    pool_abi: ABI
+    _factory: Optional[Contract]
+    _pools: Dict[tuple, Contract]
+
+    @abstractmethod
+    def new_position(self, pos_id: int) -> Position:
+        pass
+
+    @abstractmethod
+    def simulate(self, positions: List[Position], bn: int):
+        pass
+
+    @abstractmethod
+    def get_pools_states(self, positions: List[Position], bn: int) -> dict:
+        # states of pools required to calculate TVL and fees of positions off-chain
+        # keyed by Position.pool_key()
+        pass
+
+    def _enumerate_positions(self, bn: int) -> List[int]:
+        pos_num = self.w3prov.make_call(self.pm.functions.balanceOf(self.owner).call, block_identifier=bn)
+
+        info(f'{self.w3prov.chainid}: found {pos_num} positions at block {bn}')
+
+        pos_ids = self.w3prov.make_multicall(
+            [self.pm.functions.tokenOfOwnerByIndex(self.owner, i) for i in range(pos_num)],
+            bn
+        )
+        if None in pos_ids:
+            raise Exception(f'not able to get ids of positions for owner {self.owner}')
+        return pos_ids
+
+    def _get_transfers(self, from_block: int, to_block: int) -> list:
+        # NFT transfers from and to the owner
+        owner_topic = '0x' + '0' * 24 + self.owner[2:].lower()
+        logs = {}
+        for start_block in range(from_block, to_block + 1, self.block_range + 1):
+            finish_block = min(start_block + self.block_range, to_block)
+            for topics in ([NFT_TRANSFER_TOPIC, owner_topic], [NFT_TRANSFER_TOPIC, None, owner_topic]):
+                window_logs = self.w3prov.make_call(
+                    self.w3prov.w3.eth.getLogs,
+                    {
+                        'fromBlock': start_block,
+                        'toBlock': finish_block,
+                        'address': self.pm.address,
+                        'topics': topics
+                    }
+                )
+                # transfers to itself are found by both filters
+                for l in window_logs:
+                    logs[(l['blockNumber'], l['logIndex'])] = l
+        return [logs[k] for k in sorted(logs)]
+
+    def _get_pos_ids(self, bn: int) -> List[int]:
+        if self.catalog == None:
+            return self._enumerate_positions(bn)
+
+        entry = self.catalog.get_owner(self.pm.address, self.owner)
+        if entry.last_block == -1 or entry.last_block > bn or \
+           bn - entry.last_block > MAX_TRANSFERS_WINDOWS * (self.block_range + 1):
+            pos_ids = self._enumerate_positions(bn)
+            self.catalog.reset_owner(self.pm.address, self.owner, pos_ids, bn)
+            return pos_ids
+
+        try:
+            transfers = self._get_transfers(entry.last_block + 1, bn)
+        except Exception as e:
+            error(f'{self.w3prov.chainid}: not able to get transfers of positions: {e}')
+            pos_ids = self._enumerate_positions(bn)
+            self.catalog.reset_owner(self.pm.address, self.owner, pos_ids, bn)
+            return pos_ids
+
+        pos_ids = list(entry.positions)
+        owner = self.owner.lower()
+        for l in transfers:
+            pos_id = int.from_bytes(l['topics'][3], 'big')
+            if Web3.toHex(l['topics'][1][-20:]) == owner and pos_id in pos_ids:
+                pos_ids.remove(pos_id)
+            if Web3.toHex(l['topics'][2][-20:]) == owner and not pos_id in pos_ids:
+                pos_ids.append(pos_id)
+        info(f'{self.w3prov.chainid}: {len(transfers)} transfers of positions within [{entry.last_block + 1}, {bn}], {len(pos_ids)} positions owned')
+        self.catalog.reset_owner(self.pm.address, self.owner, pos_ids, bn)
+        return pos_ids
+
+    def get_raw_postions(self, bn: int, verified: bool = False) -> List[Position]:
+        # positions of the owner with non-zero liquidity and their details filled.
+        # The number of positions is read together with the positions details to
+        # check that the catalog is consistent with the chain
+        info(f'{self.w3prov.chainid}: getting {self.protocol} positions for owner {self.owner}')
+
+        pos_ids = self._get_pos_ids(bn)
+        positions = [self.new_position(pos_id) for pos_id in pos_ids]
+
+        resps = self.w3prov.make_multicall(
+            [self.pm.functions.balanceOf(self.owner)] + [pos.positions_call() for pos in positions],
+            bn
+        )
+        if None in resps:
+            raise Exception(f'not able to get details of positions for owner {self.owner}')
+        if resps[0] != len(pos_ids):
+            if verified or self.catalog == None:
+                raise Exception(f'number of positions for owner {self.owner} changed while reading them')
+            warning(f'{self.w3prov.chainid}: positions catalog is inconsistent for {self.owner}, enumerating positions')
+            self.catalog.reset_owner(self.pm.address, self.owner, [], -1)
+            return self.get_raw_postions(bn, True)
+
+        retval = []
+        for (pos, position_details) in zip(positions, resps[1:]):
+            pos.set_raw_details(position_details)
+            if pos.liquidity == 0:
+                info(f'{self.w3prov.chainid}: position {pos.pos_id} does not contain liquidity')
+                continue
+            retval.append(pos)
+        if self.catalog:
+            self.catalog.save()
+        return retval
+
+    def get_factory(self) -> Contract:
+        if self._factory == None:
+            factory_addr = self.w3prov.make_call(self.pm.functions.factory().call)
+            self._factory = self.w3prov.w3.eth.contract(abi = get_abi(self.factory_abi), address = factory_addr)
+        return self._factory
+
+    def get_pools(self, keys: List[tuple], bn: int) -> Dict[tuple, Contract]:
+        # addresses of pools never change so they are requested once
+        unknown = []
+        for k in keys:
+            if not k in self._pools:
+                pool_addr = self.catalog.get_pool(self.pm.address, k) if self.catalog else None
+                if pool_addr:
+                    self._pools[k] = self.w3prov.w3.eth.contract(abi = get_abi(self.pool_abi), address = pool_addr)
+                else:
+                    unknown.append(k)
+        if len(unknown) > 0:
+            factory = self.get_factory()
+            addresses = self.w3prov.make_multicall([factory.functions.getPool(*k) for k in unknown], bn)
+            for (k, pool_addr) in zip(unknown, addresses):
+                if pool_addr == None:
+                    raise Exception(f'not able to get pool for {k}')
+                self._pools[k] = self.w3prov.w3.eth.contract(abi = get_abi(self.pool_abi), address = pool_addr)
+                if self.catalog:
+                    self.catalog.set_pool(self.pm.address, k, pool_addr)
+            if self.catalog:
+                self.catalog.save()
+        return {k: self._pools[k] for k in keys}
+
+    def get_postions(self):
+        # all reads are pinned to the same block
+        bn = self.w3prov.make_call(self.w3prov.w3.eth.get_block_number)
+        positions = self.get_raw_postions(bn)
+        if len(positions) > 0:
+            if self.engine == TICKMATH_ENGINE:
+                pools_states = self.get_pools_states(positions, bn)
+                for pos in positions:
+                    pos.apply_tickmath(pools_states[pos.pool_key()])
+            else:
+                self.simulate(positions, bn)
+        self.postions = positions
 
     def inventory_stats(self) -> dict:
         pairs = {}
+        prefetch_tokens_info([ERC20Token(self.w3prov, addr) for addr in
+                              dict.fromkeys([a for pos in self.postions for a in (pos.token0_addr, pos.token1_addr)])])
         for pos in self.postions:
 
             token0 = ERC20Token(self.w3prov, pos.token0_addr)
@@ -79,22 +280,37 @@ class UniswapLikeInventoryHandler(InventoryHandler):
     w3prov: Web3
     pm_addr: str
     owner: str
+    engine: str
+    catalog: Optional[PositionsCatalog]
+    block_range: int
 
     def __init__(
         self,
         w3_provider: Web3Provider,
         position_manager: str,
-        position_owner: str
+        position_owner: str,
+        engine: str = SIMULATION_ENGINE,
+        catalog: PositionsCatalog = None,
+        block_range: int = 0
     ):
         self.w3prov = w3_provider
         self.pm_addr = position_manager
         self.owner = position_owner
+        self.engine = engine
+        self.catalog = catalog
+        self.block_range = block_range
 
     @classmethod
-    def generate_handler(cls, w3: Web3Provider, params: UniswapLikeInventory, _: Settings):
+    def generate_handler(cls, w3: Web3Provider, params: UniswapLikeInventory, settings: Settings):
         pm = Web3.toChecksumAddress(params.pos_manager)
         ow = Web3.toChecksumAddress(params.owner)
-        return cls(w3, pm, ow)
+        engine = params.engine if params.engine else SIMULATION_ENGINE
+        if not engine in (SIMULATION_ENGINE, TICKMATH_ENGINE):
+            raise ValueError(f'unknown positions engine {engine}')
+        info(f'{w3.chainid}: positions of {ow} are handled by {engine} engine')
+        catalog = PositionsCatalog(w3.chainid, settings.snapshot_dir, settings.positions_catalog_file_suffix)
+        block_range = settings.chains[w3.chainid].rpc.history_block_range
+        return cls(w3, pm, ow, engine, catalog, block_range)
 
     def _get_stats(self, manager: UniswapLikePositionsManager) -> Dict[str, UniswapLikeInventoryStats]:
         inventory_stats = {}
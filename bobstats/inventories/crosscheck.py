@@ -0,0 +1,102 @@
+from os import getenv, listdir
+
+from json import load, dump
+
+from utils.logging import info, error
+
+from . import uniswap, kyberswap
+
+# Cross-check of the off-chain tick math against the simulated calls of
+# the positions managers.
+#
+# CROSSCHECK=record reads positions of all UniswapV3 and KyberSwap Elastic
+# inventories configured for bobstats, the states of their pools and the results
+# of the simulated calls at the same block and stores them as fixtures to
+# FIXTURES_DIR.
+#
+# CROSSCHECK=check (default) recalculates TVL and fees of every recorded position
+# with the tick math and reports the positions where results differ.
+
+CROSSCHECK = getenv('CROSSCHECK', 'check')
+FIXTURES_DIR = getenv('FIXTURES_DIR', 'fixtures')
+
+PROTOCOLS = {
+    'UniswapV3': (uniswap.UniswapV3PositionsManager,
+                  uniswap.UniswapV3PositionRaw,
+                  uniswap.UniswapV3PoolState,
+                  uniswap.calc_position_by_tickmath),
+    'KyberSwap Elastic': (kyberswap.KyberswapElasticPositionsManager,
+                          kyberswap.KyberswapElasticPool,
+                          kyberswap.KyberswapElasticPoolState,
+                          kyberswap.calc_position_by_tickmath)
+}
+
+def record():
+    from web3 import Web3
+    from bobstats.settings import Settings
+
+    settings = Settings.get()
+    for chainid in settings.chains:
+        for inventory in settings.chains[chainid].inventories or []:
+            if not inventory.protocol in PROTOCOLS:
+                continue
+            manager_class = PROTOCOLS[inventory.protocol][0]
+            w3prov = settings.w3_providers[chainid]
+            manager = manager_class(
+                w3prov,
+                Web3.toChecksumAddress(inventory.pos_manager),
+                Web3.toChecksumAddress(inventory.owner)
+            )
+            bn = w3prov.make_call(w3prov.w3.eth.get_block_number)
+            positions = manager.get_raw_postions(bn)
+            if len(positions) == 0:
+                info(f'{chainid}: no positions found for {inventory.owner}')
+                continue
+            pools_states = manager.get_pools_states(positions, bn)
+            manager.simulate(positions, bn)
+
+            pools_keys = list(pools_states)
+            fixture = {
+                'protocol': inventory.protocol,
+                'chainid': chainid,
+                'block': bn,
+                'pools': [pools_states[k].dict() for k in pools_keys],
+                'positions': [{
+                    'pos_id': pos.pos_id,
+                    'pool': pools_keys.index(pos.pool_key()),
+                    'raw': pos.raw.dict(),
+                    'tvl': [pos.token0_tvl, pos.token1_tvl],
+                    'fees': [pos.token0_fees, pos.token1_fees]
+                } for pos in positions]
+            }
+            protocol = inventory.protocol.replace(' ', '-').lower()
+            fn = f'{FIXTURES_DIR}/{chainid}-{protocol}-{inventory.owner}.json'
+            with open(fn, 'w') as f:
+                dump(fixture, f)
+            info(f'{chainid}: {len(positions)} positions recorded to {fn}')
+
+def check() -> bool:
+    retval = True
+    for fn in sorted(listdir(FIXTURES_DIR)):
+        if not fn.endswith('.json'):
+            continue
+        with open(f'{FIXTURES_DIR}/{fn}') as f:
+            fixture = load(f)
+        (_, raw_class, state_class, calc) = PROTOCOLS[fixture['protocol']]
+        pools = [state_class.parse_obj(p) for p in fixture['pools']]
+        mismatches = 0
+        for pos in fixture['positions']:
+            (tvl, fees) = calc(raw_class.parse_obj(pos['raw']), pools[pos['pool']])
+            if list(tvl) != pos['tvl'] or list(fees) != pos['fees']:
+                mismatches += 1
+                error(f"{fn}/{pos['pos_id']}: tvl {list(tvl)} vs {pos['tvl']}, fees {list(fees)} vs {pos['fees']}")
+        info(f"{fn}: {len(fixture['positions'])} positions at block {fixture['block']}, {mismatches} mismatches")
+        retval &= mismatches == 0
+    return retval
+
+if __name__ == '__main__':
+    if CROSSCHECK == 'record':
+        record()
+    else:
+        if not check():
+            exit(1)
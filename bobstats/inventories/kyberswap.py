@@ -1,10 +1,11 @@
 from functools import cache
-from typing import Dict
+from typing import Dict, List, Tuple
 from pydantic import BaseModel
 
 from time import time
 
 from web3.eth import Contract
+from web3.contract import ContractFunction
 
 from utils.abi import get_abi, ABI
 from utils.web3 import Web3Provider
@@ -12,7 +13,11 @@ from utils.logging import info, debug, error
 from utils.constants import ONE_DAY, TWO_POW_96
 
 from .common import fields_as_list, Position, UniswapLikePositionsManager, \
-                    UniswapLikeInventoryHandler, UniswapLikeInventoryStats
+                    UniswapLikeInventoryHandler, UniswapLikeInventoryStats, \
+                    SIMULATION_ENGINE
+from .catalog import PositionsCatalog
+from .tickmath import get_amounts_for_liquidity, get_fee_growth_inside, get_fees_owed, \
+                      get_synced_fee_growth, get_amounts_for_rtokens
 
 class KyberswapElastisPoolPair(BaseModel):
     token0: str
@@ -29,78 +34,134 @@ class KyberswapElasticPool(BaseModel):
     rTokenOwed: int
     feeGrowthInsideLast: int
 
+class KyberswapElasticPoolState(BaseModel):
+    sqrtP: int
+    currentTick: int
+    baseL: int
+    reinvestL: int
+    reinvestLLast: int
+    feeGrowthGlobal: int
+    rTotalSupply: int
+    governmentFeeUnits: int
+    # tick -> feeGrowthOutside
+    ticks: Dict[int, int]
+
+def calc_position_by_tickmath(raw: KyberswapElasticPool, pool_state: KyberswapElasticPoolState) -> Tuple[tuple, tuple]:
+    # returns the same amounts as removeLiquidity and burnRTokens would return
+    tvl = get_amounts_for_liquidity(
+        pool_state.sqrtP,
+        pool_state.currentTick,
+        raw.tickLower,
+        raw.tickUpper,
+        raw.liquidity
+    )
+
+    # the pool mints reinvestment tokens for the collected fees before
+    # the position is touched
+    (fee_growth_global, r_total_supply) = get_synced_fee_growth(
+        pool_state.baseL,
+        pool_state.reinvestL,
+        pool_state.reinvestLLast,
+        pool_state.feeGrowthGlobal,
+        pool_state.rTotalSupply,
+        pool_state.governmentFeeUnits
+    )
+    fee_growth_inside = get_fee_growth_inside(
+        pool_state.currentTick,
+        raw.tickLower,
+        raw.tickUpper,
+        fee_growth_global,
+        pool_state.ticks[raw.tickLower],
+        pool_state.ticks[raw.tickUpper]
+    )
+    r_token_owed = raw.rTokenOwed + get_fees_owed(
+        fee_growth_inside,
+        raw.feeGrowthInsideLast,
+        raw.liquidity,
+        TWO_POW_96
+    )
+    fees = get_amounts_for_rtokens(
+        r_token_owed,
+        pool_state.sqrtP,
+        pool_state.reinvestL,
+        r_total_supply
+    )
+    return (tvl, fees)
+
 class KyberswapElasticPosition(Position):
+    raw: KyberswapElasticPool
 
-    def __init__(self, w3prov: Web3Provider, pos_owner: str, pos_manager: Contract, idx: int):
-        
-        @cache
-        def get_pool_contract():
-            factory_addr = w3prov.make_call(pos_manager.functions.factory().call)
-            factory = w3prov.w3.eth.contract(abi = get_abi(ABI.KYBERSWAP_FACTORY), address = factory_addr)
-            pool_addr = w3prov.make_call(factory.functions.getPool(
-                self.token0_addr, 
-                self.token1_addr, 
-                self.fee
-            ).call)
-            return w3prov.w3.eth.contract(abi = get_abi(ABI.KYBERSWAP_POOL), address = pool_addr)
-
-        def get_postion_raw_details():
-            position_details = w3prov.make_call(pos_manager.functions.positions(self.pos_id).call)
-            raw_pair = KyberswapElastisPoolPair.parse_obj(dict(zip(fields_as_list(KyberswapElastisPoolPair),
-                                                                   position_details[1]
-                                                                  )
-                                                              )
-                                                         )
-            raw_details = KyberswapElasticPool.parse_obj(dict(zip(fields_as_list(KyberswapElasticPool),
-                                                                  position_details[0]
-                                                                 )
-                                                             )
-                                                        )
-            self.token0_addr = raw_pair.token0
-            self.token1_addr = raw_pair.token1
-            self.liquidity = raw_details.liquidity
-            self.rTokenOwed = raw_details.rTokenOwed
-            self.fee = raw_pair.fee
-            info(f'{w3prov.chainid}/{self.pos_id}: pair: {self.token0_addr}/{self.token1_addr}, liquidity {self.liquidity}')
-            debug(f'{w3prov.chainid}/{self.pos_id}: pair: {raw_details}, {raw_pair}')
-
-        def get_tvl_and_fees_for_postion():
-            params = {
-                "tokenId": self.pos_id,
-                "liquidity": self.liquidity,
-                "amount0Min": 0,
-                "amount1Min": 0,
-                "deadline": int(time())+ ONE_DAY
-            }
-            removeLiquidity_encoded = pos_manager.encodeABI(fn_name="removeLiquidity", args=[params])
-            del params["liquidity"]
-            burnRTokens_encoded = pos_manager.encodeABI(fn_name="burnRTokens", args=[params])
-
-            mc_retvall = w3prov.make_call(pos_manager.functions.multicall([
-                removeLiquidity_encoded,
-                burnRTokens_encoded
-            ]).call)
-            if len(mc_retvall) != 2:
-                error(f"{w3prov.chainid}/{self.pos_id}: KyberSwap's multicall returned unexpected value")
-                BaseException(f"KyberSwap's multicall returned unexpected value")
-
-            tvl_for_pair = w3prov.w3.codec.decode(["(uint256,uint256,uint256)"], mc_retvall[0])[0]
-            fees_for_pair = w3prov.w3.codec.decode(["(uint256,uint256,uint256)"], mc_retvall[1])[0]
-
-            self.token0_tvl = tvl_for_pair[0]
-            self.token1_tvl = tvl_for_pair[1]
-            info(f'{w3prov.chainid}/{self.pos_id}: pair: tvl: {self.token0_tvl, self.token1_tvl}')
-            self.token0_fees = fees_for_pair[1]
-            self.token1_fees = fees_for_pair[2]
-            info(f'{w3prov.chainid}/{self.pos_id}: pair: fees: {self.token0_fees, self.token1_fees}')
-
-        self.pos_id = w3prov.make_call(pos_manager.functions.tokenOfOwnerByIndex(pos_owner, idx).call)
+    def __init__(self, w3prov: Web3Provider, pos_owner: str, pos_manager: Contract, pos_id: int):
+        self._w3prov = w3prov
+        self._owner = pos_owner
+        self._pm = pos_manager
+        self.pos_id = pos_id
         info(f'{w3prov.chainid}: intialising position {self.pos_id}')
-        get_postion_raw_details()
-        if self.liquidity != 0:
-            get_tvl_and_fees_for_postion()
-        else:
-            info(f'{w3prov.chainid}: position {self.pos_id} does not contain liquidity')
+
+    def positions_call(self) -> ContractFunction:
+        return self._pm.functions.positions(self.pos_id)
+
+    def set_raw_details(self, position_details: list):
+        raw_pair = KyberswapElastisPoolPair.parse_obj(dict(zip(fields_as_list(KyberswapElastisPoolPair),
+                                                               position_details[1]
+                                                              )
+                                                          )
+                                                     )
+        self.raw = KyberswapElasticPool.parse_obj(dict(zip(fields_as_list(KyberswapElasticPool),
+                                                           position_details[0]
+                                                          )
+                                                      )
+                                                 )
+        self.token0_addr = raw_pair.token0
+        self.token1_addr = raw_pair.token1
+        self.liquidity = self.raw.liquidity
+        self.rTokenOwed = self.raw.rTokenOwed
+        self.fee = raw_pair.fee
+        self.tickLower = self.raw.tickLower
+        self.tickUpper = self.raw.tickUpper
+        info(f'{self._w3prov.chainid}/{self.pos_id}: pair: {self.token0_addr}/{self.token1_addr}, liquidity {self.liquidity}')
+        debug(f'{self._w3prov.chainid}/{self.pos_id}: pair: {self.raw}, {raw_pair}')
+
+    def set_tvl(self, tvl_for_pair: list):
+        self.token0_tvl = tvl_for_pair[0]
+        self.token1_tvl = tvl_for_pair[1]
+        info(f'{self._w3prov.chainid}/{self.pos_id}: pair: tvl: {self.token0_tvl, self.token1_tvl}')
+
+    def set_fees(self, fees_for_pair: list):
+        self.token0_fees = fees_for_pair[0]
+        self.token1_fees = fees_for_pair[1]
+        info(f'{self._w3prov.chainid}/{self.pos_id}: pair: fees: {self.token0_fees, self.token1_fees}')
+
+    def simulate(self, bn: int):
+        params = {
+            "tokenId": self.pos_id,
+            "liquidity": self.liquidity,
+            "amount0Min": 0,
+            "amount1Min": 0,
+            "deadline": int(time())+ ONE_DAY
+        }
+        removeLiquidity_encoded = self._pm.encodeABI(fn_name="removeLiquidity", args=[params])
+        del params["liquidity"]
+        burnRTokens_encoded = self._pm.encodeABI(fn_name="burnRTokens", args=[params])
+
+        mc_retvall = self._w3prov.make_call(self._pm.functions.multicall([
+            removeLiquidity_encoded,
+            burnRTokens_encoded
+        ]).call, block_identifier=bn)
+        if len(mc_retvall) != 2:
+            error(f"{self._w3prov.chainid}/{self.pos_id}: KyberSwap's multicall returned unexpected value")
+            raise Exception(f"KyberSwap's multicall returned unexpected value")
+
+        tvl_for_pair = self._w3prov.w3.codec.decode(["(uint256,uint256,uint256)"], mc_retvall[0])[0]
+        fees_for_pair = self._w3prov.w3.codec.decode(["(uint256,uint256,uint256)"], mc_retvall[1])[0]
+
+        self.set_tvl(tvl_for_pair)
+        self.set_fees(fees_for_pair[1:])
+
+    def apply_tickmath(self, pool_state: KyberswapElasticPoolState):
+        (tvl, fees) = calc_position_by_tickmath(self.raw, pool_state)
+        self.set_tvl(tvl)
+        self.set_fees(fees)
 
 @cache
 class KyberswapElasticPositionsManager(UniswapLikePositionsManager):
@@ -108,28 +169,78 @@ class KyberswapElasticPositionsManager(UniswapLikePositionsManager):
     def __init__(self,
         w3_provider: Web3Provider,
         position_manager: str,
-        position_owner: str
+        position_owner: str,
+        engine: str = SIMULATION_ENGINE,
+        catalog: PositionsCatalog = None,
+        block_range: int = 0
     ):
         self.w3prov = w3_provider
         self.owner = position_owner
         self.pm = w3_provider.w3.eth.contract(abi = get_abi(ABI.KYBERSWAP_PM), address = position_manager)
         self.fee_denominator = 1000
-
-    def get_postions(self):
-        info(f'{self.w3prov.chainid}: getting KyberSwap Elastic positions for owner {self.owner}')
-
-        pos_num = self.w3prov.make_call(self.pm.functions.balanceOf(self.owner).call)
-
-        info(f'{self.w3prov.chainid}: found {pos_num} positions')
-
-        self.postions = []
-        for i in range(pos_num):
-            pos = KyberswapElasticPosition(self.w3prov, self.owner, self.pm, i)
-            if pos.liquidity == 0:
-                continue
-            self.postions.append(pos)
+        self.engine = engine
+        self.catalog = catalog
+        self.block_range = block_range
+        self.protocol = 'KyberSwap Elastic'
+        self.factory_abi = ABI.KYBERSWAP_FACTORY
+        self.pool_abi = ABI.KYBERSWAP_POOL
+        self._factory = None
+        self._pools = {}
+
+    def new_position(self, pos_id: int) -> KyberswapElasticPosition:
+        return KyberswapElasticPosition(self.w3prov, self.owner, self.pm, pos_id)
+
+    def simulate(self, positions: List[KyberswapElasticPosition], bn: int):
+        # every position is simulated in a separate multicall since burning
+        # reinvestment tokens of one position changes the pool for another one
+        for pos in positions:
+            pos.simulate(bn)
+
+    def get_pools_states(self, positions: List[KyberswapElasticPosition], bn: int) -> Dict[tuple, KyberswapElasticPoolState]:
+        ticks = {}
+        for pos in positions:
+            ticks.setdefault(pos.pool_key(), set()).update((pos.tickLower, pos.tickUpper))
+        pools = self.get_pools(list(ticks), bn)
+
+        # every pool is read once no matter how many positions it has
+        funcs = [self.get_factory().functions.feeConfiguration()]
+        for k in ticks:
+            pool = pools[k]
+            funcs.extend([pool.functions.getPoolState(),
+                          pool.functions.getLiquidityState(),
+                          pool.functions.getFeeGrowthGlobal(),
+                          pool.functions.totalSupply()])
+            funcs.extend([pool.functions.ticks(t) for t in sorted(ticks[k])])
+        resps = self.w3prov.make_multicall(funcs, bn)
+        if None in resps:
+            raise Exception(f'not able to get states of pools')
+
+        government_fee_units = resps[0][1]
+        retval = {}
+        i = 1
+        for k in ticks:
+            (pool_state, liquidity_state, fee_growth_global, total_supply) = resps[i:i+4]
+            i += 4
+            pool_ticks = {}
+            for t in sorted(ticks[k]):
+                pool_ticks[t] = resps[i][2]
+                i += 1
+            retval[k] = KyberswapElasticPoolState(
+                sqrtP=pool_state[0],
+                currentTick=pool_state[1],
+                baseL=liquidity_state[0],
+                reinvestL=liquidity_state[1],
+                reinvestLLast=liquidity_state[2],
+                feeGrowthGlobal=fee_growth_global,
+                rTotalSupply=total_supply,
+                governmentFeeUnits=government_fee_units,
+                ticks=pool_ticks
+            )
+            debug(f'{self.w3prov.chainid}: pool {pools[k].address}: {retval[k]}')
+        info(f'{self.w3prov.chainid}: got states of {len(retval)} pools at block {bn}')
+        return retval
 
 class KyberswapElasticInventoryHandler(UniswapLikeInventoryHandler):
     def get_stats(self) -> Dict[str, UniswapLikeInventoryStats]:
-        manager = KyberswapElasticPositionsManager(self.w3prov, self.pm_addr, self.owner)
+        manager = KyberswapElasticPositionsManager(self.w3prov, self.pm_addr, self.owner, self.engine, self.catalog, self.block_range)
         return self._get_stats(manager)
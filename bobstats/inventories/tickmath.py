@@ -0,0 +1,141 @@
+from typing import Tuple
+
+# Integer math of concentrated liquidity pools ported from Uniswap V3 core
+# (TickMath, SqrtPriceMath, Tick.getFeeGrowthInside) and KyberSwap Elastic
+# (ReinvestmentMath, QtyDeltaMath). All the functions round exactly the same
+# way as the contracts do when liquidity is removed, so the results match
+# the simulated decreaseLiquidity/collect and removeLiquidity/burnRTokens calls.
+
+Q96 = 2 ** 96
+Q128 = 2 ** 128
+Q256 = 2 ** 256
+
+MIN_TICK = -887272
+MAX_TICK = 887272
+
+KYBERSWAP_FEE_UNITS = 100000
+
+_TICK_RATIOS = [
+    (0x2, 0xfff97272373d413259a46990580e213a),
+    (0x4, 0xfff2e50f5f656932ef12357cf3c7fdcc),
+    (0x8, 0xffe5caca7e10e4e61c3624eaa0941cd0),
+    (0x10, 0xffcb9843d60f6159c9db58835c926644),
+    (0x20, 0xff973b41fa98c081472e6896dfb254c0),
+    (0x40, 0xff2ea16466c96a3843ec78b326b52861),
+    (0x80, 0xfe5dee046a99a2a811c461f1969c3053),
+    (0x100, 0xfcbe86c7900a88aedcffc83b479aa3a4),
+    (0x200, 0xf987a7253ac413176f2b074cf7815e54),
+    (0x400, 0xf3392b0822b70005940c7a398e4b70f3),
+    (0x800, 0xe7159475a2c29b7443b29c7fa6e889d9),
+    (0x1000, 0xd097f3bdfd2022b8845ad8f792aa5825),
+    (0x2000, 0xa9f746462d870fdf8a65dc1f90e061e5),
+    (0x4000, 0x70d869a156d2a1b890bb3df62baf32f7),
+    (0x8000, 0x31be135f97d08fd981231505542fcfa6),
+    (0x10000, 0x9aa508b5b7a84e1c677de54f3e99bc9),
+    (0x20000, 0x5d6af8dedb81196699c329225ee604),
+    (0x40000, 0x2216e584f5fa1ea926041bedfe98),
+    (0x80000, 0x48a170391f7dc42444e8fa2),
+]
+
+def get_sqrt_ratio_at_tick(tick: int) -> int:
+    abs_tick = abs(tick)
+    if abs_tick > MAX_TICK:
+        raise ValueError(f'tick {tick} is out of range')
+
+    ratio = 0xfffcb933bd6fad37aa2d162d1a594001 if abs_tick & 0x1 != 0 else 0x100000000000000000000000000000000
+    for (mask, multiplier) in _TICK_RATIOS:
+        if abs_tick & mask != 0:
+            ratio = (ratio * multiplier) >> 128
+
+    if tick > 0:
+        ratio = (Q256 - 1) // ratio
+
+    # Q128.128 to Q64.96 rounding up
+    return (ratio >> 32) + (0 if ratio % (1 << 32) == 0 else 1)
+
+def get_amount0_delta(sqrt_ratio_a: int, sqrt_ratio_b: int, liquidity: int) -> int:
+    if sqrt_ratio_a > sqrt_ratio_b:
+        (sqrt_ratio_a, sqrt_ratio_b) = (sqrt_ratio_b, sqrt_ratio_a)
+    return ((liquidity << 96) * (sqrt_ratio_b - sqrt_ratio_a) // sqrt_ratio_b) // sqrt_ratio_a
+
+def get_amount1_delta(sqrt_ratio_a: int, sqrt_ratio_b: int, liquidity: int) -> int:
+    if sqrt_ratio_a > sqrt_ratio_b:
+        (sqrt_ratio_a, sqrt_ratio_b) = (sqrt_ratio_b, sqrt_ratio_a)
+    return liquidity * (sqrt_ratio_b - sqrt_ratio_a) // Q96
+
+def get_amounts_for_liquidity(
+    sqrt_price: int,
+    tick: int,
+    tick_lower: int,
+    tick_upper: int,
+    liquidity: int
+) -> Tuple[int, int]:
+    # amounts of tokens which are returned when the liquidity is removed from the pool
+    sqrt_ratio_lower = get_sqrt_ratio_at_tick(tick_lower)
+    sqrt_ratio_upper = get_sqrt_ratio_at_tick(tick_upper)
+    if tick < tick_lower:
+        return (get_amount0_delta(sqrt_ratio_lower, sqrt_ratio_upper, liquidity), 0)
+    elif tick < tick_upper:
+        return (get_amount0_delta(sqrt_price, sqrt_ratio_upper, liquidity),
+                get_amount1_delta(sqrt_ratio_lower, sqrt_price, liquidity))
+    return (0, get_amount1_delta(sqrt_ratio_lower, sqrt_ratio_upper, liquidity))
+
+def get_fee_growth_inside(
+    tick: int,
+    tick_lower: int,
+    tick_upper: int,
+    fee_growth_global: int,
+    fee_growth_outside_lower: int,
+    fee_growth_outside_upper: int
+) -> int:
+    if tick >= tick_lower:
+        fee_growth_below = fee_growth_outside_lower
+    else:
+        fee_growth_below = fee_growth_global - fee_growth_outside_lower
+    if tick < tick_upper:
+        fee_growth_above = fee_growth_outside_upper
+    else:
+        fee_growth_above = fee_growth_global - fee_growth_outside_upper
+    return (fee_growth_global - fee_growth_below - fee_growth_above) % Q256
+
+def get_fees_owed(
+    fee_growth_inside: int,
+    fee_growth_inside_last: int,
+    liquidity: int,
+    resolution: int = Q128
+) -> int:
+    # fee growth is accounted modulo 2^256 by the contracts
+    return ((fee_growth_inside - fee_growth_inside_last) % Q256) * liquidity // resolution
+
+def get_synced_fee_growth(
+    base_l: int,
+    reinvest_l: int,
+    reinvest_l_last: int,
+    fee_growth_global: int,
+    r_total_supply: int,
+    government_fee_units: int
+) -> Tuple[int, int]:
+    # KyberSwap Elastic mints reinvestment tokens for the fees collected since
+    # the last sync before any position is touched. Returns the global fee growth
+    # and the reinvestment tokens supply as they are after the sync
+    if base_l + reinvest_l == 0 or reinvest_l_last == 0:
+        return (fee_growth_global, r_total_supply)
+    lp_contribution = base_l * (reinvest_l - reinvest_l_last) // (base_l + reinvest_l)
+    r_mint_qty = r_total_supply * lp_contribution // reinvest_l_last
+    if r_mint_qty == 0:
+        return (fee_growth_global, r_total_supply)
+    r_govt_qty = r_mint_qty * government_fee_units // KYBERSWAP_FEE_UNITS
+    fee_growth_global = (fee_growth_global + (r_mint_qty - r_govt_qty) * Q96 // base_l) % Q256
+    return (fee_growth_global, r_total_supply + r_mint_qty)
+
+def get_amounts_for_rtokens(
+    r_token_qty: int,
+    sqrt_price: int,
+    reinvest_l: int,
+    r_total_supply: int
+) -> Tuple[int, int]:
+    # amounts of tokens which are returned when reinvestment tokens are burnt
+    if r_total_supply == 0:
+        return (0, 0)
+    delta_l = r_token_qty * reinvest_l // r_total_supply
+    return (delta_l * Q96 // sqrt_price, delta_l * sqrt_price // Q96)
@@ -1,18 +1,22 @@
 from functools import cache
-from typing import Dict
+from typing import Dict, List, Tuple
 from pydantic import BaseModel
 
 from time import time
 
 from web3.eth import Contract
+from web3.contract import ContractFunction
 
 from utils.abi import get_abi, ABI
 from utils.web3 import Web3Provider
-from utils.logging import info, debug
+from utils.logging import info, debug, error
 from utils.constants import ONE_DAY, MAX_INT
 
 from .common import fields_as_list, Position, UniswapLikePositionsManager, \
-                    UniswapLikeInventoryHandler, UniswapLikeInventoryStats
+                    UniswapLikeInventoryHandler, UniswapLikeInventoryStats, \
+                    SIMULATION_ENGINE
+from .catalog import PositionsCatalog
+from .tickmath import get_amounts_for_liquidity, get_fee_growth_inside, get_fees_owed
 
 class UniswapV3PositionRaw(BaseModel):
     nonce: int
@@ -28,55 +32,97 @@ class UniswapV3PositionRaw(BaseModel):
     tokensOwed0: int
     tokensOwed1: int
 
+class UniswapV3PoolState(BaseModel):
+    sqrtPriceX96: int
+    tick: int
+    feeGrowthGlobal0X128: int
+    feeGrowthGlobal1X128: int
+    # tick -> (feeGrowthOutside0X128, feeGrowthOutside1X128)
+    ticks: Dict[int, Tuple[int, int]]
+
+def calc_position_by_tickmath(raw: UniswapV3PositionRaw, pool_state: UniswapV3PoolState) -> Tuple[tuple, tuple]:
+    # returns the same amounts as decreaseLiquidity and collect would return
+    tvl = get_amounts_for_liquidity(
+        pool_state.sqrtPriceX96,
+        pool_state.tick,
+        raw.tickLower,
+        raw.tickUpper,
+        raw.liquidity
+    )
+
+    (lower0, lower1) = pool_state.ticks[raw.tickLower]
+    (upper0, upper1) = pool_state.ticks[raw.tickUpper]
+    inside0 = get_fee_growth_inside(pool_state.tick, raw.tickLower, raw.tickUpper,
+                                    pool_state.feeGrowthGlobal0X128, lower0, upper0)
+    inside1 = get_fee_growth_inside(pool_state.tick, raw.tickLower, raw.tickUpper,
+                                    pool_state.feeGrowthGlobal1X128, lower1, upper1)
+    # collect returns no more than uint128 max for every token
+    fees = (
+        min(raw.tokensOwed0 + get_fees_owed(inside0, raw.feeGrowthInside0LastX128, raw.liquidity), MAX_INT),
+        min(raw.tokensOwed1 + get_fees_owed(inside1, raw.feeGrowthInside1LastX128, raw.liquidity), MAX_INT)
+    )
+    return (tvl, fees)
+
 class UniswapV3Position(Position):
+    raw: UniswapV3PositionRaw
 
-    def __init__(self, w3prov: Web3Provider, pos_owner: str, pos_manager: Contract, idx: int):
-        def get_postion_raw_details():
-            position_details = w3prov.make_call(pos_manager.functions.positions(self.pos_id).call)
-            raw_details = UniswapV3PositionRaw.parse_obj(dict(zip(fields_as_list(UniswapV3PositionRaw),
-                                                                  position_details
-                                                                 )
-                                                             )
-                                                        )
-            self.token0_addr = raw_details.token0
-            self.token1_addr = raw_details.token1
-            self.liquidity = raw_details.liquidity
-            self.fee = raw_details.fee
-            info(f'{w3prov.chainid}/{self.pos_id}: pair: {self.token0_addr}/{self.token1_addr}, liquidity {self.liquidity}')
-            debug(f'{w3prov.chainid}/{self.pos_id}: pair: {raw_details}')
-
-        def get_tvl_for_postion():
-            params = {
-                "tokenId": self.pos_id,
-                "liquidity": self.liquidity,
-                "amount0Min": 0,
-                "amount1Min": 0,
-                "deadline": int(time())+ ONE_DAY
-            }
-            tvl_for_pair = w3prov.make_call(pos_manager.functions.decreaseLiquidity(params).call)
-            self.token0_tvl = tvl_for_pair[0]
-            self.token1_tvl = tvl_for_pair[1]
-            info(f'{w3prov.chainid}/{self.pos_id}: pair: tvl: {self.token0_tvl, self.token1_tvl}')
-
-        def get_fees_for_postion():
-            params = {"tokenId": self.pos_id,
-                    "recipient": pos_owner,
-                    "amount0Max": MAX_INT,
-                    "amount1Max": MAX_INT
-                    }
-            fees_for_pair = w3prov.make_call(pos_manager.functions.collect(params).call)
-            self.token0_fees = fees_for_pair[0]
-            self.token1_fees = fees_for_pair[1]
-            info(f'{w3prov.chainid}/{self.pos_id}: pair: fees: {self.token0_fees, self.token1_fees}')
-
-        self.pos_id = w3prov.make_call(pos_manager.functions.tokenOfOwnerByIndex(pos_owner, idx).call)
+    def __init__(self, w3prov: Web3Provider, pos_owner: str, pos_manager: Contract, pos_id: int):
+        self._w3prov = w3prov
+        self._owner = pos_owner
+        self._pm = pos_manager
+        self.pos_id = pos_id
         info(f'{w3prov.chainid}: intialising position {self.pos_id}')
-        get_postion_raw_details()
-        if self.liquidity != 0:
-            get_tvl_for_postion()
-            get_fees_for_postion()
-        else:
-            info(f'{w3prov.chainid}: position {self.pos_id} does not contain liquidity')
+
+    def positions_call(self) -> ContractFunction:
+        return self._pm.functions.positions(self.pos_id)
+
+    def decrease_liquidity_call(self) -> ContractFunction:
+        params = {
+            "tokenId": self.pos_id,
+            "liquidity": self.liquidity,
+            "amount0Min": 0,
+            "amount1Min": 0,
+            "deadline": int(time())+ ONE_DAY
+        }
+        return self._pm.functions.decreaseLiquidity(params)
+
+    def collect_call(self) -> ContractFunction:
+        params = {"tokenId": self.pos_id,
+                "recipient": self._owner,
+                "amount0Max": MAX_INT,
+                "amount1Max": MAX_INT
+                }
+        return self._pm.functions.collect(params)
+
+    def set_raw_details(self, position_details: list):
+        self.raw = UniswapV3PositionRaw.parse_obj(dict(zip(fields_as_list(UniswapV3PositionRaw),
+                                                           position_details
+                                                          )
+                                                      )
+                                                 )
+        self.token0_addr = self.raw.token0
+        self.token1_addr = self.raw.token1
+        self.liquidity = self.raw.liquidity
+        self.fee = self.raw.fee
+        self.tickLower = self.raw.tickLower
+        self.tickUpper = self.raw.tickUpper
+        info(f'{self._w3prov.chainid}/{self.pos_id}: pair: {self.token0_addr}/{self.token1_addr}, liquidity {self.liquidity}')
+        debug(f'{self._w3prov.chainid}/{self.pos_id}: pair: {self.raw}')
+
+    def set_tvl(self, tvl_for_pair: list):
+        self.token0_tvl = tvl_for_pair[0]
+        self.token1_tvl = tvl_for_pair[1]
+        info(f'{self._w3prov.chainid}/{self.pos_id}: pair: tvl: {self.token0_tvl, self.token1_tvl}')
+
+    def set_fees(self, fees_for_pair: list):
+        self.token0_fees = fees_for_pair[0]
+        self.token1_fees = fees_for_pair[1]
+        info(f'{self._w3prov.chainid}/{self.pos_id}: pair: fees: {self.token0_fees, self.token1_fees}')
+
+    def apply_tickmath(self, pool_state: UniswapV3PoolState):
+        (tvl, fees) = calc_position_by_tickmath(self.raw, pool_state)
+        self.set_tvl(tvl)
+        self.set_fees(fees)
 
 @cache
 class UniswapV3PositionsManager(UniswapLikePositionsManager):
@@ -84,28 +130,91 @@ class UniswapV3PositionsManager(UniswapLikePositionsManager):
     def __init__(self,
         w3_provider: Web3Provider,
         position_manager: str,
-        position_owner: str
+        position_owner: str,
+        engine: str = SIMULATION_ENGINE,
+        catalog: PositionsCatalog = None,
+        block_range: int = 0
     ):
         self.w3prov = w3_provider
         self.owner = position_owner
         self.pm = w3_provider.w3.eth.contract(abi = get_abi(ABI.UNIV3_PM), address = position_manager)
         self.fee_denominator = 10000
-
-    def get_postions(self):
-        info(f'{self.w3prov.chainid}: getting UniSwapV3 positions for owner {self.owner}')
-
-        pos_num = self.w3prov.make_call(self.pm.functions.balanceOf(self.owner).call)
-
-        info(f'{self.w3prov.chainid}: found {pos_num} positions')
-
-        self.postions = []
-        for i in range(pos_num):
-            pos = UniswapV3Position(self.w3prov, self.owner, self.pm, i)
-            if pos.liquidity == 0:
-                continue
-            self.postions.append(pos)
+        self.engine = engine
+        self.catalog = catalog
+        self.block_range = block_range
+        self.protocol = 'UniSwapV3'
+        self.factory_abi = ABI.UNIV3_FACTORY
+        self.pool_abi = ABI.UNIV3_POOL
+        self._factory = None
+        self._pools = {}
+
+    def new_position(self, pos_id: int) -> UniswapV3Position:
+        return UniswapV3Position(self.w3prov, self.owner, self.pm, pos_id)
+
+    def simulate(self, positions: List[UniswapV3Position], bn: int):
+        # decreaseLiquidity and collect check that the caller is authorized for
+        # the token so they are simulated in one multicall of the positions manager
+        # rather than through Multicall3.
+        # Fees are collected before liquidity is decreased otherwise the collected
+        # amounts would include the withdrawn liquidity
+        funcs = [pos.collect_call() for pos in positions] + \
+                [pos.decrease_liquidity_call() for pos in positions]
+        mc_retval = self.w3prov.make_call(
+            self.pm.functions.multicall([self.w3prov.encode_function_call(f) for f in funcs]).call,
+            block_identifier=bn
+        )
+        if mc_retval == None or len(mc_retval) != len(funcs):
+            error(f'{self.w3prov.chainid}: positions manager multicall failed, simulating positions one by one')
+            for pos in positions:
+                pos.set_fees(self.w3prov.make_call(pos.collect_call().call, block_identifier=bn))
+                pos.set_tvl(self.w3prov.make_call(pos.decrease_liquidity_call().call, block_identifier=bn))
+            return
+
+        results = [self.w3prov.decode_function_output(f, data) for (f, data) in zip(funcs, mc_retval)]
+        pos_count = len(positions)
+        for i in range(pos_count):
+            positions[i].set_fees(results[i])
+            positions[i].set_tvl(results[pos_count + i])
+
+    def get_pools_states(self, positions: List[UniswapV3Position], bn: int) -> Dict[tuple, UniswapV3PoolState]:
+        ticks = {}
+        for pos in positions:
+            ticks.setdefault(pos.pool_key(), set()).update((pos.tickLower, pos.tickUpper))
+        pools = self.get_pools(list(ticks), bn)
+
+        # every pool is read once no matter how many positions it has
+        funcs = []
+        for k in ticks:
+            pool = pools[k]
+            funcs.extend([pool.functions.slot0(),
+                          pool.functions.feeGrowthGlobal0X128(),
+                          pool.functions.feeGrowthGlobal1X128()])
+            funcs.extend([pool.functions.ticks(t) for t in sorted(ticks[k])])
+        resps = self.w3prov.make_multicall(funcs, bn)
+        if None in resps:
+            raise Exception(f'not able to get states of pools')
+
+        retval = {}
+        i = 0
+        for k in ticks:
+            (slot0, global0, global1) = resps[i:i+3]
+            i += 3
+            pool_ticks = {}
+            for t in sorted(ticks[k]):
+                pool_ticks[t] = (resps[i][2], resps[i][3])
+                i += 1
+            retval[k] = UniswapV3PoolState(
+                sqrtPriceX96=slot0[0],
+                tick=slot0[1],
+                feeGrowthGlobal0X128=global0,
+                feeGrowthGlobal1X128=global1,
+                ticks=pool_ticks
+            )
+            debug(f'{self.w3prov.chainid}: pool {pools[k].address}: {retval[k]}')
+        info(f'{self.w3prov.chainid}: got states of {len(retval)} pools at block {bn}')
+        return retval
 
 class UniswapInventoryHandler(UniswapLikeInventoryHandler):
     def get_stats(self) -> Dict[str, UniswapLikeInventoryStats]:
-        manager = UniswapV3PositionsManager(self.w3prov, self.pm_addr, self.owner)
+        manager = UniswapV3PositionsManager(self.w3prov, self.pm_addr, self.owner, self.engine, self.catalog, self.block_range)
         return self._get_stats(manager)
@@ -2,6 +2,8 @@ from typing import Dict, Union, List
 
 from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 
+from time import time
+
 from .settings import Settings
 
 from utils.logging import info, error
@@ -39,7 +41,8 @@ class Inventory:
                     ))
                 else:
                     error(f'{chainid}: not able to discover inventory')
-        self._max_workers = min(len(self._handlers), settings.max_workers)
+        handlers_num = sum([len(self._handlers[chainid]) for chainid in self._handlers])
+        self._max_workers = max(min(handlers_num, settings.max_workers), 1)
 
     def _get_inventory_handler(self, proto: str) -> InventoryHandler:
         if proto in self._inventory_protocols:
@@ -48,25 +51,33 @@ class Inventory:
             error(f'Handler for {proto} not found')
             return None
 
-    def _stats_for_chain(self, chainid: str, result: dict):
-        info(f'{chainid}: invoking handlers')
-        result[chainid] = {}
-        for handler in self._handlers[chainid]:
-            poi = handler.get_stats()
-            result[chainid].update(poi)
-        
-    def get_inventory(self) -> Dict[str, Dict[str, Union[UniswapLikeInventoryStats, BobVaultInventoryStats]]]:
-        def task(chainid: str, result: dict):
-            self._stats_for_chain(chainid, result)
+    def _stats_for_handler(self, chainid: str, handler: InventoryHandler) -> dict:
+        start = time()
+        poi = handler.get_stats()
+        info(f'{chainid}: {type(handler).__name__} took {time() - start:.2f}s')
+        return poi
 
+    def get_inventory(self) -> Dict[str, Dict[str, Union[UniswapLikeInventoryStats, BobVaultInventoryStats]]]:
+        # handlers of all chains run concurrently, requests to the same RPC
+        # provider are bounded by the provider itself
         info(f'Getting inventory')
-        ret = {}
+        start = time()
+        ret = {chainid: {} for chainid in self._handlers}
         with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
-            inventory_futures = {executor.submit(task, chainid, ret): chainid for chainid in self._handlers}
+            inventory_futures = {}
+            for chainid in self._handlers:
+                info(f'{chainid}: invoking handlers')
+                for handler in self._handlers[chainid]:
+                    f = executor.submit(self._stats_for_handler, chainid, handler)
+                    inventory_futures[f] = chainid
             done = wait(inventory_futures, return_when = FIRST_EXCEPTION)[0]
             for f in done:
                 ex = f.exception()
                 if ex:
                     error(f'Not able to get inventory in {inventory_futures[f]}: {ex}')
                     return {}
+        # results are merged in the order of handlers as it was done sequentially
+        for (f, chainid) in inventory_futures.items():
+            ret[chainid].update(f.result())
+        info(f'Inventory collected in {time() - start:.2f}s')
         return ret
@@ -3,6 +3,7 @@ from typing import Dict
 from utils.settings.feeding import FeedingServiceSettings
 from utils.logging import info, error
 from utils.web3 import Web3Provider
+from utils.tsdb import TINYFLUX_ENGINE
 
 class Settings(FeedingServiceSettings):
     update_bigquery: bool = True
@@ -15,11 +16,15 @@ class Settings(FeedingServiceSettings):
     bobvault_snapshot_file_suffix: str = 'bobvault-snaphsot.json'
     balances_snapshot_file_suffix: str = 'bob-holders-snaphsot.json'
     bobvault_registrar_file_suffix: str = 'bobvault-tokens.json'
+    positions_catalog_file_suffix: str = 'positions-catalog.json'
     coingecko_retry_attempts: int = 2
     coingecko_retry_delay: int = 5
     coingecko_include_anomalies: bool = True
     max_workers: int = 5
+    web3_max_inflight_requests: int = 4
     tsdb_dir: str = '.'
+    # tinyflux or sqlite, see tsdb-migrate.py to convert existing dbs
+    tsdb_engine: str = TINYFLUX_ENGINE
     bob_composed_stat_db: str = 'bobstat_composed.csv'
     bob_composed_fees_stat_db: str = 'bobstat_comp_yield.csv'
     bobvault_fees_db_suffix: str = 'bobvault-fees.csv'
@@ -36,13 +41,29 @@ class Settings(FeedingServiceSettings):
                     chainid,
                     self.chains[chainid].rpc.url,
                     self.web3_retry_attemtps,
-                    self.web3_retry_delay
+                    self.web3_retry_delay,
+                    self.timestamps_cache_dir,
+                    self.timestamps_cache_size,
+                    max_inflight_requests=self.web3_max_inflight_requests,
+                    batch_max_size=self.web3_batch_max_size,
+                    batch_max_delay=self.web3_batch_max_delay,
+                    endpoint_failure_threshold=self.web3_endpoint_failure_threshold,
+                    endpoint_eject_time=self.web3_endpoint_eject_time,
+                    hedge_delay=self.web3_hedge_delay,
+                    rate_limit=self.web3_rate_limit,
+                    rate_limit_burst=self.web3_rate_limit_burst,
+                    rate_limit_lock_dir=self.web3_rate_limit_lock_dir,
+                    finalization_delay=self.chains[chainid].finalization,
+                    responses_cache_dir=self.web3_responses_cache_dir,
+                    responses_cache_memory_size=self.web3_responses_cache_memory_size,
+                    responses_cache_disk_size=self.web3_responses_cache_disk_size,
+                    cassette_dir=self.web3_cassette_dir
                 )
 
         def web3_providers_formatter(w3_providers: Dict[str, Web3Provider]) -> str:
             providers_to_str = {}
             for c in w3_providers:
-                providers_to_str[c] = w3_providers[c].w3.provider.endpoint_uri
+                providers_to_str[c] = [ep.url for ep in w3_providers[c].w3.provider.endpoints]
 
             return str(providers_to_str)
         
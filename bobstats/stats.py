@@ -5,6 +5,7 @@ from decimal import Decimal
 from time import time, gmtime, strftime
 
 from utils.logging import info, error
+from utils.taskgraph import TaskGraph
 
 from .settings import Settings
 from .supply import Supply
@@ -32,6 +33,7 @@ class Stats:
     _volume: Volume
     _interest: InterestStats
     _chain_names: Dict[str, str]
+    _max_workers: int
 
     def __init__(self, settings: Settings):
         self._supply = Supply(settings)
@@ -39,25 +41,32 @@ class Stats:
         self._inventory = Inventory(settings)
         self._volume = Volume(settings)
         self._interest = InterestStats(settings)
+        self._max_workers = settings.max_workers
 
         self._chain_names = {}
         for chainid in settings.chains:
             self._chain_names[chainid] = settings.chains[chainid].name
 
     def _collect(self) -> RawStatsData:
-        ts = self._supply.get_total_supply()
-        inv = self._inventory.get_inventory() if len(ts) != 0 else {}
-        hldrs = self._holders.get_bob_holders_amount() if len(inv) != 0 else {}
-        vol = self._volume.get_volume() if len(hldrs) != 0 else {}
-        intrs = self._interest.get_interest() if len(vol) != 0 else {}
-
-        if (len(ts) == 0) or \
-           (len(inv) == 0) or \
-           (len(hldrs) == 0) or \
-           (len(vol) == 0):
+        # the sources are independent, the stats are not generated
+        # if any of the required sources returned nothing
+        graph = TaskGraph('stats', self._max_workers)
+        graph.add('supply', self._supply.get_total_supply)
+        graph.add('inventory', self._inventory.get_inventory)
+        graph.add('holders', self._holders.get_bob_holders_amount)
+        graph.add('volume', self._volume.get_volume)
+        graph.add('interest', self._interest.get_interest, required=False)
+        results = graph.run()
+        if not results:
             return None
 
-        return RawStatsData(supply=ts, holders=hldrs, inventory=inv, volume=vol, interest=intrs)
+        return RawStatsData(
+            supply=results['supply'],
+            holders=results['holders'],
+            inventory=results['inventory'],
+            volume=results['volume'],
+            interest=results['interest']
+        )
 
     def generate(self, timestamp = None) -> StatsByChains:
         raw_data = self._collect()
@@ -1,5 +1,9 @@
 from functools import cache
 
+from typing import List, Dict, Tuple
+
+from concurrent.futures import ThreadPoolExecutor
+
 from web3 import Web3
 from web3.eth import Contract
 
@@ -16,8 +20,9 @@ class BobVaultContract:
     _w3prov: Web3Provider
     _contract: Contract
     _block_range: int
+    _max_workers: int
 
-    def __init__(self, w3_provider: Web3Provider, address: str, start_block: int, block_range: int):
+    def __init__(self, w3_provider: Web3Provider, address: str, start_block: int, block_range: int, max_workers: int = 1):
         self._w3prov = w3_provider
         self._contract = w3_provider.w3.eth.contract(
             abi = get_abi(ABI.BOBVAULT),
@@ -25,6 +30,7 @@ class BobVaultContract:
         )
         self.start_block = start_block
         self._block_range = block_range
+        self._max_workers = max(max_workers, 1)
 
     @cache
     def address(self) -> str:
@@ -75,7 +81,7 @@ class BobVaultContract:
             swapTopic: (swap_decoder, 'Swap'),
         }
 
-    def process_log(self, log_rec) -> dict:
+    def process_log(self, log_rec, timestamps: dict = None) -> dict:
         with_events = self._get_event_decoders()
         event_topic = log_rec.topics[0]
         event_handler = with_events[event_topic][0]
@@ -90,44 +96,49 @@ class BobVaultContract:
             transactionHash=Web3.toHex(pl.transactionHash),
             blockHash=blockhash,
             blockNumber=pl.blockNumber,
-            timestamp=self._w3prov.make_call(self._w3prov.w3.eth.get_block, blockhash).timestamp
+            timestamp=timestamps[blockhash] if timestamps and blockhash in timestamps \
+                      else self._w3prov.get_block_timestamp(blockhash)
         )
         return l
 
+    def _get_logs_for_window(self, start_block: int, finish_block: int) -> list:
+        # all vault events are requested at once by putting their topics
+        # to the first position of the topics filter
+        efilters = self._get_filters()
+        vault_logs = self._w3prov.make_call(
+            self._w3prov.w3.eth.getLogs,
+            {
+                'fromBlock': start_block, 
+                'toBlock': finish_block, 
+                'address': self._contract.address, 
+                'topics': [[Web3.toHex(efilter.event_topic) for efilter in efilters]]
+            }
+        )
+        info(f"bv_contract:{self._w3prov.chainid}: found {len(vault_logs)} of {'/'.join([efilter.event_abi['name'] for efilter in efilters])} events within [{start_block}, {finish_block}]")
+        return vault_logs
+
     def get_logs_for_range(self, from_block, to_block) -> dict:
         info(f'bv_contract:{self._w3prov.chainid}: looking for events within [{from_block}, {to_block}]')
-        logs = []
-        for b in range(from_block, to_block, self._block_range + 1):
-            start_block = b
-            finish_block = min(b + self._block_range, to_block)
-            if (from_block != start_block) or (to_block != finish_block):
-                info(f'bv_contract:{self._w3prov.chainid}: looking for events within a smaler range [{start_block}, {finish_block}]')
-            vault_logs = []
-            for efilter in self._get_filters():
-                bss_logs = self._w3prov.make_call(
-                    self._w3prov.w3.eth.getLogs,
-                    {
-                        'fromBlock': start_block, 
-                        'toBlock': finish_block, 
-                        'address': efilter.address, 
-                        'topics': efilter.topics
-                    }
-                )
-                len_bss_logs = len(bss_logs)
-                info(f"bv_contract:{self._w3prov.chainid}: found {len_bss_logs} of {efilter.event_abi['name']} events")
-                if len_bss_logs > 0:
-                    vault_logs.extend(bss_logs)
-            logs.extend([self.process_log(l) for l in vault_logs])
+        windows = []
+        for b in range(from_block, to_block + 1, self._block_range + 1):
+            windows.append((b, min(b + self._block_range, to_block)))
+        if len(windows) > 1:
+            info(f'bv_contract:{self._w3prov.chainid}: the range split into {len(windows)} smaller ranges')
+
+        with ThreadPoolExecutor(max_workers=min(len(windows), self._max_workers) or 1) as executor:
+            windows_logs = executor.map(lambda w: self._get_logs_for_window(w[0], w[1]), windows)
+            vault_logs = [l for window_logs in windows_logs for l in window_logs]
+        vault_logs.sort(key=lambda l: (l['blockNumber'], l['logIndex']))
+
+        timestamps = self._w3prov.get_timestamps_by_blockhashes(
+            [Web3.toHex(l['blockHash']) for l in vault_logs]
+        )
+        logs = [self.process_log(l, timestamps) for l in vault_logs]
         info(f'bv_contract:{self._w3prov.chainid}: collected {len(logs)} events')
         return logs
 
-    def get_collateral(self, token: str, bn: int = -1) -> BobVaultCollateral:
-        info(f'bv_contract:{self._w3prov.chainid}: getting collateral info for {token}')
-        if bn == -1:
-            resp = self._w3prov.make_call(self._contract.functions.collateral(token).call)
-        else:
-            resp = self._w3prov.make_call(self._contract.functions.collateral(token).call, block_identifier=bn)
-        reval = BobVaultCollateral(
+    def _to_collateral(self, resp) -> BobVaultCollateral:
+        return BobVaultCollateral(
             balance=resp[0],
             buffer=resp[1],
             dust=resp[2],
@@ -136,6 +147,27 @@ class BobVaultContract:
             inFee=resp[5],
             outFee=resp[6]
         )
+
+    def _to_stat(self, resp) -> BobVaultCollateralStat:
+        if resp:
+            return BobVaultCollateralStat(
+                total=resp[0],
+                required=resp[1],
+                farmed=resp[2]
+            )
+        return BobVaultCollateralStat(
+            total=0,
+            required=0,
+            farmed=0
+        )
+
+    def get_collateral(self, token: str, bn: int = -1) -> BobVaultCollateral:
+        info(f'bv_contract:{self._w3prov.chainid}: getting collateral info for {token}')
+        if bn == -1:
+            resp = self._w3prov.make_call(self._contract.functions.collateral(token).call)
+        else:
+            resp = self._w3prov.make_call(self._contract.functions.collateral(token).call, block_identifier=bn)
+        reval = self._to_collateral(resp)
         info(f'bv_contract:{self._w3prov.chainid}: collateral info is: {reval}')
         return reval
 
@@ -145,17 +177,35 @@ class BobVaultContract:
             resp = self._w3prov.make_call(self._contract.functions.stat(token).call)
         else:
             resp = self._w3prov.make_call(self._contract.functions.stat(token).call, block_identifier=bn)
-        if resp:
-            reval = BobVaultCollateralStat(
-                total=resp[0],
-                required=resp[1],
-                farmed=resp[2]
-            )
-        else:
-            reval = BobVaultCollateralStat(
-                total=0,
-                required=0,
-                farmed=0
-            )
+        reval = self._to_stat(resp)
         info(f'bv_contract:{self._w3prov.chainid}: collateral stat is: {reval}')
         return reval
+
+    def get_collaterals(self, tokens: List[str], bn: int = -1) -> Dict[str, BobVaultCollateral]:
+        info(f'bv_contract:{self._w3prov.chainid}: getting collateral info for {len(tokens)} tokens')
+        resps = self._w3prov.make_multicall(
+            [self._contract.functions.collateral(token) for token in tokens],
+            bn
+        )
+        retval = {}
+        for (token, resp) in zip(tokens, resps):
+            retval[token] = self._to_collateral(resp)
+            info(f'bv_contract:{self._w3prov.chainid}: collateral info for {token} is: {retval[token]}')
+        return retval
+
+    def get_collaterals_and_stats(
+        self,
+        tokens: List[str],
+        bn: int = -1
+    ) -> Dict[str, Tuple[BobVaultCollateral, BobVaultCollateralStat]]:
+        info(f'bv_contract:{self._w3prov.chainid}: getting collateral info and stat for {len(tokens)} tokens')
+        funcs = []
+        for token in tokens:
+            funcs.append(self._contract.functions.collateral(token))
+            funcs.append(self._contract.functions.stat(token))
+        resps = self._w3prov.make_multicall(funcs, bn)
+        retval = {}
+        for i in range(len(tokens)):
+            retval[tokens[i]] = (self._to_collateral(resps[2*i]), self._to_stat(resps[2*i+1]))
+            info(f'bv_contract:{self._w3prov.chainid}: collateral info and stat for {tokens[i]} are: {retval[tokens[i]]}')
+        return retval
@@ -190,6 +190,16 @@ class CoinGeckoAdapter(BobVaultLogsProcessor):
         self._cg_data[ticker_id].low_sell = None
         self._cg_data[ticker_id].low_buy = None
 
+    def _prefetch_collaterals(self):
+        # collaterals of all tokens used in pairs are read in one multicall
+        tokens = set()
+        for ticker_id in self._cg_data.pairs():
+            tokens.add(self._cg_data[ticker_id].base_address)
+            tokens.add(self._cg_data[ticker_id].target_address)
+        tokens = [t for t in tokens if t != BOB_TOKEN_ADDRESS and not t in self._collaterals]
+        if len(tokens) > 0:
+            self._collaterals.update(self._contract.get_collaterals(tokens, self._snapshot_lastblock))
+
     def _collateral(self, token: str) -> BobVaultCollateral:
         if not token in self._collaterals:
             self._collaterals[token] = self._contract.get_collateral(token, self._snapshot_lastblock)
@@ -260,12 +270,8 @@ class CoinGeckoAdapter(BobVaultLogsProcessor):
 
     def post(self) -> bool:
         if len(self._cg_data.pairs()) > 0:
-            one_timestamp = Decimal(
-                self._w3prov.make_call(
-                    self._w3prov.w3.eth.get_block,
-                    self._snapshot_lastblock
-                ).timestamp
-            )
+            one_timestamp = Decimal(self._w3prov.get_block_timestamp(self._snapshot_lastblock))
+            self._prefetch_collaterals()
 
         for ticker_id in self._cg_data.pairs():
             self._cg_data[ticker_id].timestamp = one_timestamp
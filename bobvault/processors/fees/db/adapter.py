@@ -13,7 +13,7 @@ class DBAdapter(DBGenericAdapter):
         def inventory_setup(inv: BobVaultInventory):
             self._pool_id = inv.coingecko_poolid
         
-        super().__init__()
+        super().__init__(settings.tsdb_engine)
         self._log_prefix = f'db:{chainid}'
         if not discover_bobvault_inventory(settings.chains[chainid].inventories, inventory_setup):
             error(f'{self._log_prefix }: inventory is not found')
@@ -3,6 +3,7 @@ from typing import Dict
 from utils.settings.feeding import FeedingServiceSettings
 from utils.logging import info
 from utils.web3 import Web3Provider
+from utils.tsdb import TINYFLUX_ENGINE
 
 class Settings(FeedingServiceSettings):
     chain_selector: str = 'pol'
@@ -11,10 +12,13 @@ class Settings(FeedingServiceSettings):
     coingecko_file_suffix: str = 'bobvault-coingecko-data.json'
     registrar_file_suffix: str = 'bobvault-tokens.json'
     tsdb_dir: str = '.'
+    # tinyflux or sqlite, see tsdb-migrate.py to convert existing dbs
+    tsdb_engine: str = TINYFLUX_ENGINE
     fees_stat_db_suffix: str = 'bobvault-fees.csv'
     w3_providers: dict = {}
     measurements_interval: int = 15
     max_workers: int = 5
+    logs_fetch_workers: int = 4
 
     def __init__(self):
         def init_w3_providers():
@@ -26,13 +30,28 @@ class Settings(FeedingServiceSettings):
                     chainid,
                     self.chains[chainid].rpc.url,
                     self.web3_retry_attemtps,
-                    self.web3_retry_delay
+                    self.web3_retry_delay,
+                    self.timestamps_cache_dir,
+                    self.timestamps_cache_size,
+                    batch_max_size=self.web3_batch_max_size,
+                    batch_max_delay=self.web3_batch_max_delay,
+                    endpoint_failure_threshold=self.web3_endpoint_failure_threshold,
+                    endpoint_eject_time=self.web3_endpoint_eject_time,
+                    hedge_delay=self.web3_hedge_delay,
+                    rate_limit=self.web3_rate_limit,
+                    rate_limit_burst=self.web3_rate_limit_burst,
+                    rate_limit_lock_dir=self.web3_rate_limit_lock_dir,
+                    finalization_delay=self.chains[chainid].finalization,
+                    responses_cache_dir=self.web3_responses_cache_dir,
+                    responses_cache_memory_size=self.web3_responses_cache_memory_size,
+                    responses_cache_disk_size=self.web3_responses_cache_disk_size,
+                    cassette_dir=self.web3_cassette_dir
                 )
 
         def web3_providers_formatter(w3_providers: Dict[str, Web3Provider]) -> str:
             providers_to_str = {}
             for c in w3_providers:
-                providers_to_str[c] = w3_providers[c].w3.provider.endpoint_uri
+                providers_to_str[c] = [ep.url for ep in w3_providers[c].w3.provider.endpoints]
 
             return str(providers_to_str)
         
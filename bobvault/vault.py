@@ -28,7 +28,8 @@ class BobVault(BaseBobVault):
                 self._w3prov,
                 inv.address,
                 inv.start_block,
-                settings.chains[chainid].rpc.history_block_range
+                settings.chains[chainid].rpc.history_block_range,
+                settings.logs_fetch_workers
             )
 
         super().__init__(chainid, settings.snapshot_dir, settings.snapshot_file_suffix)
@@ -97,6 +98,11 @@ class BobVault(BaseBobVault):
         else:
             self._snapshot = ()
 
+        self._w3prov.timestamps.report()
+        self._w3prov.responses.report()
+        self._w3prov.report_batching()
+        self._w3prov.report_endpoints()
+
         return True
 
     def process(self, keep_snapshot = False):
@@ -1,3 +1,5 @@
+from typing import Dict
+
 from time import time
 
 from bobstats.settings import Settings
@@ -7,6 +9,7 @@ from bobstats.feeding import prepare_data_for_feeding, BobStatsConnector
 
 from utils.logging import error, info
 from utils.misc import every
+from utils.web3 import Web3Provider
 
 class BobStats:
     _last_main: int = 0
@@ -18,9 +21,11 @@ class BobStats:
     _stats: Stats
     _db: DBAdapter
     _connector: BobStatsConnector
+    _w3_providers: Dict[str, Web3Provider]
 
     def __init__(self, settings: Settings):
         self._stats = Stats(settings)
+        self._w3_providers = settings.w3_providers
         self._db = DBAdapter(settings)
         self._connector = BobStatsConnector(
             base_url=settings.feeding_service_url,
@@ -44,6 +49,11 @@ class BobStats:
                 error(f'Something wrong with preparing data for the feeding service. Plan to upload data next time')
         else:
             error(f'Something wrong with amount of collected data. Interrupt measurements for the next time')
+        for w3prov in self._w3_providers.values():
+            w3prov.timestamps.report()
+            w3prov.responses.report()
+            w3prov.report_batching()
+            w3prov.report_endpoints()
 
     def monitor_feeding_service(self):
         if self._monitor_feedback_counter == (self._monitor_attempts_for_info - 1):
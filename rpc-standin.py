@@ -0,0 +1,73 @@
+from os import getenv
+
+from time import sleep
+
+from utils.cassette import Cassette
+from utils.logging import info
+
+from rpcstandin.server import RPCStandIn
+from rpcstandin.synthetic import SyntheticChain
+
+# Local JSON-RPC stand-in for running the indexer, bobvault-trades and bobstats
+# offline. Point `rpc.url` of a chain in the deployments info to
+# http://<STANDIN_HOST>:<STANDIN_PORT>.
+#
+# STANDIN_CASSETTE is a cassette recorded by the services with WEB3_CASSETTE_DIR
+# set. Requests missing in the cassette are answered by the synthetic chain
+# unless STANDIN_SYNTHETIC is false. The synthetic chain has SYNTHETIC_BLOCKS
+# blocks starting from SYNTHETIC_START_BLOCK with BOB transfers and trades of
+# the BobVault at SYNTHETIC_VAULT in every block.
+#
+# STANDIN_LATENCY and STANDIN_JITTER (seconds) are added to every request,
+# STANDIN_ERROR_RATE of requests fail with HTTP 503 and STANDIN_RATE_LIMITED_RATE
+# of them with HTTP 429.
+
+STANDIN_HOST = getenv('STANDIN_HOST', '127.0.0.1')
+STANDIN_PORT = int(getenv('STANDIN_PORT', 8545))
+STANDIN_CASSETTE = getenv('STANDIN_CASSETTE', '')
+STANDIN_SYNTHETIC = getenv('STANDIN_SYNTHETIC', 'true').lower() == 'true'
+STANDIN_LATENCY = float(getenv('STANDIN_LATENCY', 0))
+STANDIN_JITTER = float(getenv('STANDIN_JITTER', 0))
+STANDIN_ERROR_RATE = float(getenv('STANDIN_ERROR_RATE', 0))
+STANDIN_RATE_LIMITED_RATE = float(getenv('STANDIN_RATE_LIMITED_RATE', 0))
+STANDIN_REPORT_INTERVAL = int(getenv('STANDIN_REPORT_INTERVAL', 60))
+SYNTHETIC_SEED = int(getenv('SYNTHETIC_SEED', 1))
+SYNTHETIC_CHAIN_ID = int(getenv('SYNTHETIC_CHAIN_ID', 137))
+SYNTHETIC_START_BLOCK = int(getenv('SYNTHETIC_START_BLOCK', 1000000))
+SYNTHETIC_BLOCKS = int(getenv('SYNTHETIC_BLOCKS', 10000))
+SYNTHETIC_BLOCK_TIME = int(getenv('SYNTHETIC_BLOCK_TIME', 2))
+SYNTHETIC_TRANSFERS_PER_BLOCK = int(getenv('SYNTHETIC_TRANSFERS_PER_BLOCK', 2))
+SYNTHETIC_TRADES_PER_BLOCK = int(getenv('SYNTHETIC_TRADES_PER_BLOCK', 1))
+SYNTHETIC_HOLDERS = int(getenv('SYNTHETIC_HOLDERS', 1000))
+SYNTHETIC_MAX_LOGS_RANGE = int(getenv('SYNTHETIC_MAX_LOGS_RANGE', 3000))
+SYNTHETIC_VAULT = getenv('SYNTHETIC_VAULT', '')
+
+if __name__ == '__main__':
+    chain = None
+    if STANDIN_SYNTHETIC:
+        chain = SyntheticChain(
+            seed=SYNTHETIC_SEED,
+            chainid=SYNTHETIC_CHAIN_ID,
+            start_block=SYNTHETIC_START_BLOCK,
+            blocks=SYNTHETIC_BLOCKS,
+            block_time=SYNTHETIC_BLOCK_TIME,
+            transfers_per_block=SYNTHETIC_TRANSFERS_PER_BLOCK,
+            trades_per_block=SYNTHETIC_TRADES_PER_BLOCK,
+            holders=SYNTHETIC_HOLDERS,
+            max_logs_range=SYNTHETIC_MAX_LOGS_RANGE,
+            vault=SYNTHETIC_VAULT or None
+        )
+        info(f'synthetic chain: blocks [{chain.start_block}, {chain.head}], vault {chain.vault}')
+    standin = RPCStandIn(
+        cassette=Cassette(STANDIN_CASSETTE).load() if STANDIN_CASSETTE else None,
+        chain=chain,
+        latency=STANDIN_LATENCY,
+        jitter=STANDIN_JITTER,
+        error_rate=STANDIN_ERROR_RATE,
+        rate_limited_rate=STANDIN_RATE_LIMITED_RATE,
+        seed=SYNTHETIC_SEED
+    )
+    standin.start(STANDIN_HOST, STANDIN_PORT)
+    while True:
+        sleep(STANDIN_REPORT_INTERVAL)
+        standin.report()
@@ -0,0 +1,193 @@
+from typing import Optional
+
+from random import Random
+from threading import Thread, Lock
+from time import sleep
+
+from json import loads, dumps
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.cassette import Cassette
+from utils.rpc import request_key
+from utils.logging import info, warning
+
+from .synthetic import SyntheticChain, topics_match
+
+def _block_number(block) -> Optional[int]:
+    # tags like 'latest' do not define a range
+    if isinstance(block, int):
+        return block
+    if isinstance(block, str) and block.startswith('0x'):
+        return int(block, 16)
+    return None
+
+def _as_lower_list(value) -> list:
+    return [v.lower() for v in ([value] if isinstance(value, str) else value)]
+
+def _filter_covers(recorded: dict, requested: dict) -> bool:
+    # checks that every log selected by the requested address and topics is
+    # selected by the recorded ones, block ranges are not considered
+    rec_addresses = _as_lower_list(recorded.get('address') or [])
+    req_addresses = _as_lower_list(requested.get('address') or [])
+    if len(rec_addresses) > 0 and (len(req_addresses) == 0 or not set(req_addresses) <= set(rec_addresses)):
+        return False
+    req_topics = requested.get('topics') or []
+    for (i, rec_topic) in enumerate(recorded.get('topics') or []):
+        if rec_topic == None:
+            continue
+        req_topic = req_topics[i] if i < len(req_topics) else None
+        if req_topic == None or not set(_as_lower_list(req_topic)) <= set(_as_lower_list(rec_topic)):
+            return False
+    return True
+
+class RPCStandIn:
+    # Answers JSON-RPC requests (single ones and batches) from a recorded cassette
+    # and, for requests missing in the cassette, from a synthetic chain.
+    # latency +/- jitter seconds are added to every HTTP request, error_rate of
+    # requests fail with HTTP 503 and rate_limited_rate of them with HTTP 429
+    _cassette: Optional[Cassette]
+    _chain: Optional[SyntheticChain]
+    _latency: float
+    _jitter: float
+    _error_rate: float
+    _rate_limited_rate: float
+    _rnd: Random
+    _lock: Lock
+    served: int
+    missed: int
+    injected: int
+
+    def __init__(
+        self,
+        cassette: Optional[Cassette] = None,
+        chain: Optional[SyntheticChain] = None,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        rate_limited_rate: float = 0,
+        seed: int = 1
+    ):
+        self._cassette = cassette
+        self._chain = chain
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._rate_limited_rate = rate_limited_rate
+        self._rnd = Random(seed)
+        self._lock = Lock()
+        self.served = 0
+        self.missed = 0
+        self.injected = 0
+
+    def _recorded_logs(self, flt: dict) -> Optional[list]:
+        # logs of a window that was not requested during recording are
+        # collected from the windows that were, if their filters select the
+        # requested logs and their block ranges cover the requested range.
+        # Otherwise the window is unknown and None is returned
+        start = _block_number(flt.get('fromBlock', '0x0'))
+        finish = _block_number(flt.get('toBlock'))
+        if start == None or finish == None:
+            return None
+        addresses = _as_lower_list(flt.get('address') or [])
+        ranges = []
+        found = {}
+        for (params, resp) in self._cassette.recorded('eth_getLogs'):
+            if 'result' not in resp or len(params) == 0 or not _filter_covers(params[0], flt):
+                continue
+            rec_start = _block_number(params[0].get('fromBlock', '0x0'))
+            rec_finish = _block_number(params[0].get('toBlock'))
+            if rec_start == None or rec_finish == None or rec_finish < start or rec_start > finish:
+                continue
+            ranges.append((rec_start, rec_finish))
+            for l in resp['result']:
+                number = int(l['blockNumber'], 16)
+                if number < start or number > finish:
+                    continue
+                if len(addresses) > 0 and l['address'].lower() not in addresses:
+                    continue
+                if topics_match(l['topics'], flt.get('topics') or []):
+                    found[(l['blockHash'], l['logIndex'])] = l
+        covered = start
+        for (rec_start, rec_finish) in sorted(ranges):
+            if rec_start > covered:
+                break
+            covered = max(covered, rec_finish + 1)
+        if covered <= finish:
+            return None
+        return sorted(found.values(), key=lambda l: (int(l['blockNumber'], 16), int(l['logIndex'], 16)))
+
+    def handle_one(self, req: dict) -> dict:
+        method = req.get('method')
+        params = req.get('params') or []
+        payload = None
+        if self._cassette:
+            key = request_key(method, params)
+            payload = self._cassette.lookup(key) if key else None
+            if payload == None and method == 'eth_getLogs':
+                logs = self._recorded_logs(params[0])
+                payload = None if logs == None else {'result': logs}
+        if payload == None and self._chain:
+            payload = self._chain.handle(method, params)
+        with self._lock:
+            if payload == None:
+                self.missed += 1
+            else:
+                self.served += 1
+        if payload == None:
+            warning(f'stand-in: no response for {method} {params}')
+            payload = {'error': {'code': -32000, 'message': f'{method} was not recorded'}}
+        return dict({'jsonrpc': '2.0', 'id': req.get('id')}, **payload)
+
+    def _injected_status(self) -> Optional[int]:
+        with self._lock:
+            dice = self._rnd.random()
+            delay = max(self._latency + self._rnd.uniform(-self._jitter, self._jitter), 0)
+            status = None
+            if dice < self._error_rate:
+                status = 503
+            elif dice < self._error_rate + self._rate_limited_rate:
+                status = 429
+            if status:
+                self.injected += 1
+        if delay > 0:
+            sleep(delay)
+        return status
+
+    def handle_http(self, body: bytes) -> tuple:
+        # returns (HTTP status, response body)
+        status = self._injected_status()
+        if status:
+            return (status, b'')
+        req = loads(body)
+        if isinstance(req, list):
+            resp = [self.handle_one(r) for r in req]
+        else:
+            resp = self.handle_one(req)
+        return (200, dumps(resp).encode())
+
+    def report(self):
+        info(f'stand-in: {self.served} requests served, {self.missed} missed, {self.injected} failures injected')
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+        # serves requests in a background thread, the url is
+        # http://<server.server_address[0]>:<server.server_address[1]>
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                (status, data) = standin.handle_http(self.rfile.read(int(self.headers['Content-Length'])))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        info(f'stand-in: listening on http://{server.server_address[0]}:{server.server_address[1]}')
+        return server
@@ -0,0 +1,262 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from functools import cache
+from random import Random
+
+from eth_abi import encode_abi, decode_abi
+
+from web3 import Web3
+
+from utils.constants import BOB_TOKEN_ADDRESS, MULTICALL3_ADDRESS, ZERO_ADDRESS
+
+def _selector(signature: str) -> str:
+    return Web3.keccak(text=signature)[:4].hex()
+
+def _topic(signature: str) -> str:
+    return Web3.toHex(Web3.keccak(text=signature))
+
+def _address_topic(address: str) -> str:
+    return '0x' + '00' * 12 + address[2:].lower()
+
+TRANSFER_TOPIC = _topic('Transfer(address,address,uint256)')
+BUY_TOPIC = _topic('Buy(address,address,uint256,uint256)')
+SELL_TOPIC = _topic('Sell(address,address,uint256,uint256)')
+SWAP_TOPIC = _topic('Swap(address,address,address,uint256,uint256)')
+
+DECIMALS = _selector('decimals()')
+SYMBOL = _selector('symbol()')
+TOTAL_SUPPLY = _selector('totalSupply()')
+BALANCE_OF = _selector('balanceOf(address)')
+COLLATERAL = _selector('collateral(address)')
+STAT = _selector('stat(address)')
+AGGREGATE3 = _selector('aggregate3((address,bool,bytes)[])')
+
+class SyntheticChain:
+    # Deterministic chain with BOB transfers and BobVault trades in every block.
+    # Everything is derived from the seed and the block number so the same
+    # requests get the same responses in every run and in every process.
+    # eth_getLogs for more than max_logs_range blocks is rejected the same way
+    # public endpoints do it
+    chainid: int
+    start_block: int
+    head: int
+    _seed: int
+    _block_time: int
+    _genesis_timestamp: int
+    _transfers_per_block: int
+    _trades_per_block: int
+    _max_logs_range: int
+    vault: str
+    collaterals: List[str]
+    holders: List[str]
+
+    def __init__(
+        self,
+        seed: int = 1,
+        chainid: int = 137,
+        start_block: int = 1000000,
+        blocks: int = 10000,
+        block_time: int = 2,
+        genesis_timestamp: int = 1672531200,
+        transfers_per_block: int = 2,
+        trades_per_block: int = 1,
+        holders: int = 1000,
+        max_logs_range: int = 3000,
+        vault: str = None
+    ):
+        rnd = Random(seed)
+        self.chainid = chainid
+        self.start_block = start_block
+        self.head = start_block + blocks - 1
+        self._seed = seed
+        self._block_time = block_time
+        self._genesis_timestamp = genesis_timestamp
+        self._transfers_per_block = transfers_per_block
+        self._trades_per_block = trades_per_block
+        self._max_logs_range = max_logs_range
+        self.vault = Web3.toChecksumAddress(vault or '0x' + rnd.randbytes(20).hex())
+        self.collaterals = [Web3.toChecksumAddress('0x' + rnd.randbytes(20).hex()) for _ in range(3)]
+        self.holders = [Web3.toChecksumAddress('0x' + rnd.randbytes(20).hex()) for _ in range(max(holders, 2))]
+
+    def _block_hash(self, number: int) -> str:
+        return Web3.toHex(Web3.keccak(text=f'{self._seed}/block/{number}'))
+
+    def _timestamp(self, number: int) -> int:
+        return self._genesis_timestamp + (number - self.start_block) * self._block_time
+
+    def block(self, number: int) -> Optional[dict]:
+        if number < 0 or number > self.head:
+            return None
+        return {
+            'number': hex(number),
+            'hash': self._block_hash(number),
+            'parentHash': self._block_hash(number - 1),
+            'timestamp': hex(self._timestamp(number)),
+            'miner': ZERO_ADDRESS,
+            'extraData': '0x',
+            'gasLimit': hex(30000000),
+            'gasUsed': '0x0',
+            'difficulty': '0x0',
+            'totalDifficulty': '0x0',
+            'size': '0x0',
+            'nonce': '0x0000000000000000',
+            'logsBloom': '0x' + '00' * 256,
+            'transactionsRoot': '0x' + '00' * 32,
+            'stateRoot': '0x' + '00' * 32,
+            'receiptsRoot': '0x' + '00' * 32,
+            'sha3Uncles': '0x' + '00' * 32,
+            'uncles': [],
+            'transactions': []
+        }
+
+    @cache
+    def _block_numbers_by_hash(self) -> Dict[str, int]:
+        # hashes are not reversible so all of them are calculated once
+        return {self._block_hash(n): n for n in range(self.start_block, self.head + 1)}
+
+    def block_by_hash(self, blockhash: str) -> Optional[dict]:
+        number = self._block_numbers_by_hash().get(blockhash.lower())
+        return None if number == None else self.block(number)
+
+    def _log(self, number: int, index: int, address: str, topics: list, data: bytes) -> dict:
+        return {
+            'address': address,
+            'topics': topics,
+            'data': Web3.toHex(data),
+            'blockNumber': hex(number),
+            'blockHash': self._block_hash(number),
+            'transactionHash': Web3.toHex(Web3.keccak(text=f'{self._seed}/tx/{number}/{index}')),
+            'transactionIndex': hex(index),
+            'logIndex': hex(index),
+            'removed': False
+        }
+
+    def block_logs(self, number: int) -> list:
+        rnd = Random(f'{self._seed}/logs/{number}')
+        logs = []
+        for _ in range(self._transfers_per_block):
+            # a tenth of transfers are mints to keep balances positive
+            sender = ZERO_ADDRESS if rnd.random() < 0.1 else rnd.choice(self.holders)
+            logs.append(self._log(number, len(logs), BOB_TOKEN_ADDRESS,
+                                  [TRANSFER_TOPIC, _address_topic(sender), _address_topic(rnd.choice(self.holders))],
+                                  encode_abi(['uint256'], [rnd.randrange(10 ** 15, 10 ** 21)])))
+        for _ in range(self._trades_per_block):
+            user = _address_topic(rnd.choice(self.holders))
+            amount = rnd.randrange(10 ** 6, 10 ** 10)
+            kind = rnd.randrange(3)
+            if kind == 0:
+                logs.append(self._log(number, len(logs), self.vault,
+                                      [BUY_TOPIC, _address_topic(rnd.choice(self.collaterals)), user],
+                                      encode_abi(['uint256', 'uint256'], [amount, amount * 10 ** 12])))
+            elif kind == 1:
+                logs.append(self._log(number, len(logs), self.vault,
+                                      [SELL_TOPIC, _address_topic(rnd.choice(self.collaterals)), user],
+                                      encode_abi(['uint256', 'uint256'], [amount * 10 ** 12, amount])))
+            else:
+                (token_in, token_out) = rnd.sample(self.collaterals, 2)
+                logs.append(self._log(number, len(logs), self.vault,
+                                      [SWAP_TOPIC, _address_topic(token_in), user],
+                                      encode_abi(['address', 'uint256', 'uint256'], [token_out, amount, amount])))
+        return logs
+
+    def _block_param(self, value: Any, default: int) -> int:
+        if value == None:
+            return default
+        if value == 'earliest':
+            return 0
+        if value in ('latest', 'safe', 'finalized', 'pending'):
+            return self.head
+        return int(value, 16) if isinstance(value, str) else value
+
+    def get_logs(self, flt: dict) -> Tuple[Optional[list], Optional[dict]]:
+        # returns (logs, error)
+        start = self._block_param(flt.get('fromBlock'), self.head)
+        finish = min(self._block_param(flt.get('toBlock'), self.head), self.head)
+        if finish - start > self._max_logs_range:
+            return (None, {'code': -32005, 'message': f'block range is too large, max is {self._max_logs_range}'})
+        addresses = flt.get('address')
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        addresses = [a.lower() for a in addresses] if addresses else None
+        topics = flt.get('topics') or []
+        logs = []
+        for number in range(max(start, self.start_block), finish + 1):
+            for l in self.block_logs(number):
+                if addresses and l['address'].lower() not in addresses:
+                    continue
+                if topics_match(l['topics'], topics):
+                    logs.append(l)
+        return (logs, None)
+
+    def _word(self, *parts) -> int:
+        # deterministic pseudo random value for the contract state
+        return int.from_bytes(Web3.keccak(text='/'.join([str(self._seed)] + [str(p) for p in parts])), 'big')
+
+    def call(self, to: str, data: str, block: int) -> Tuple[bool, bytes]:
+        # returns (success, return data) of a contract call
+        to = Web3.toChecksumAddress(to)
+        selector = data[:10]
+        args = bytes.fromhex(data[10:])
+        if to == MULTICALL3_ADDRESS and selector == AGGREGATE3:
+            calls = decode_abi(['(address,bool,bytes)[]'], args)[0]
+            results = [self.call(target, Web3.toHex(calldata), block) for (target, _, calldata) in calls]
+            return (True, encode_abi(['(bool,bytes)[]'], [results]))
+        if to == self.vault and selector == COLLATERAL:
+            token = decode_abi(['address'], args)[0]
+            balance = self._word('collateral', token, block) % 10 ** 13
+            return (True, encode_abi(['uint128', 'uint128', 'uint96', 'address', 'uint128', 'uint64', 'uint64'],
+                                     [balance, balance // 10, 0, ZERO_ADDRESS, 10 ** 18, 10 ** 14, 10 ** 14]))
+        if to == self.vault and selector == STAT:
+            token = decode_abi(['address'], args)[0]
+            total = self._word('stat', token, block) % 10 ** 12
+            return (True, encode_abi(['(uint256,uint256,uint256)'], [(total, total // 3, total // 2)]))
+        if selector == DECIMALS:
+            return (True, encode_abi(['uint8'], [18 if to == BOB_TOKEN_ADDRESS else 6]))
+        if selector == SYMBOL:
+            symbol = 'BOB' if to == BOB_TOKEN_ADDRESS else f'TKN{self._word("symbol", to) % 1000}'
+            return (True, encode_abi(['string'], [symbol]))
+        if selector == TOTAL_SUPPLY:
+            return (True, encode_abi(['uint256'], [10 ** 24 + self._word('supply', to, block) % 10 ** 24]))
+        if selector == BALANCE_OF:
+            owner = decode_abi(['address'], args)[0]
+            return (True, encode_abi(['uint256'], [self._word('balance', to, owner, block) % 10 ** 24]))
+        return (False, b'')
+
+    def handle(self, method: str, params: list) -> dict:
+        # returns the payload of the response: {'result': ...} or {'error': ...}
+        if method == 'eth_chainId':
+            return {'result': hex(self.chainid)}
+        if method == 'net_version':
+            return {'result': str(self.chainid)}
+        if method == 'eth_blockNumber':
+            return {'result': hex(self.head)}
+        if method == 'eth_getBlockByNumber':
+            return {'result': self.block(self._block_param(params[0], self.head))}
+        if method == 'eth_getBlockByHash':
+            return {'result': self.block_by_hash(params[0])}
+        if method == 'eth_getLogs':
+            (logs, err) = self.get_logs(params[0])
+            return {'error': err} if err else {'result': logs}
+        if method == 'eth_getCode':
+            # every address looks like a contract, Multicall3 included
+            return {'result': '0x6080'}
+        if method == 'eth_call':
+            block = self._block_param(params[1] if len(params) > 1 else 'latest', self.head)
+            (success, data) = self.call(params[0]['to'], params[0].get('data', params[0].get('input', '0x')), block)
+            if not success:
+                return {'error': {'code': 3, 'message': 'execution reverted', 'data': '0x'}}
+            return {'result': Web3.toHex(data)}
+        return {'error': {'code': -32601, 'message': f'the method {method} does not exist/is not available'}}
+
+def topics_match(log_topics: list, flt_topics: list) -> bool:
+    for i in range(len(flt_topics)):
+        expected = flt_topics[i]
+        if expected == None:
+            continue
+        if i >= len(log_topics):
+            return False
+        if isinstance(expected, str):
+            expected = [expected]
+        if log_topics[i].lower() not in [t.lower() for t in expected]:
+            return False
+    return True
@@ -0,0 +1,75 @@
+from json import loads, dumps
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import unittest
+
+from web3.exceptions import BlockNotFound
+
+from utils.web3 import Web3Provider
+
+BLOCK = {
+    'number': '0x1',
+    'hash': '0x' + '11' * 32,
+    'timestamp': '0x64'
+}
+
+def answer(req: dict) -> dict:
+    result = None
+    if req['method'] == 'eth_getBlockByNumber' and req['params'][0] == BLOCK['number']:
+        result = BLOCK
+    # unknown blocks are answered with null result
+    return {'jsonrpc': '2.0', 'id': req['id'], 'result': result}
+
+class StubHandler(BaseHTTPRequestHandler):
+    # some public endpoints answer single JSON-RPC requests only
+    accept_batches = True
+
+    def do_POST(self):
+        req = loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if not isinstance(req, list):
+            resp = answer(req)
+        elif self.accept_batches:
+            resp = [answer(r) for r in req]
+        else:
+            resp = {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': 'batch requests are not supported'}}
+        body = dumps(resp).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class BatchRejectingHandler(StubHandler):
+    accept_batches = False
+
+class BatchingTest(unittest.TestCase):
+    handler = BatchRejectingHandler
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.w3 = Web3Provider('eth', f'http://127.0.0.1:{self.server.server_port}',
+                               retry_attemtps=1, retry_delay=0, batch_max_size=50)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_failed_element_is_retried(self):
+        # the element failed in the batch is sent alone and must not wait
+        # for the future of the submitted call
+        for _ in range(5):
+            resp = self.w3.submit('eth_getBlockByNumber', [BLOCK['number'], False]).result(timeout=5)
+            self.assertEqual(resp['timestamp'], BLOCK['timestamp'])
+
+    def test_unknown_block(self):
+        self.assertEqual(self.w3.get_block_timestamp(1), 100)
+        with self.assertRaises(BlockNotFound):
+            self.w3.get_block_timestamp(2)
+
+class BatchesAcceptedTest(BatchingTest):
+    handler = StubHandler
@@ -0,0 +1,59 @@
+import unittest
+
+from bobstats.inventories import crosscheck
+from bobstats.inventories.tickmath import MIN_TICK, MAX_TICK, Q96, Q128, Q256, \
+                                          get_sqrt_ratio_at_tick, get_amount0_delta, get_amount1_delta, \
+                                          get_amounts_for_liquidity, get_fee_growth_inside, get_fees_owed
+
+# encodePriceSqrt(121, 100) of the Uniswap V3 core tests
+SQRT_PRICE_1_21 = 87150978765690771352898345369
+TICK_1_21 = 1906
+
+class TickMathTest(unittest.TestCase):
+    # expected values are taken from the tests of Uniswap V3 core
+
+    def test_sqrt_ratio_at_tick(self):
+        self.assertEqual(get_sqrt_ratio_at_tick(MIN_TICK), 4295128739)
+        self.assertEqual(get_sqrt_ratio_at_tick(MIN_TICK + 1), 4295343490)
+        self.assertEqual(get_sqrt_ratio_at_tick(0), Q96)
+        self.assertEqual(get_sqrt_ratio_at_tick(MAX_TICK - 1), 1461373636630004318706518188784493106690254656249)
+        self.assertEqual(get_sqrt_ratio_at_tick(MAX_TICK), 1461446703485210103287273052203988822378723970342)
+        self.assertLessEqual(get_sqrt_ratio_at_tick(TICK_1_21), SQRT_PRICE_1_21)
+        self.assertLess(SQRT_PRICE_1_21, get_sqrt_ratio_at_tick(TICK_1_21 + 1))
+        with self.assertRaises(ValueError):
+            get_sqrt_ratio_at_tick(MAX_TICK + 1)
+
+    def test_amount_deltas(self):
+        # amounts are rounded down when liquidity is removed
+        self.assertEqual(get_amount0_delta(Q96, SQRT_PRICE_1_21, 10 ** 18), 90909090909090910 - 1)
+        self.assertEqual(get_amount1_delta(Q96, SQRT_PRICE_1_21, 10 ** 18), 100000000000000000 - 1)
+
+    def test_position_in_range(self):
+        (amount0, amount1) = get_amounts_for_liquidity(SQRT_PRICE_1_21, TICK_1_21, 0, MAX_TICK, 10 ** 18)
+        self.assertEqual(amount0, 909090909090909090)
+        self.assertEqual(amount1, 100000000000000000 - 1)
+
+    def test_position_out_of_range(self):
+        # the price is below the range so the position holds token0 only
+        (amount0, amount1) = get_amounts_for_liquidity(SQRT_PRICE_1_21, TICK_1_21, 2000, 4000, 10 ** 18)
+        self.assertEqual(amount1, 0)
+        self.assertEqual(amount0, get_amount0_delta(get_sqrt_ratio_at_tick(2000), get_sqrt_ratio_at_tick(4000), 10 ** 18))
+        self.assertAlmostEqual(amount0 / 10 ** 18, 1.0001 ** -1000 - 1.0001 ** -2000, places=12)
+        # above the range it holds token1 only
+        (amount0, amount1) = get_amounts_for_liquidity(SQRT_PRICE_1_21, TICK_1_21, -4000, 0, 10 ** 18)
+        self.assertEqual(amount0, 0)
+        self.assertEqual(amount1, get_amount1_delta(get_sqrt_ratio_at_tick(-4000), Q96, 10 ** 18))
+
+    def test_fee_growth_wraparound(self):
+        # fee growth outside of the lower tick overflowed uint256
+        inside = get_fee_growth_inside(TICK_1_21, 0, 4000, 2 * Q128, Q256 - 3 * Q128, Q128)
+        self.assertEqual(inside, 4 * Q128)
+        # the last fee growth inside is above the current one after the overflow
+        self.assertEqual(get_fees_owed(inside, Q256 - Q128, 10 ** 18), 5 * 10 ** 18)
+        self.assertEqual(get_fees_owed(5, Q256 - 5, Q128), 10)
+
+class CrosscheckFixturesTest(unittest.TestCase):
+
+    def test_fixtures(self):
+        crosscheck.FIXTURES_DIR = 'tests/fixtures'
+        self.assertTrue(crosscheck.check())
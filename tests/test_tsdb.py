@@ -0,0 +1,48 @@
+from os import environ
+from time import tzset
+from tempfile import mkdtemp
+from datetime import datetime, timezone
+
+import unittest
+
+from tinyflux import Point
+
+from utils.tsdb import TINYFLUX_ENGINE, SQLITE_ENGINE, open_storage
+
+class NaiveTimesTest(unittest.TestCase):
+    # naive datetimes written by the services must be stored at the same
+    # UTC time by both engines on a host with a non-UTC time zone
+
+    def setUp(self):
+        self._tz = environ.get('TZ')
+        environ['TZ'] = 'Europe/Berlin'
+        tzset()
+
+    def tearDown(self):
+        if self._tz == None:
+            del environ['TZ']
+        else:
+            environ['TZ'] = self._tz
+        tzset()
+
+    def test_naive_time_is_local(self):
+        ts = 1700000000
+        tsdb_dir = mkdtemp()
+        for engine in (TINYFLUX_ENGINE, SQLITE_ENGINE):
+            with self.subTest(engine=engine):
+                tsdb = open_storage(f'{tsdb_dir}/fees.csv', engine)
+                tsdb.insert([Point(
+                    time=datetime.fromtimestamp(ts),
+                    tags={'id': 'pool'},
+                    fields={'BOB': 1.5, 'count': 2}
+                )])
+                self.assertEqual(tsdb.earliest('_default'), ts)
+                point = tsdb.latest_point()
+                self.assertEqual(point.time, datetime.fromtimestamp(ts, timezone.utc))
+                self.assertEqual(point.tags, {'id': 'pool'})
+                self.assertEqual(float(point.fields['BOB']), 1.5)
+                self.assertEqual([p.time for p in tsdb.points_at('_default', ts)], [point.time])
+                tsdb.close()
+
+if __name__ == '__main__':
+    unittest.main()
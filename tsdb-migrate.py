@@ -0,0 +1,77 @@
+from os import getenv, remove, replace
+from os.path import exists, splitext
+from glob import glob
+
+from time import perf_counter
+
+from utils.logging import info, error
+from utils.tsdb import STORAGE_ENGINES, TINYFLUX_ENGINE, SQLITE_ENGINE, open_storage, storage_filename
+
+# Converts the timeseries dbs in TSDB_DIR from the MIGRATE_FROM engine to the
+# MIGRATE_TO one: monthly transfers partitions, composed stats and yields and
+# BobVault fees. The dbs are found by MIGRATE_PATTERN applied to the names of
+# TinyFlux CSVs, SQLite dbs are named the same with the .sqlite extension.
+# An existing target db is skipped unless MIGRATE_OVERWRITE is true. The target
+# is written to a temporary file and renamed once all points are copied, so
+# the services must be stopped while the dbs are converted. Set TSDB_ENGINE
+# for the services to MIGRATE_TO afterwards.
+
+TSDB_DIR = getenv('TSDB_DIR', 'tsdb')
+MIGRATE_FROM = getenv('MIGRATE_FROM', TINYFLUX_ENGINE)
+MIGRATE_TO = getenv('MIGRATE_TO', SQLITE_ENGINE)
+MIGRATE_PATTERN = getenv('MIGRATE_PATTERN', '*.csv')
+MIGRATE_BATCH_SIZE = int(getenv('MIGRATE_BATCH_SIZE', 5000))
+MIGRATE_OVERWRITE = getenv('MIGRATE_OVERWRITE', 'false').lower() == 'true'
+
+def migrate(db_file: str) -> bool:
+    source_file = storage_filename(db_file, MIGRATE_FROM)
+    target_file = storage_filename(db_file, MIGRATE_TO)
+    if exists(target_file) and not MIGRATE_OVERWRITE:
+        info(f'{target_file}: exists already, skipping')
+        return False
+
+    tmp_file = f'{target_file}.migrating'
+    if exists(tmp_file):
+        remove(tmp_file)
+
+    start = perf_counter()
+    source = open_storage(db_file, MIGRATE_FROM)
+    target = STORAGE_ENGINES[MIGRATE_TO](tmp_file)
+    counter = 0
+    batch = []
+    try:
+        for point in source.points():
+            batch.append(point)
+            if len(batch) == MIGRATE_BATCH_SIZE:
+                target.insert(batch)
+                counter += len(batch)
+                batch = []
+                info(f'{source_file}: copied {counter} points')
+        if len(batch) > 0:
+            target.insert(batch)
+            counter += len(batch)
+    finally:
+        source.close()
+        target.close()
+
+    replace(tmp_file, target_file)
+    info(f'{source_file}: {counter} points copied to {target_file} in {perf_counter() - start:.2f} secs')
+    return True
+
+if __name__ == '__main__':
+    for engine in (MIGRATE_FROM, MIGRATE_TO):
+        if not engine in STORAGE_ENGINES:
+            error(f'Unknown timeseries db engine {engine}')
+            exit(1)
+    if MIGRATE_FROM == MIGRATE_TO:
+        error('Source and target engines are the same')
+        exit(1)
+
+    sources = sorted(glob(storage_filename(f'{TSDB_DIR}/{MIGRATE_PATTERN}', MIGRATE_FROM)))
+    info(f'Found {len(sources)} dbs to migrate from {MIGRATE_FROM} to {MIGRATE_TO} in {TSDB_DIR}')
+    migrated = 0
+    for source_file in sources:
+        # the dbs are addressed by the names of TinyFlux CSVs
+        if migrate(f'{splitext(source_file)[0]}.csv'):
+            migrated += 1
+    info(f'{migrated} dbs migrated')
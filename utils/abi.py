@@ -9,10 +9,13 @@ from .constants import ABI_DIR
 class ABI(Enum):
     ERC20 = "erc20.json"
     UNIV3_PM = "uniswapv3_pm.json"
+    UNIV3_FACTORY = "uniswapv3_factory.json"
+    UNIV3_POOL = "uniswapv3_pool.json"
     KYBERSWAP_PM = "kyberswap_elastic_pm.json"
     KYBERSWAP_FACTORY = "kyberswap_elastic_factory.json"
     KYBERSWAP_POOL = "kyberswap_elastic_pool.json"
     BOBVAULT = "bobvault.json"
+    MULTICALL3 = "multicall3.json"
 
 @cache
 def get_abi(fname: ABI) -> dict:
@@ -0,0 +1,55 @@
+from typing import Any, Dict, List, Optional
+
+from threading import Lock
+
+from json import dumps, loads
+
+from .logging import info, error
+
+class Cassette:
+    # JSON-RPC requests and the responses of the endpoints stored as JSON lines
+    # {"key", "method", "params", "response"}. Providers append the responses
+    # they get to the cassette in the recording mode, the RPC stand-in replays
+    # them. The last recorded response wins if the same request was recorded
+    # several times, e.g. eth_blockNumber
+    _filename: str
+    _lock: Lock
+    responses: Dict[str, dict]
+    requests: Dict[str, dict]
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._lock = Lock()
+        self.responses = {}
+        self.requests = {}
+
+    def load(self) -> 'Cassette':
+        info(f'Loading cassette {self._filename}')
+        try:
+            with open(self._filename) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    rec = loads(line)
+                    self.responses[rec['key']] = rec['response']
+                    self.requests[rec['key']] = {'method': rec['method'], 'params': rec['params']}
+        except IOError as e:
+            error(f'Cannot load cassette {self._filename}: {e}')
+        info(f'{len(self.responses)} requests loaded from {self._filename}')
+        return self
+
+    def record(self, key: str, method: str, params: Any, response: dict):
+        # only the payload is kept, ids are assigned by the replaying side
+        payload = {k: response[k] for k in ('result', 'error') if k in response}
+        line = dumps({'key': key, 'method': method, 'params': params, 'response': payload}, default=str)
+        with self._lock:
+            with open(self._filename, 'a') as f:
+                f.write(line + '\n')
+
+    def lookup(self, key: str) -> Optional[dict]:
+        return self.responses.get(key)
+
+    def recorded(self, method: str) -> List[tuple]:
+        # returns (params, response) of all recorded requests of the method
+        return [(self.requests[k]['params'], self.responses[k])
+                for k in self.requests if self.requests[k]['method'] == method]
@@ -9,6 +9,8 @@ ONE_ETHER = 10 ** 18
 
 BOB_TOKEN_ADDRESS = Web3.toChecksumAddress("0xB0B195aEFA3650A6908f15CdaC7D92F8a5791B0B")
 ZERO_ADDRESS = Web3.toChecksumAddress("0x0000000000000000000000000000000000000000")
+# Multicall3 is deployed to the same address on most of EVM chains
+MULTICALL3_ADDRESS = Web3.toChecksumAddress("0xcA11bde05977b3631167028862bE2a173976CA11")
 
 ABI_DIR = 'abi'
 
@@ -0,0 +1,113 @@
+from typing import Optional
+
+import os
+import fcntl
+
+from functools import cache
+from hashlib import sha1
+from json import loads, dumps
+from contextlib import contextmanager
+
+from time import time, sleep
+from threading import Lock
+
+# the rate is not reduced below this share of the configured rate
+MIN_RATE_SHARE = 0.05
+# share of the configured rate restored every second after the rate was reduced
+RECOVERY_SPEED = 0.02
+
+class TokenBucket:
+    # Requests per second limiter allowing bursts up to `burst` requests.
+    # If lock_file is set the state of the bucket is kept in this file so
+    # the limit is shared by all processes on the host using the same file.
+    # The rate is halved every time the endpoint answers with 429 and
+    # restored gradually
+    _max_rate: float
+    _burst: int
+    _lock_file: Optional[str]
+    _state: dict
+    _lock: Lock
+
+    def __init__(self, rate: float, burst: int, lock_file: Optional[str] = None):
+        self._max_rate = rate
+        self._burst = max(burst, 1)
+        self._lock_file = lock_file
+        self._state = self._initial_state()
+        self._lock = Lock()
+
+    def _initial_state(self) -> dict:
+        return {'tokens': self._burst, 'updated': time(), 'rate': self._max_rate}
+
+    @contextmanager
+    def _locked_state(self):
+        with self._lock:
+            if not self._lock_file:
+                yield self._state
+                return
+            with open(self._lock_file, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = loads(f.read())
+                    except ValueError:
+                        state = self._initial_state()
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _reserve(self) -> float:
+        # takes a token if it is available, otherwise returns the time
+        # to wait for the next one
+        with self._locked_state() as state:
+            now = time()
+            elapsed = max(now - state['updated'], 0)
+            tokens = min(self._burst, state['tokens'] + elapsed * state['rate'])
+            state['rate'] = min(state['rate'] + elapsed * self._max_rate * RECOVERY_SPEED, self._max_rate)
+            state['updated'] = now
+            if tokens >= 1:
+                state['tokens'] = tokens - 1
+                return 0
+            state['tokens'] = tokens
+            return (1 - tokens) / state['rate']
+
+    def acquire(self):
+        while True:
+            delay = self._reserve()
+            if delay <= 0:
+                return
+            sleep(delay)
+
+    def throttle(self) -> float:
+        # returns the reduced rate
+        with self._locked_state() as state:
+            state['rate'] = max(state['rate'] / 2, self._max_rate * MIN_RATE_SHARE)
+            state['tokens'] = 0
+            return state['rate']
+
+    def rate(self) -> float:
+        with self._locked_state() as state:
+            return state['rate']
+
+@cache
+def get_rate_limiter(url: str, rate: float, burst: int, lock_dir: str = '') -> Optional[TokenBucket]:
+    # providers of different chains or services within one process use
+    # the same limiter if they share the endpoint
+    if rate <= 0:
+        return None
+    lock_file = None
+    if lock_dir:
+        # urls often contain API keys so they are not exposed in the file names
+        lock_file = os.path.join(lock_dir, f'rpc-{sha1(url.encode()).hexdigest()[:16]}.bucket')
+    return TokenBucket(rate, burst, lock_file)
+
+def is_rate_limited(e: Exception) -> bool:
+    response = getattr(e, 'response', None)
+    if response is not None and getattr(response, 'status_code', None) == 429:
+        return True
+    msg = str(e).lower()
+    return 'too many requests' in msg or 'rate limit' in msg
@@ -0,0 +1,145 @@
+from typing import Any, Optional
+from collections import OrderedDict
+
+from threading import Lock
+from time import time
+
+from json import dumps, loads
+
+import sqlite3
+
+from .logging import info
+
+# positions of the block identifier in params of the methods whose results
+# never change for a finalized block
+BLOCK_PARAM_POSITION = {
+    'eth_call': 1,
+    'eth_getBalance': 1,
+    'eth_getCode': 1,
+    'eth_getStorageAt': 2,
+    'eth_getBlockByNumber': 0
+}
+# results of these methods depend on the hash only
+HASH_ADDRESSED_METHODS = ['eth_getBlockByHash']
+
+# the disk cache is trimmed by this share of its size at once
+DISK_EVICTION_SHARE = 0.1
+
+def pinned_block(method: str, params: Any) -> Optional[int]:
+    # returns the block number the request is pinned to or None if the request
+    # refers to a tag like 'latest' or the method is not cacheable
+    pos = BLOCK_PARAM_POSITION.get(method)
+    if pos == None or not isinstance(params, (list, tuple)) or len(params) <= pos:
+        return None
+    block = params[pos]
+    if isinstance(block, int):
+        return block
+    if isinstance(block, str) and block.startswith('0x'):
+        try:
+            return int(block, 16)
+        except ValueError:
+            return None
+    return None
+
+class ResponseCache:
+    # Results of RPC requests pinned to finalized blocks. They are kept in memory
+    # with LRU eviction and, if a directory is configured, in an SQLite table so
+    # restarts and backfills do not request the same data again. Both storages
+    # are bounded by the total size of stored results in bytes
+    _chainid: str
+    _max_memory: int
+    _max_disk: int
+    _memory: OrderedDict
+    _memory_size: int
+    _disk_size: int
+    _lock: Lock
+    _db: Optional[sqlite3.Connection]
+    hits: int
+    disk_hits: int
+    misses: int
+
+    def __init__(self, chainid: str, cache_dir: Optional[str] = None,
+                 max_memory: int = 64 * 1024 * 1024, max_disk: int = 1024 * 1024 * 1024):
+        self._chainid = chainid
+        self._max_memory = max_memory
+        self._max_disk = max_disk
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        self._lock = Lock()
+        self._db = None
+        if cache_dir:
+            fn = f'{cache_dir}/{chainid}-rpc-responses.sqlite'
+            info(f'{chainid}: RPC responses are stored in {fn}')
+            self._db = sqlite3.connect(fn, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, result TEXT, size INTEGER, accessed INTEGER)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._disk_size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def report(self, reset: bool = True):
+        info(f'{self._chainid}: RPC responses cache: {self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses, ' +
+             f'{self._memory_size} bytes in memory, {self._disk_size} bytes on disk')
+        if reset:
+            self.reset_counters()
+
+    def _remember(self, key: str, raw: str):
+        if key in self._memory:
+            self._memory_size -= len(self._memory[key])
+        self._memory[key] = raw
+        self._memory.move_to_end(key)
+        self._memory_size += len(raw)
+        while self._memory_size > self._max_memory and len(self._memory) > 0:
+            self._memory_size -= len(self._memory.popitem(last=False)[1])
+
+    def _trim_disk(self):
+        if self._disk_size <= self._max_disk:
+            return
+        target = self._max_disk * (1 - DISK_EVICTION_SHARE)
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        evicted = []
+        for (key, size) in rows:
+            if self._disk_size <= target:
+                break
+            evicted.append((key,))
+            self._disk_size -= size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+        info(f'{self._chainid}: {len(evicted)} RPC responses evicted from the disk cache')
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return loads(self._memory[key])
+            if self._db:
+                row = self._db.execute('SELECT result FROM responses WHERE key = ?', (key,)).fetchone()
+                if row:
+                    self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (int(time()), key))
+                    self.disk_hits += 1
+                    self._remember(key, row[0])
+                    return loads(row[0])
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: Any):
+        # empty results are not stored since they can change
+        if result == None:
+            return
+        raw = dumps(result)
+        with self._lock:
+            self._remember(key, raw)
+            if self._db:
+                cur = self._db.execute(
+                    'INSERT OR IGNORE INTO responses (key, result, size, accessed) VALUES (?, ?, ?, ?)',
+                    (key, raw, len(raw), int(time()))
+                )
+                if cur.rowcount > 0:
+                    self._disk_size += len(raw)
+                    self._trim_disk()
@@ -0,0 +1,350 @@
+from typing import Callable, Any, List, Dict, Optional
+
+from time import time
+from threading import Lock
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from copy import deepcopy
+from json import dumps
+
+import requests
+
+from web3 import HTTPProvider
+from web3.providers.base import JSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from .logging import info, warning
+from .ratelimit import TokenBucket, get_rate_limiter, is_rate_limited
+from .responses import ResponseCache, pinned_block, HASH_ADDRESSED_METHODS
+from .cassette import Cassette
+
+# weight of the latest measurement in the moving averages of latency and error rate
+HEALTH_SMOOTHING = 0.2
+# seconds added to the latency of an endpoint failing every request
+FAILURE_COST = 1.0
+# the finalized block is refreshed not more often than once per this interval
+HEAD_CHECK_INTERVAL = 30
+
+# requests changing the state of the node must be sent every time
+NOT_DEDUPLICATED_METHODS = [
+    'eth_sendRawTransaction',
+    'eth_sendTransaction',
+    'eth_newFilter',
+    'eth_newBlockFilter',
+    'eth_getFilterChanges',
+    'eth_uninstallFilter'
+]
+
+def request_key(method: str, params: Any) -> Optional[str]:
+    # params of eth_call and others include the block identifier so requests
+    # to different blocks get different keys
+    if method in NOT_DEDUPLICATED_METHODS:
+        return None
+    return f'{method}:{dumps(params, sort_keys=True, default=str)}'
+
+class SingleFlight:
+    # Identical requests issued concurrently share one network call and its result.
+    # Futures of submitted calls are kept apart from the calls made with `do`:
+    # a submitted call failed in a batch is retried with `do` under the same key
+    # and must not wait for its own future
+    _inflight: Dict[str, Future]
+    _submitted: Dict[str, Future]
+    _lock: Lock
+    shared: int
+
+    def __init__(self):
+        self._inflight = {}
+        self._submitted = {}
+        self._lock = Lock()
+        self.shared = 0
+
+    def do(self, key: Optional[str], func: Callable) -> Any:
+        if key == None:
+            return func()
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future == None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.shared += 1
+        if not leader:
+            # every caller gets its own copy of the response to format
+            return deepcopy(future.result())
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise e
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def submit(self, key: Optional[str], start: Callable[[], Future]) -> Future:
+        # the same as `do` for calls returning futures
+        if key == None:
+            return start()
+        with self._lock:
+            future = self._submitted.get(key)
+            if future != None:
+                self.shared += 1
+                return future
+            future = start()
+            self._submitted[key] = future
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key: str, future: Future):
+        with self._lock:
+            if self._submitted.get(key) is future:
+                del self._submitted[key]
+
+class EndpointHealth:
+    url: str
+    provider: HTTPProvider
+    latency: float
+    error_rate: float
+    consecutive_failures: int
+    ejected_until: float
+    limiter: Optional[TokenBucket]
+    _lock: Lock
+
+    def __init__(self, url: str, limiter: Optional[TokenBucket] = None):
+        self.url = url
+        self.provider = HTTPProvider(url)
+        self.limiter = limiter
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self._lock = Lock()
+
+    def score(self) -> float:
+        # lower is better, endpoints that were not used yet are tried first
+        return self.latency + FAILURE_COST * self.error_rate
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def record_success(self, latency: float):
+        with self._lock:
+            if self.latency == 0.0:
+                self.latency = latency
+            else:
+                self.latency += HEALTH_SMOOTHING * (latency - self.latency)
+            self.error_rate -= HEALTH_SMOOTHING * self.error_rate
+            self.consecutive_failures = 0
+            self.ejected_until = 0.0
+
+    def record_failure(self, failure_threshold: int, eject_time: int) -> bool:
+        # returns True if the circuit breaker ejected the endpoint
+        with self._lock:
+            self.error_rate += HEALTH_SMOOTHING * (1 - self.error_rate)
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= failure_threshold:
+                self.ejected_until = time() + eject_time
+                return True
+            return False
+
+class FailoverHTTPProvider(JSONBaseProvider):
+    # Sends every request to the healthiest endpoint of the chain. If the request
+    # fails on the transport level it is repeated on the next-best endpoint right
+    # away. An endpoint failed failure_threshold times in a row is ejected for
+    # eject_time seconds. If hedge_delay is set and the endpoint has not answered
+    # within hedge_delay seconds the same request is sent to the next endpoint
+    # too and the first answer is used.
+    # Requests to every endpoint are limited by rate_limit requests per second
+    # (0 means no limit), the limit is reduced when the endpoint answers with 429.
+    # If finalization_delay is set, results of requests to blocks deeper than
+    # the finalization delay are served from the responses cache.
+    # If a cassette is set all responses of the endpoints are recorded to it,
+    # the responses cache is not used then so every request reaches the endpoints
+    chainid: str
+    endpoints: List[EndpointHealth]
+    _failure_threshold: int
+    _eject_time: int
+    _hedge_delay: float
+    _executor: Optional[ThreadPoolExecutor]
+    single_flight: SingleFlight
+    responses: Optional[ResponseCache]
+    _finalization_delay: Optional[int]
+    _finalized_block: int
+    _head_checked: float
+    _cassette: Optional[Cassette]
+
+    def __init__(
+        self,
+        chainid: str,
+        urls: List[str],
+        failure_threshold: int = 3,
+        eject_time: int = 60,
+        hedge_delay: float = 0,
+        rate_limit: float = 0,
+        rate_limit_burst: int = 10,
+        rate_limit_lock_dir: str = '',
+        finalization_delay: Optional[int] = None,
+        responses: Optional[ResponseCache] = None,
+        cassette: Optional[Cassette] = None
+    ):
+        super().__init__()
+        if len(urls) == 0:
+            raise ValueError(f'{chainid}: no RPC endpoints configured')
+        self.chainid = chainid
+        self.endpoints = [EndpointHealth(url, get_rate_limiter(url, rate_limit, rate_limit_burst, rate_limit_lock_dir))
+                          for url in urls]
+        self._failure_threshold = max(failure_threshold, 1)
+        self._eject_time = eject_time
+        self._hedge_delay = hedge_delay
+        self._executor = None
+        self.single_flight = SingleFlight()
+        self.responses = responses if finalization_delay != None and cassette == None else None
+        self._cassette = cassette
+        if cassette:
+            info(f'{chainid}: recording RPC responses')
+        self._finalization_delay = finalization_delay
+        self._finalized_block = -1
+        self._head_checked = 0
+        if hedge_delay > 0 and len(urls) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=len(urls) * 4)
+
+    @property
+    def endpoint_uri(self) -> str:
+        return self.ranked_endpoints()[0].url
+
+    def __str__(self) -> str:
+        return f'RPC failover connection {[ep.url for ep in self.endpoints]}'
+
+    def ranked_endpoints(self) -> List[EndpointHealth]:
+        # ejected endpoints are kept at the end of the list so they are still
+        # tried when all endpoints are ejected
+        now = time()
+        healthy = [ep for ep in self.endpoints if ep.available(now)]
+        ejected = [ep for ep in self.endpoints if not ep.available(now)]
+        return sorted(healthy, key=lambda ep: ep.score()) + \
+               sorted(ejected, key=lambda ep: ep.ejected_until)
+
+    def _timed(self, endpoint: EndpointHealth, func: Callable) -> Any:
+        if endpoint.limiter:
+            endpoint.limiter.acquire()
+        start = time()
+        try:
+            retval = func(endpoint)
+        except Exception as e:
+            if endpoint.limiter and is_rate_limited(e):
+                rate = endpoint.limiter.throttle()
+                warning(f'{self.chainid}: endpoint {endpoint.url} is rate limited, requests rate reduced to {rate:.2f} per second')
+            if endpoint.record_failure(self._failure_threshold, self._eject_time):
+                warning(f'{self.chainid}: endpoint {endpoint.url} ejected for {self._eject_time} seconds: {e}')
+            else:
+                warning(f'{self.chainid}: endpoint {endpoint.url} failed: {e}')
+            raise e
+        endpoint.record_success(time() - start)
+        return retval
+
+    def _dispatch(self, func: Callable) -> Any:
+        candidates = self.ranked_endpoints()
+        exc = None
+        if self._executor == None:
+            for endpoint in candidates:
+                try:
+                    return self._timed(endpoint, func)
+                except Exception as e:
+                    exc = e
+            raise exc
+
+        pending = set()
+        i = 0
+        while True:
+            # every round starts one more endpoint: either the previous ones
+            # failed or they did not answer within the hedge delay
+            if i < len(candidates):
+                pending.add(self._executor.submit(self._timed, candidates[i], func))
+                if i > 0:
+                    info(f'{self.chainid}: request hedged to {candidates[i].url}')
+                i += 1
+            if len(pending) == 0:
+                raise exc
+            timeout = self._hedge_delay if i < len(candidates) else None
+            (done, pending) = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for f in done:
+                try:
+                    return f.result()
+                except Exception as e:
+                    exc = e
+
+    def _is_finalized(self, block: int) -> bool:
+        if block <= self._finalized_block:
+            return True
+        if time() - self._head_checked < HEAD_CHECK_INTERVAL:
+            return False
+        self._head_checked = time()
+        try:
+            resp = self._dispatch(lambda ep: ep.provider.make_request('eth_blockNumber', []))
+            self._finalized_block = int(resp['result'], 16) - self._finalization_delay
+        except Exception as e:
+            warning(f'{self.chainid}: cannot get the finalized block: {e}')
+        return block <= self._finalized_block
+
+    def cache_key(self, method: str, params: Any) -> Optional[str]:
+        # returns the key for the responses cache if the result of the request
+        # cannot change anymore
+        if self.responses == None:
+            return None
+        if method not in HASH_ADDRESSED_METHODS:
+            block = pinned_block(method, params)
+            if block == None or not self._is_finalized(block):
+                return None
+        return request_key(method, params)
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        key = self.cache_key(method, params)
+        if key:
+            result = self.responses.get(key)
+            if result != None:
+                return {'jsonrpc': '2.0', 'id': next(self.request_counter), 'result': result}
+        resp = self._make_request(method, params)
+        if key and 'error' not in resp:
+            self.responses.put(key, resp.get('result'))
+        return resp
+
+    def _make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        def request(endpoint: EndpointHealth) -> RPCResponse:
+            resp = endpoint.provider.make_request(method, params)
+            # some providers report exceeded limits as JSON-RPC errors
+            if 'error' in resp and is_rate_limited(ValueError(resp['error'])):
+                raise ValueError(resp['error'])
+            return resp
+        key = request_key(method, params)
+        resp = self.single_flight.do(key, lambda: self._dispatch(request))
+        if self._cassette and key:
+            self._cassette.record(key, method, params, resp)
+        return resp
+
+    def make_batch_request(self, batch: list) -> list:
+        def post(endpoint: EndpointHealth) -> list:
+            r = requests.post(
+                endpoint.url,
+                json=batch,
+                timeout=(3.05, 27),
+                **endpoint.provider.get_request_kwargs()
+            )
+            r.raise_for_status()
+            return r.json()
+        resp = self._dispatch(post)
+        if self._cassette and isinstance(resp, list):
+            requests_by_id = {req['id']: req for req in batch}
+            for r in resp:
+                req = requests_by_id.get(r.get('id')) if isinstance(r, dict) else None
+                key = request_key(req['method'], req['params']) if req else None
+                if key:
+                    self._cassette.record(key, req['method'], req['params'], r)
+        return resp
+
+    def health_report(self) -> str:
+        now = time()
+        return ', '.join([f'{ep.url}: {ep.latency:.3f}s, errors {ep.error_rate:.2f}' +
+                          (f', rate {ep.limiter.rate():.2f}' if ep.limiter else '') +
+                          ('' if ep.available(now) else ', ejected') for ep in self.endpoints])
@@ -63,6 +63,26 @@ class CommonSettings(GenericSettings):
     token_depoloyments_info: str = 'token-deployments-info.json'
     web3_retry_attemtps: int = 2
     web3_retry_delay: int = 5
+    timestamps_cache_dir: str = ''
+    timestamps_cache_size: int = 100000
+    web3_batch_max_size: int = 50
+    web3_batch_max_delay: float = 0.01
+    web3_endpoint_failure_threshold: int = 3
+    web3_endpoint_eject_time: int = 60
+    web3_hedge_delay: float = 0
+    # requests per second to every RPC endpoint, 0 means no limit
+    web3_rate_limit: float = 0
+    web3_rate_limit_burst: int = 10
+    # directory for lock files sharing the rate limit between processes
+    web3_rate_limit_lock_dir: str = ''
+    # results of requests to finalized blocks are kept in memory and, if
+    # the directory is set, on disk
+    web3_responses_cache_dir: str = ''
+    web3_responses_cache_memory_size: int = 64 * 1024 * 1024
+    web3_responses_cache_disk_size: int = 1024 * 1024 * 1024
+    # responses of RPC endpoints are recorded to cassettes in this directory
+    # to be replayed by the RPC stand-in
+    web3_cassette_dir: str = ''
     chains: dict = {}
 
     def __init__(self):
@@ -3,8 +3,10 @@ from typing import Dict, List, Union, Optional
 from pydantic import BaseModel
 
 class RPCSpec(BaseModel):
-    url: str
+    # a list of urls enables failover between the endpoints
+    url: Union[str, List[str]]
     history_block_range: int
+    max_history_block_range: Optional[int]
 
 class TokenSpec(BaseModel):
     start_block: int
@@ -13,6 +15,7 @@ class UniswapLikeInventory(BaseModel):
     protocol: str
     pos_manager: str
     owner: str
+    engine: Optional[str]
 
 class BobVaultInventory(BaseModel):
     protocol: str
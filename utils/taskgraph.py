@@ -0,0 +1,59 @@
+from typing import Callable, Any, Dict, List, Optional, Tuple
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from time import time
+
+from .logging import info, error
+
+class TaskGraph:
+    # Runs tasks concurrently as soon as the tasks they depend on are finished.
+    # If a required task returns an empty result no more tasks are started and
+    # the whole graph is considered failed
+    _name: str
+    _max_workers: int
+    _tasks: Dict[str, Tuple[Callable, List[str], bool]]
+
+    def __init__(self, name: str, max_workers: int = 5):
+        self._name = name
+        self._max_workers = max(max_workers, 1)
+        self._tasks = {}
+
+    def add(self, name: str, func: Callable, deps: List[str] = [], required: bool = True):
+        self._tasks[name] = (func, list(deps), required)
+
+    def _timed(self, func: Callable) -> Tuple[Any, float]:
+        start = time()
+        result = func()
+        return (result, time() - start)
+
+    def run(self) -> Optional[Dict[str, Any]]:
+        results = {}
+        timings = {}
+        pending = dict(self._tasks)
+        running = {}
+        aborted = False
+        start = time()
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            while (len(pending) > 0 or len(running) > 0) and not aborted:
+                for name in [n for n in pending if all([d in results for d in pending[n][1]])]:
+                    running[executor.submit(self._timed, pending[name][0])] = name
+                    del pending[name]
+                if len(running) == 0:
+                    raise ValueError(f'{self._name}: unresolved dependencies of {list(pending)}')
+                done = wait(running, return_when=FIRST_COMPLETED)[0]
+                for f in done:
+                    name = running.pop(f)
+                    (results[name], timings[name]) = f.result()
+                    if self._tasks[name][2] and not results[name]:
+                        error(f'{self._name}: {name} returned no data')
+                        aborted = True
+            if aborted:
+                # tasks waiting for a free worker are not started
+                for f in running:
+                    f.cancel()
+        breakdown = ', '.join([f'{name} {timings[name]:.2f}s' for name in self._tasks if name in timings])
+        info(f'{self._name}: finished in {time() - start:.2f}s ({breakdown})')
+        if aborted:
+            return None
+        return results
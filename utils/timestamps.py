@@ -0,0 +1,89 @@
+from typing import Optional, Union, Iterable, Tuple
+from collections import OrderedDict
+
+from threading import Lock
+
+import sqlite3
+
+from .logging import info
+
+BlockId = Union[int, str]
+
+class BlockTimestampsCache:
+    # Timestamps of blocks are kept in memory with LRU eviction and, if a directory
+    # is configured, in an SQLite table shared by all services running on the host.
+    # Blocks are looked up by hash or by number, the callers must request blocks
+    # by number only if they are finalized
+    _chainid: str
+    _max_size: int
+    _memory: OrderedDict
+    _lock: Lock
+    _db: Optional[sqlite3.Connection]
+    hits: int
+    disk_hits: int
+    misses: int
+
+    def __init__(self, chainid: str, cache_dir: Optional[str] = None, max_size: int = 100000):
+        self._chainid = chainid
+        self._max_size = max_size
+        self._memory = OrderedDict()
+        self._lock = Lock()
+        self._db = None
+        if cache_dir:
+            fn = f'{cache_dir}/{chainid}-block-timestamps.sqlite'
+            info(f'{chainid}: block timestamps are stored in {fn}')
+            self._db = sqlite3.connect(fn, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS blocks (hash TEXT PRIMARY KEY, number INTEGER, timestamp INTEGER)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS blocks_number ON blocks (number)')
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def report(self, reset: bool = True):
+        info(f'{self._chainid}: block timestamps cache: {self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses')
+        if reset:
+            self.reset_counters()
+
+    def _remember(self, key: BlockId, timestamp: int):
+        self._memory[key] = timestamp
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_size:
+            self._memory.popitem(last=False)
+
+    def get(self, block: BlockId) -> Optional[int]:
+        with self._lock:
+            if block in self._memory:
+                self._memory.move_to_end(block)
+                self.hits += 1
+                return self._memory[block]
+            if self._db:
+                if isinstance(block, int):
+                    row = self._db.execute('SELECT timestamp FROM blocks WHERE number = ?', (block,)).fetchone()
+                else:
+                    row = self._db.execute('SELECT timestamp FROM blocks WHERE hash = ?', (block,)).fetchone()
+                if row:
+                    self.disk_hits += 1
+                    self._remember(block, row[0])
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put_many(self, blocks: Iterable[Tuple[int, str, int]]):
+        # every element is (number, hash, timestamp)
+        blocks = list(blocks)
+        with self._lock:
+            for (number, blockhash, timestamp) in blocks:
+                self._remember(blockhash, timestamp)
+                self._remember(number, timestamp)
+            if self._db and len(blocks) > 0:
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO blocks (number, hash, timestamp) VALUES (?, ?, ?)',
+                    blocks
+                )
+
+    def put(self, number: int, blockhash: str, timestamp: int):
+        self.put_many([(number, blockhash, timestamp)])
@@ -0,0 +1,468 @@
+from typing import Dict, List, Optional, Tuple, Iterator, Union
+
+from abc import ABC, abstractmethod
+
+from functools import cache
+from threading import Lock
+from bisect import bisect_left, insort
+from csv import reader
+from json import dumps, loads
+from os.path import getsize, exists, splitext
+
+from datetime import datetime, timezone, timedelta
+
+import sqlite3
+
+from tinyflux import TinyFlux, Point, TagQuery
+
+from .logging import info, error
+from .misc import InitException
+
+# engines of the timeseries dbs
+TINYFLUX_ENGINE = 'tinyflux'
+SQLITE_ENGINE = 'sqlite'
+
+TAIL_READ_SIZE = 4096
+# points are read from SQLite dbs by chunks of this size while iterating
+SQLITE_READ_CHUNK = 5000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# columns of TinyFlux CSVs
+TAG_PREFIX = '_tag_'
+FIELD_PREFIX = '_field_'
+NONE_VALUE = '_none'
+
+def _parse_field(value: str) -> Optional[Union[int, float]]:
+    if value.isdigit() or (value.startswith('-') and value[1:].isdigit()):
+        return int(value)
+    if value == NONE_VALUE:
+        return None
+    return float(value)
+
+def _parse_row(row: bytes) -> Point:
+    # Rows of TinyFlux CSVs (the format of tinyflux pinned in requirements.txt)
+    # are: time in UTC, measurement, then _tag_<key>,<value> and
+    # _field_<key>,<value> pairs. They are parsed here since TinyFlux does not
+    # expose parsing of a single row
+    columns = next(reader([row.decode()]))
+    if len(columns) < 2 or len(columns) % 2 != 0:
+        raise ValueError(f'malformed row of {len(columns)} columns')
+    tags = {}
+    fields = {}
+    for i in range(2, len(columns), 2):
+        (key, value) = (columns[i], columns[i + 1])
+        if key.startswith(TAG_PREFIX):
+            tags[key[len(TAG_PREFIX):]] = value
+        elif key.startswith(FIELD_PREFIX):
+            fields[key[len(FIELD_PREFIX):]] = _parse_field(value)
+        else:
+            raise ValueError(f'unexpected column {key}')
+    return Point(
+        time = datetime.fromisoformat(columns[0]).replace(tzinfo=timezone.utc),
+        measurement = columns[1],
+        tags = tags,
+        fields = fields
+    )
+
+class TimeIndex:
+    # Times of points of every measurement of a TinyFlux CSV kept sorted in
+    # memory with offsets of their rows. The nearest point is found by bisect
+    # and read by seeking to its row instead of scanning the whole file.
+    # Rows appended since the last refresh are indexed incrementally, the index
+    # is rebuilt if the file was truncated or rewritten
+    _filename: str
+    _lock: Lock
+    _times: Dict[str, List[float]]
+    _offsets: Dict[str, Dict[float, List[int]]]
+    _size: int
+    _last_row: Tuple[int, bytes]
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self._times = {}
+        self._offsets = {}
+        self._size = 0
+        self._last_row = (0, b'')
+
+    def _add(self, offset: int, row: bytes):
+        # the time and the measurement are the first columns of a row
+        (time, measurement, _) = row.split(b',', 2)
+        ts = datetime.fromisoformat(time.decode()).replace(tzinfo=timezone.utc).timestamp()
+        measurement = measurement.decode()
+        times = self._times.setdefault(measurement, [])
+        offsets = self._offsets.setdefault(measurement, {})
+        if ts not in offsets:
+            if len(times) == 0 or ts > times[-1]:
+                times.append(ts)
+            else:
+                insort(times, ts)
+            offsets[ts] = []
+        offsets[ts].append(offset)
+
+    def _is_rewritten(self, f) -> bool:
+        (offset, row) = self._last_row
+        f.seek(offset)
+        return f.read(len(row)) != row
+
+    def refresh(self):
+        with self._lock:
+            try:
+                size = getsize(self._filename)
+            except OSError:
+                self._reset()
+                return
+            if size == self._size:
+                return
+            with open(self._filename, 'rb') as f:
+                if size < self._size or self._is_rewritten(f):
+                    info(f'db:{self._filename}: file was rewritten, rebuilding time index')
+                    self._reset()
+                offset = self._size
+                f.seek(offset)
+                for row in f:
+                    if not row.endswith(b'\n'):
+                        # the row is being written
+                        break
+                    self._add(offset, row)
+                    self._last_row = (offset, row)
+                    offset += len(row)
+                self._size = offset
+
+    def empty(self) -> bool:
+        with self._lock:
+            return sum([len(t) for t in self._times.values()]) == 0
+
+    def earliest(self, measurement: str) -> Optional[float]:
+        with self._lock:
+            times = self._times.get(measurement)
+            return times[0] if times else None
+
+    def nearest(self, measurement: str, required_ts: float) -> Optional[float]:
+        # the earlier time wins if two times are equally close
+        with self._lock:
+            times = self._times.get(measurement)
+            if not times:
+                return None
+            i = bisect_left(times, required_ts)
+            return min(times[max(i - 1, 0):i + 1], key=lambda t: abs(required_ts - t))
+
+    def points_at(self, measurement: str, ts: float) -> List[Point]:
+        with self._lock:
+            offsets = list(self._offsets.get(measurement, {}).get(ts, []))
+        points = []
+        if len(offsets) > 0:
+            with open(self._filename, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    points.append(_parse_row(f.readline()))
+        return points
+
+def read_latest_point(filename: str, measurement: str = '_default') -> Optional[Point]:
+    # Reads the last point of the measurement in an append-only TinyFlux CSV
+    # by seeking from the end of the file, only the rows of the tail are parsed.
+    # The tail is extended if it does not contain a complete row of the
+    # measurement. A row which is being written by another process is skipped.
+    # Raises an exception if a row of the tail cannot be parsed
+    try:
+        size = getsize(filename)
+    except OSError:
+        return None
+    window = TAIL_READ_SIZE
+    with open(filename, 'rb') as f:
+        while True:
+            start = max(size - window, 0)
+            f.seek(start)
+            rows = f.read(size - start).split(b'\n')
+            # the last element is empty or incomplete, the first one
+            # is cut unless the tail starts at the beginning of the file
+            for row in reversed(rows[(0 if start == 0 else 1):-1]):
+                if len(row.strip()) == 0:
+                    continue
+                point = _parse_row(row)
+                if point.measurement == measurement:
+                    return point
+            if start == 0:
+                return None
+            window *= 4
+
+def scan_latest_point(filename: str, measurement: str = '_default') -> Optional[Point]:
+    # Reads the latest point of the measurement by scanning the whole file,
+    # rows which cannot be parsed are skipped
+    latest = None
+    try:
+        with open(filename, 'rb') as f:
+            for row in f:
+                if not row.endswith(b'\n') or len(row.strip()) == 0:
+                    continue
+                try:
+                    point = _parse_row(row)
+                except Exception:
+                    continue
+                if point.measurement == measurement and (latest == None or point.time >= latest.time):
+                    latest = point
+    except OSError:
+        return None
+    return latest
+
+def _to_micros(dt: datetime) -> int:
+    # naive times are considered as local ones the same way as TinyFlux does
+    delta = dt.astimezone(timezone.utc) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+def _ts_to_micros(ts: float) -> int:
+    return round(ts * 10 ** 6)
+
+def _from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+class SeriesStorage(ABC):
+    # Timeseries db of points of one or several measurements. Times are passed
+    # and returned as UTC timestamps in seconds, naive datetimes of inserted
+    # points are considered as local ones
+    filename: str
+
+    @abstractmethod
+    def insert(self, points: List[Point]):
+        pass
+
+    @abstractmethod
+    def points(self) -> Iterator[Point]:
+        # all points in the order of insertion
+        pass
+
+    @abstractmethod
+    def empty(self) -> bool:
+        pass
+
+    @abstractmethod
+    def earliest(self, measurement: str) -> Optional[float]:
+        pass
+
+    @abstractmethod
+    def nearest(self, measurement: str, required_ts: float) -> Optional[float]:
+        # the earlier time wins if two times are equally close
+        pass
+
+    @abstractmethod
+    def points_at(self, measurement: str, ts: float) -> List[Point]:
+        pass
+
+    @abstractmethod
+    def search(self, measurement: str, tags: Dict[str, str]) -> List[Point]:
+        # points having all the tags ordered by time
+        pass
+
+    @abstractmethod
+    def latest_point(self, measurement: str = '_default') -> Optional[Point]:
+        pass
+
+    def close(self):
+        pass
+
+class TinyFluxStorage(SeriesStorage):
+    # Points are appended to a TinyFlux CSV. Lookups by time go through the
+    # in-memory time index built on the first lookup, the latest point is read
+    # from the tail of the file. Tags are not indexed so the search scans the file
+    _index: Optional[TimeIndex]
+    _lock: Lock
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._index = None
+        self._lock = Lock()
+
+    def _time_index(self) -> TimeIndex:
+        with self._lock:
+            if not self._index:
+                self._index = TimeIndex(self.filename)
+        self._index.refresh()
+        return self._index
+
+    def insert(self, points: List[Point]):
+        with TinyFlux(self.filename) as db:
+            db.insert_multiple(points)
+        if self._index:
+            self._index.refresh()
+
+    def points(self) -> Iterator[Point]:
+        if not exists(self.filename):
+            return
+        with TinyFlux(self.filename) as db:
+            for point in db:
+                yield point
+
+    def empty(self) -> bool:
+        return self._time_index().empty()
+
+    def earliest(self, measurement: str) -> Optional[float]:
+        return self._time_index().earliest(measurement)
+
+    def nearest(self, measurement: str, required_ts: float) -> Optional[float]:
+        return self._time_index().nearest(measurement, required_ts)
+
+    def points_at(self, measurement: str, ts: float) -> List[Point]:
+        return self._time_index().points_at(measurement, ts)
+
+    def search(self, measurement: str, tags: Dict[str, str]) -> List[Point]:
+        if not exists(self.filename):
+            return []
+        query = None
+        for key in tags:
+            tag_query = getattr(TagQuery(), key) == tags[key]
+            query = tag_query if query == None else query & tag_query
+        with TinyFlux(self.filename) as db:
+            if query == None:
+                points = list(db.measurement(measurement))
+            else:
+                points = db.measurement(measurement).search(query)
+        return sorted(points, key=lambda p: p.time)
+
+    def latest_point(self, measurement: str = '_default') -> Optional[Point]:
+        # the db is append-only so the latest point is at its tail
+        try:
+            return read_latest_point(self.filename, measurement)
+        except Exception as e:
+            error(f'db:{self.filename}: cannot parse the tail of timeseries db, scanning it: {e}')
+            return scan_latest_point(self.filename, measurement)
+
+class SQLiteStorage(SeriesStorage):
+    # Points are kept in an SQLite table indexed by measurement and time, times
+    # are stored as integer microseconds so points are matched by time exactly.
+    # Tags are duplicated to a table indexed by key and value. The db works in
+    # WAL mode so one service can read it while another one appends points
+    _lock: Lock
+    _db: sqlite3.Connection
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = Lock()
+        self._db = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS points (id INTEGER PRIMARY KEY, measurement TEXT NOT NULL, time INTEGER NOT NULL, tags TEXT NOT NULL, fields TEXT NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS points_time ON points (measurement, time)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tags (point INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tags_value ON tags (key, value, point)')
+
+    @staticmethod
+    def _to_point(row: tuple) -> Point:
+        (measurement, time, tags, fields) = row
+        return Point(
+            measurement = measurement,
+            time = _from_micros(time),
+            tags = loads(tags),
+            fields = loads(fields)
+        )
+
+    def _select(self, condition: str, params: tuple) -> List[Point]:
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT measurement, time, tags, fields FROM points WHERE {condition}',
+                params
+            ).fetchall()
+        return [self._to_point(row) for row in rows]
+
+    def insert(self, points: List[Point]):
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                for p in points:
+                    cur = self._db.execute(
+                        'INSERT INTO points (measurement, time, tags, fields) VALUES (?, ?, ?, ?)',
+                        (p.measurement, _to_micros(p.time), dumps(p.tags), dumps(p.fields, default=float))
+                    )
+                    self._db.executemany(
+                        'INSERT INTO tags (point, key, value) VALUES (?, ?, ?)',
+                        [(cur.lastrowid, key, p.tags[key]) for key in p.tags]
+                    )
+                self._db.execute('COMMIT')
+            except Exception as e:
+                self._db.execute('ROLLBACK')
+                raise e
+
+    def points(self) -> Iterator[Point]:
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT id, measurement, time, tags, fields FROM points WHERE id > ? ORDER BY id LIMIT ?',
+                    (last_id, SQLITE_READ_CHUNK)
+                ).fetchall()
+            if len(rows) == 0:
+                return
+            for row in rows:
+                yield self._to_point(row[1:])
+            last_id = rows[-1][0]
+
+    def empty(self) -> bool:
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM points LIMIT 1').fetchone() == None
+
+    def earliest(self, measurement: str) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute('SELECT MIN(time) FROM points WHERE measurement = ?', (measurement,)).fetchone()
+        return row[0] / 10 ** 6 if row[0] != None else None
+
+    def nearest(self, measurement: str, required_ts: float) -> Optional[float]:
+        required = _ts_to_micros(required_ts)
+        with self._lock:
+            before = self._db.execute(
+                'SELECT MAX(time) FROM points WHERE measurement = ? AND time <= ?',
+                (measurement, required)
+            ).fetchone()[0]
+            after = self._db.execute(
+                'SELECT MIN(time) FROM points WHERE measurement = ? AND time > ?',
+                (measurement, required)
+            ).fetchone()[0]
+        candidates = [t for t in (before, after) if t != None]
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda t: abs(required - t)) / 10 ** 6
+
+    def points_at(self, measurement: str, ts: float) -> List[Point]:
+        return self._select('measurement = ? AND time = ? ORDER BY id', (measurement, _ts_to_micros(ts)))
+
+    def search(self, measurement: str, tags: Dict[str, str]) -> List[Point]:
+        if len(tags) == 0:
+            return self._select('measurement = ? ORDER BY time, id', (measurement,))
+        by_tags = ' INTERSECT '.join(['SELECT point FROM tags WHERE key = ? AND value = ?'] * len(tags))
+        params = [measurement]
+        for key in tags:
+            params.extend([key, tags[key]])
+        return self._select(f'measurement = ? AND id IN ({by_tags}) ORDER BY time, id', tuple(params))
+
+    def latest_point(self, measurement: str = '_default') -> Optional[Point]:
+        points = self._select('measurement = ? ORDER BY time DESC, id DESC LIMIT 1', (measurement,))
+        return points[0] if len(points) > 0 else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+STORAGE_ENGINES = {
+    TINYFLUX_ENGINE: TinyFluxStorage,
+    SQLITE_ENGINE: SQLiteStorage
+}
+
+def storage_filename(filename: str, engine: str) -> str:
+    # the dbs are configured by names of TinyFlux CSVs, SQLite dbs are kept
+    # next to them with another extension
+    if engine == SQLITE_ENGINE:
+        return f'{splitext(filename)[0]}.sqlite'
+    return filename
+
+def open_storage(filename: str, engine: str) -> SeriesStorage:
+    if not engine in STORAGE_ENGINES:
+        error(f'db:{filename}: unknown timeseries db engine {engine}')
+        raise InitException
+    return STORAGE_ENGINES[engine](storage_filename(filename, engine))
+
+@cache
+def get_storage(filename: str, engine: str = TINYFLUX_ENGINE) -> SeriesStorage:
+    # one storage per db is shared by all adapters of the process
+    return open_storage(filename, engine)
@@ -0,0 +1,188 @@
+from typing import Tuple
+
+from os import getenv, makedirs
+from os.path import exists
+
+from time import perf_counter
+from datetime import datetime, timezone
+
+from random import Random
+from tempfile import mkdtemp
+from json import dump
+
+from tinyflux import Point
+
+from utils.logging import info, error
+from utils.constants import ONE_DAY
+from utils.tsdb import TINYFLUX_ENGINE, SQLITE_ENGINE, SeriesStorage, open_storage, storage_filename
+
+# Compares insert and lookup latency of the timeseries db engines on the
+# workloads of the services. For every engine in ENGINES the dbs are created
+# from scratch in TSDB_DIR (a temporary directory by default):
+# - a transfers partition gets TRANSFERS points inserted by TRANSFERS_BATCH as
+#   the indexer does, then SEARCHES transfers are searched by transaction hash;
+# - composed stats get a measurement for every of CHAINS every
+#   MEASUREMENTS_INTERVAL seconds during DAYS, then LOOKUPS random timespots
+#   are looked up the same way as bobstats does;
+# - BobVault fees get a point every FEES_INTERVAL seconds during DAYS, the
+#   latest point is read LOOKUPS times.
+# The results of lookups are compared between the engines. Latencies are
+# logged and written to BENCHMARK_OUTPUT as JSON.
+
+TSDB_DIR = getenv('TSDB_DIR', '')
+ENGINES = getenv('ENGINES', f'{TINYFLUX_ENGINE},{SQLITE_ENGINE}').split(',')
+TRANSFERS = int(getenv('TRANSFERS', 100000))
+TRANSFERS_BATCH = int(getenv('TRANSFERS_BATCH', 500))
+SEARCHES = int(getenv('SEARCHES', 100))
+DAYS = int(getenv('DAYS', 365))
+CHAINS = getenv('CHAINS', 'pol,opt,eth,arb1,bsc').split(',')
+MEASUREMENTS_INTERVAL = int(getenv('MEASUREMENTS_INTERVAL', 60 * 60 * 2))
+FEES_INTERVAL = int(getenv('FEES_INTERVAL', 60 * 15))
+LOOKUPS = int(getenv('LOOKUPS', 1000))
+BENCHMARK_OUTPUT = getenv('BENCHMARK_OUTPUT', 'benchmark-tsdb.json')
+START_TS = 1672531200
+
+def measure(name: str, func, args: list) -> Tuple[list, dict]:
+    latencies = []
+    results = []
+    for arg in args:
+        start = perf_counter()
+        results.append(func(arg))
+        latencies.append(perf_counter() - start)
+    latencies.sort()
+    stats = {
+        'count': len(latencies),
+        'total': sum(latencies),
+        'mean_ms': sum(latencies) / max(len(latencies), 1) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if len(latencies) > 0 else 0
+    }
+    info(f"{name}: {stats['count']} ops in {stats['total']:.3f} secs, " +
+         f"{stats['mean_ms']:.3f} msecs per op, p99 {stats['p99_ms']:.3f} msecs")
+    return results, stats
+
+def as_comparable(points: list) -> list:
+    # TinyFlux may return integer fields as floats
+    return sorted([(
+        p.time.timestamp(),
+        p.measurement,
+        sorted(p.tags.items()),
+        sorted([(k, float(v)) for (k, v) in p.fields.items()])
+    ) for p in points])
+
+def transfers_batches(rnd: Random) -> list:
+    holders = [f'0x{rnd.getrandbits(160):040x}' for _ in range(1000)]
+    batches = []
+    batch = []
+    for i in range(TRANSFERS):
+        batch.append(Point(
+            time=datetime.fromtimestamp(START_TS + i * 2, timezone.utc),
+            tags={
+                'logIndex': str(i % 10),
+                'transactionIndex': str(i % 7),
+                'transactionHash': f'0x{i:064x}',
+                'blockHash': f'0x{i // 10:064x}',
+                'blockNumber': str(i // 10),
+                'from': rnd.choice(holders),
+                'to': rnd.choice(holders)
+            },
+            fields={'a0': rnd.randrange(10 ** 9), 'a1': rnd.randrange(10 ** 9), 'a2': 0, 'a3': 0}
+        ))
+        if len(batch) == TRANSFERS_BATCH:
+            batches.append(batch)
+            batch = []
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+def composed_measurements(rnd: Random) -> list:
+    measurements = []
+    for ts in range(START_TS, START_TS + DAYS * ONE_DAY, MEASUREMENTS_INTERVAL):
+        # measurements take some time so points do not fall on exact intervals
+        dt = datetime.fromtimestamp(ts + rnd.randrange(60), timezone.utc)
+        measurements.append([Point(time=dt, tags={'chain': chain}, fields={
+            'totalSupply': rnd.uniform(10 ** 6, 10 ** 7),
+            'colCirculatingSupply': rnd.uniform(10 ** 6, 10 ** 7),
+            'volumeUSD': rnd.uniform(0, 10 ** 6),
+            'holders': rnd.randrange(1000, 10000)
+        }) for chain in CHAINS])
+    return measurements
+
+def fees_points(rnd: Random) -> list:
+    return [[Point(
+        time=datetime.fromtimestamp(ts, timezone.utc),
+        tags={'id': 'bobvault-pol'},
+        fields={'BOB': rnd.uniform(0, 1000), 'USDC': rnd.uniform(0, 1000)}
+    )] for ts in range(START_TS, START_TS + DAYS * ONE_DAY, FEES_INTERVAL)]
+
+def nearest_points(tsdb: SeriesStorage, required_ts: float) -> list:
+    suitable_time = tsdb.nearest('_default', required_ts)
+    if suitable_time == None or abs(required_ts - suitable_time) >= ONE_DAY // 2:
+        return []
+    return tsdb.points_at('_default', suitable_time)
+
+def run_engine(tsdb_dir: str, engine: str, timespots: list, hashes: list) -> Tuple[dict, dict]:
+    stats = {}
+    results = {}
+
+    db_file = f'{tsdb_dir}/pol-202301-bob-transfers.csv'
+    tsdb = open_storage(db_file, engine)
+    _, stats['transfers_insert'] = measure(f'{engine}: transfers insert by {TRANSFERS_BATCH}', tsdb.insert, transfers_batches(Random(1)))
+    results['transfers_search'], stats['transfers_search'] = measure(
+        f'{engine}: transfers search by hash',
+        lambda h: as_comparable(tsdb.search('_default', {'transactionHash': h})),
+        hashes
+    )
+    tsdb.close()
+
+    tsdb = open_storage(f'{tsdb_dir}/bobstat_composed.csv', engine)
+    _, stats['composed_insert'] = measure(f'{engine}: composed stats insert', tsdb.insert, composed_measurements(Random(2)))
+    results['composed_lookup'], stats['composed_lookup'] = measure(
+        f'{engine}: composed stats nearest lookup',
+        lambda ts: as_comparable(nearest_points(tsdb, ts)),
+        timespots
+    )
+    tsdb.close()
+
+    tsdb = open_storage(f'{tsdb_dir}/bobvault-pol-bobvault-fees.csv', engine)
+    _, stats['fees_insert'] = measure(f'{engine}: fees insert', tsdb.insert, fees_points(Random(3)))
+    results['fees_latest'], stats['fees_latest'] = measure(
+        f'{engine}: fees latest point',
+        lambda _: as_comparable([tsdb.latest_point()]),
+        range(LOOKUPS)
+    )
+    tsdb.close()
+
+    return stats, results
+
+if __name__ == '__main__':
+    tsdb_dir = TSDB_DIR or mkdtemp(prefix='tsdb-benchmark-')
+    makedirs(tsdb_dir, exist_ok=True)
+    for engine in ENGINES:
+        for fn in ('pol-202301-bob-transfers.csv', 'bobstat_composed.csv', 'bobvault-pol-bobvault-fees.csv'):
+            if exists(storage_filename(f'{tsdb_dir}/{fn}', engine)):
+                error(f'{tsdb_dir} contains dbs already, use an empty directory')
+                exit(1)
+    info(f'Benchmarking {ENGINES} in {tsdb_dir}')
+
+    rnd = Random(4)
+    # some timespots are out of the stored interval on purpose
+    timespots = [rnd.randrange(START_TS - ONE_DAY, START_TS + (DAYS + 1) * ONE_DAY) for _ in range(LOOKUPS)]
+    hashes = [f'0x{rnd.randrange(TRANSFERS):064x}' for _ in range(SEARCHES)]
+
+    output = {}
+    results = {}
+    for engine in ENGINES:
+        output[engine], results[engine] = run_engine(tsdb_dir, engine, timespots, hashes)
+
+    for engine in ENGINES[1:]:
+        for workload in results[engine]:
+            expected = results[ENGINES[0]][workload]
+            mismatches = [i for i in range(len(expected)) if expected[i] != results[engine][workload][i]]
+            if len(mismatches) > 0:
+                error(f'{workload}: {engine} differs from {ENGINES[0]} in {len(mismatches)} lookups')
+            else:
+                info(f'{workload}: {engine} matches {ENGINES[0]}')
+
+    with open(BENCHMARK_OUTPUT, 'w') as f:
+        dump(output, f, indent=2)
+    info(f'Results are stored to {BENCHMARK_OUTPUT}')
@@ -1,44 +1,136 @@
 from functools import cache
 from decimal import Decimal
 
-from typing import Callable, Any
+from typing import Callable, Any, List, Dict, Union, Optional
 
-from time import sleep
+from time import sleep, time
 
-from web3 import Web3, HTTPProvider
+from threading import BoundedSemaphore, Condition, Lock, Thread
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from hexbytes import HexBytes
+
+from web3 import Web3
 from web3.middleware import geth_poa_middleware
 from web3.eth import Contract
-from web3.exceptions import ContractLogicError
+from web3.contract import ContractFunction
+from web3.exceptions import ContractLogicError, BlockNotFound
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3._utils.contracts import encode_transaction_data
 
-from .logging import info, error, warning
+from .logging import info, error, warning, debug
 from .abi import get_abi, ABI
+from .constants import MULTICALL3_ADDRESS
+from .timestamps import BlockTimestampsCache
+from .responses import ResponseCache
+from .cassette import Cassette
+from .rpc import FailoverHTTPProvider, request_key
+from .ratelimit import is_rate_limited
+
+# methods answering with null result if the requested object is not known to the node
+NOT_FOUND_AS_NULL_METHODS = [
+    'eth_getBlockByNumber',
+    'eth_getBlockByHash'
+]
 
 class Web3Provider:
     chainid: str
     w3: Web3
+    timestamps: BlockTimestampsCache
+    responses: ResponseCache
     _retry_attemtps: int
     _retry_delay: int
+    _timestamps_batch_size: int
+    _multicall: Contract
+    _multicall_available: Optional[bool]
+    _inflight: Union[BoundedSemaphore, nullcontext]
+    _rate_limited: bool
+    _batch_max_size: int
+    _batch_max_delay: float
+    _batch_queue: list
+    _batch_cond: Condition
+    _batch_thread: Optional[Thread]
+    _batch_executor: Optional[ThreadPoolExecutor]
+    _batch_stats_lock: Lock
+    batched_calls: int
+    batch_requests: int
 
     def __init__(
         self,
         chainid: str,
-        url: str,
+        url: Union[str, List[str]],
         retry_attemtps: int,
-        retry_delay: int
+        retry_delay: int,
+        timestamps_cache_dir: str = None,
+        timestamps_cache_size: int = 100000,
+        timestamps_batch_size: int = 100,
+        max_inflight_requests: int = 0,
+        batch_max_size: int = 0,
+        batch_max_delay: float = 0.01,
+        endpoint_failure_threshold: int = 3,
+        endpoint_eject_time: int = 60,
+        hedge_delay: float = 0,
+        rate_limit: float = 0,
+        rate_limit_burst: int = 10,
+        rate_limit_lock_dir: str = '',
+        finalization_delay: Optional[int] = None,
+        responses_cache_dir: str = None,
+        responses_cache_memory_size: int = 64 * 1024 * 1024,
+        responses_cache_disk_size: int = 1024 * 1024 * 1024,
+        cassette_dir: str = None
     ):
         self.chainid = chainid
-        self.w3 = Web3(HTTPProvider(url))
+        # results of requests to finalized blocks are cached if the finalization
+        # delay of the chain is known
+        self.responses = ResponseCache(chainid, responses_cache_dir, responses_cache_memory_size, responses_cache_disk_size)
+        self.w3 = Web3(FailoverHTTPProvider(
+            chainid,
+            [url] if isinstance(url, str) else url,
+            endpoint_failure_threshold,
+            endpoint_eject_time,
+            hedge_delay,
+            rate_limit,
+            rate_limit_burst,
+            rate_limit_lock_dir,
+            finalization_delay,
+            self.responses,
+            # responses are recorded for the RPC stand-in if the directory is set
+            Cassette(f'{cassette_dir}/{chainid}-cassette.jsonl') if cassette_dir else None
+        ))
+        self._rate_limited = rate_limit > 0
         if chainid != 'eth':
             self.w3.middleware_onion.inject(geth_poa_middleware, layer=0)
         self._retry_attemtps = retry_attemtps
         self._retry_delay = retry_delay
+        self.timestamps = BlockTimestampsCache(chainid, timestamps_cache_dir, timestamps_cache_size)
+        self._timestamps_batch_size = timestamps_batch_size
+        self._multicall = self.w3.eth.contract(abi = get_abi(ABI.MULTICALL3), address = MULTICALL3_ADDRESS)
+        self._multicall_available = None
+        # bounds the number of requests executed in parallel by all threads
+        # using the provider, 0 means no limit
+        self._inflight = BoundedSemaphore(max_inflight_requests) if max_inflight_requests > 0 else nullcontext()
+        # calls submitted by different threads are sent as one JSON-RPC batch
+        # if they are submitted within batch_max_delay seconds, 0 or 1 as the
+        # batch size disables batching
+        self._batch_max_size = batch_max_size
+        self._batch_max_delay = batch_max_delay
+        self._batch_queue = []
+        self._batch_cond = Condition()
+        self._batch_thread = None
+        self._batch_executor = None
+        self._batch_stats_lock = Lock()
+        self.batched_calls = 0
+        self.batch_requests = 0
 
     def make_call(self, func: Callable, *args, **kwargs) -> Any:
         exc = None
         attempts = 0
         while True:
             try:
-                return func(*args, **kwargs)
+                with self._inflight:
+                    return func(*args, **kwargs)
             except ContractLogicError as e:
                 warning(f'{self.chainid}: {func} failed: {e}')
                 return None
@@ -47,12 +139,309 @@ class Web3Provider:
                 error(f'{self.chainid}: not able to get data: {e}')
             attempts += 1
             if attempts < self._retry_attemtps:
-                info(f'{self.chainid}: repeat attempt in {self._retry_delay} seconds')
-                sleep(self._retry_delay)
+                if self._rate_limited and is_rate_limited(exc):
+                    # the rate limiter already slowed down requests to the endpoint
+                    info(f'{self.chainid}: repeat attempt at reduced rate')
+                else:
+                    info(f'{self.chainid}: repeat attempt in {self._retry_delay} seconds')
+                    sleep(self._retry_delay)
             else:
                 break
         raise exc
 
+    def _make_raw_call(self, method: str, params: list, nullable: bool = False) -> Any:
+        resp = self.w3.provider.make_request(method, params)
+        if 'error' in resp:
+            raise ValueError(resp['error'])
+        if resp.get('result') == None and not nullable:
+            raise ValueError(f'empty result for {method}')
+        return resp.get('result')
+
+    def _post_batch(self, batch: list) -> list:
+        return self.w3.provider.make_batch_request(batch)
+
+    def make_batch_call(self, method: str, params: List[list]) -> List[Any]:
+        # Sends the same JSON-RPC method with different params as one batch request.
+        # Elements that were not answered successfully are retried one by one
+        # instead of re-sending the whole batch
+        batch = []
+        for i in range(len(params)):
+            batch.append({"jsonrpc": "2.0",
+                          "id": i,
+                          "method": method,
+                          "params": params[i]
+                         })
+        resp = self.make_call(self._post_batch, batch)
+
+        results = [None] * len(params)
+        failed = set(range(len(params)))
+        # providers not supporting batches respond with a single error object
+        if isinstance(resp, list):
+            for r in resp:
+                idx = r.get('id') if isinstance(r, dict) else None
+                if (idx in failed) and ('error' not in r) and (r.get('result') != None):
+                    results[idx] = r['result']
+                    failed.discard(idx)
+
+        if len(failed) > 0:
+            warning(f'{self.chainid}: {len(failed)} of {len(params)} {method} requests failed in batch, retrying them separately')
+            for idx in sorted(failed):
+                results[idx] = self.make_call(self._make_raw_call, method, params[idx])
+        return results
+
+    def batching_enabled(self) -> bool:
+        return self._batch_max_size > 1
+
+    def submit(self, method: str, params: list) -> Future:
+        # Enqueues a JSON-RPC call to be sent within the next batch. The future
+        # gets the raw result of the call or the exception if the call failed
+        # after all retry attempts. A reverted eth_call fails with ContractLogicError.
+        # Unknown blocks are answered with None. Identical calls submitted while
+        # the first one is not answered yet get the same future
+        future = Future()
+        if not self.batching_enabled():
+            try:
+                future.set_result(self.make_call(self._make_raw_call, method, params, method in NOT_FOUND_AS_NULL_METHODS))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        key = self.w3.provider.cache_key(method, params)
+        if key:
+            result = self.responses.get(key)
+            if result != None:
+                future.set_result(result)
+                return future
+        return self.w3.provider.single_flight.submit(request_key(method, params),
+                                                     lambda: self._enqueue(method, params, key))
+
+    def _enqueue(self, method: str, params: list, cache_key: Optional[str]) -> Future:
+        future = Future()
+        def remember(f: Future):
+            if f.exception() == None and f.result() != None:
+                self.responses.put(cache_key, f.result())
+        if cache_key:
+            future.add_done_callback(remember)
+        with self._batch_cond:
+            self._batch_queue.append((method, params, future))
+            if self._batch_thread == None:
+                self._batch_executor = ThreadPoolExecutor(max_workers=4)
+                self._batch_thread = Thread(target=self._batch_loop, daemon=True)
+                self._batch_thread.start()
+            self._batch_cond.notify()
+        return future
+
+    def _batch_loop(self):
+        while True:
+            with self._batch_cond:
+                while len(self._batch_queue) == 0:
+                    self._batch_cond.wait()
+                # the batch is sent when it is full or the latency budget is spent
+                deadline = time() + self._batch_max_delay
+                while len(self._batch_queue) < self._batch_max_size:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        break
+                    self._batch_cond.wait(remaining)
+                batch = self._batch_queue[:self._batch_max_size]
+                del self._batch_queue[:self._batch_max_size]
+            self._batch_executor.submit(self._flush_batch, batch)
+
+    def _flush_batch(self, batch: list):
+        requests = []
+        for i in range(len(batch)):
+            requests.append({"jsonrpc": "2.0",
+                             "id": i,
+                             "method": batch[i][0],
+                             "params": batch[i][1]
+                            })
+        try:
+            resp = self.make_call(self._post_batch, requests)
+        except Exception as e:
+            for (_, _, future) in batch:
+                future.set_exception(e)
+            return
+        with self._batch_stats_lock:
+            self.batched_calls += len(batch)
+            self.batch_requests += 1
+
+        answered = {}
+        # providers not supporting batches respond with a single error object
+        if isinstance(resp, list):
+            for r in resp:
+                if isinstance(r, dict) and isinstance(r.get('id'), int):
+                    answered[r['id']] = r
+        for i in range(len(batch)):
+            (method, params, future) = batch[i]
+            r = answered.get(i, {})
+            if ('error' not in r) and (r.get('result') != None):
+                future.set_result(r['result'])
+                continue
+            if ('error' not in r) and ('result' in r) and (method in NOT_FOUND_AS_NULL_METHODS):
+                # the caller decides how to handle unknown blocks
+                future.set_result(None)
+                continue
+            if _is_revert(r.get('error')):
+                future.set_exception(ContractLogicError(r['error'].get('message')))
+                continue
+            # the existing retry semantics are applied to failed elements
+            try:
+                future.set_result(self.make_call(self._make_raw_call, method, params, method in NOT_FOUND_AS_NULL_METHODS))
+            except Exception as e:
+                future.set_exception(e)
+
+    def report_batching(self, reset: bool = True):
+        with self._batch_stats_lock:
+            info(f'{self.chainid}: {self.batched_calls} calls sent in {self.batch_requests} batches, {self.batched_calls - self.batch_requests} requests saved')
+            if reset:
+                self.batched_calls = 0
+                self.batch_requests = 0
+
+    def report_endpoints(self):
+        info(f'{self.chainid}: endpoints health: {self.w3.provider.health_report()}')
+        info(f'{self.chainid}: {self.w3.provider.single_flight.shared} requests shared the result of identical in-flight requests')
+
+    def submit_call(self, func: ContractFunction, bn: int = -1) -> Future:
+        # the future gets the decoded output of the function or None
+        # if the function reverted as it is for make_call
+        if not self.batching_enabled():
+            future = Future()
+            try:
+                if bn == -1:
+                    future.set_result(self.make_call(func.call))
+                else:
+                    future.set_result(self.make_call(func.call, block_identifier=bn))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        block_id = 'latest' if bn == -1 else hex(bn)
+        raw = self.submit('eth_call', [{'to': func.address, 'data': self.encode_function_call(func)}, block_id])
+        future = Future()
+        def decode(f: Future):
+            try:
+                future.set_result(self.decode_function_output(func, HexBytes(f.result())))
+            except ContractLogicError as e:
+                warning(f'{self.chainid}: {func.fn_name} failed: {e}')
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+        raw.add_done_callback(decode)
+        return future
+
+    def call_function(self, func: ContractFunction, bn: int = -1) -> Any:
+        return self.submit_call(func, bn).result()
+
+    def multicall_available(self) -> bool:
+        if self._multicall_available == None:
+            code = self.make_call(self.w3.eth.get_code, MULTICALL3_ADDRESS)
+            self._multicall_available = len(code) > 0
+            if not self._multicall_available:
+                warning(f'{self.chainid}: Multicall3 is not deployed, contract calls will not be batched')
+        return self._multicall_available
+
+    def encode_function_call(self, func: ContractFunction) -> str:
+        # the same way as the function arguments are encoded for eth_call
+        return encode_transaction_data(
+            self.w3,
+            func.function_identifier,
+            func.contract_abi,
+            func.abi,
+            func.args,
+            func.kwargs
+        )
+
+    def decode_function_output(self, func: ContractFunction, data: bytes) -> Any:
+        output_types = get_abi_output_types(func.abi)
+        decoded = self.w3.codec.decode_abi(output_types, data)
+        normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+        if len(normalized) == 1:
+            return normalized[0]
+        return normalized
+
+    def _make_separate_calls(self, funcs: List[ContractFunction], bn: int) -> List[Any]:
+        if bn == -1:
+            return [self.make_call(func.call) for func in funcs]
+        return [self.make_call(func.call, block_identifier=bn) for func in funcs]
+
+    def make_multicall(self, funcs: List[ContractFunction], bn: int = -1) -> List[Any]:
+        # Executes view functions of contracts in one eth_call through Multicall3.
+        # The result of a reverted function is None as it is for make_call. If Multicall3
+        # is not available on the chain the functions are called one by one
+        if len(funcs) == 0:
+            return []
+        if not self.multicall_available():
+            return self._make_separate_calls(funcs, bn)
+        calls = [(func.address, True, self.encode_function_call(func)) for func in funcs]
+        aggregated = self._multicall.functions.aggregate3(calls)
+        if bn == -1:
+            resp = self.make_call(aggregated.call)
+        else:
+            resp = self.make_call(aggregated.call, block_identifier=bn)
+        if resp == None:
+            warning(f'{self.chainid}: multicall of {len(funcs)} functions failed, calling them separately')
+            return self._make_separate_calls(funcs, bn)
+        results = []
+        for (func, (success, data)) in zip(funcs, resp):
+            if success and len(data) > 0:
+                results.append(self.decode_function_output(func, data))
+            else:
+                warning(f'{self.chainid}: {func.fn_name} failed within multicall')
+                results.append(None)
+        debug(f'{self.chainid}: {len(funcs)} functions called in one multicall')
+        return results
+
+    def get_block_timestamp(self, block: Union[int, str]) -> int:
+        # blocks can be requested by number only if they are finalized
+        if isinstance(block, str):
+            block = block.lower()
+        timestamp = self.timestamps.get(block)
+        if timestamp == None:
+            debug(f'{self.chainid}: getting timestamp for {block}')
+            if self.batching_enabled():
+                if isinstance(block, int):
+                    resp = self.submit('eth_getBlockByNumber', [hex(block), False]).result()
+                else:
+                    resp = self.submit('eth_getBlockByHash', [block, False]).result()
+                if resp == None:
+                    # the same exception is raised by web3 without batching
+                    raise BlockNotFound(f"Block with id: '{block}' not found.")
+                timestamp = int(resp['timestamp'], 16)
+                self.timestamps.put(int(resp['number'], 16), resp['hash'], timestamp)
+            else:
+                resp = self.make_call(self.w3.eth.get_block, block)
+                timestamp = resp.timestamp
+                self.timestamps.put(resp.number, Web3.toHex(resp.hash), timestamp)
+        return timestamp
+
+    def get_timestamp_by_blockhash(self, blockhash: str) -> int:
+        return self.get_block_timestamp(blockhash)
+
+    def get_timestamps_by_blockhashes(self, blockhashes: List[str]) -> Dict[str, int]:
+        timestamps = {}
+        to_request = []
+        for h in dict.fromkeys(blockhashes):
+            timestamp = self.timestamps.get(h.lower())
+            if timestamp == None:
+                to_request.append(h)
+            else:
+                timestamps[h] = timestamp
+        if len(to_request) > 0:
+            info(f'{self.chainid}: getting timestamps for {len(to_request)} blocks')
+        for i in range(0, len(to_request), self._timestamps_batch_size):
+            batch = to_request[i:i + self._timestamps_batch_size]
+            blocks = self.make_batch_call('eth_getBlockByHash', [[h, False] for h in batch])
+            fetched = []
+            for (h, b) in zip(batch, blocks):
+                timestamps[h] = int(b['timestamp'], 16)
+                fetched.append((int(b['number'], 16), h.lower(), timestamps[h]))
+            self.timestamps.put_many(fetched)
+        return timestamps
+
+def _is_revert(err: Optional[dict]) -> bool:
+    if not isinstance(err, dict):
+        return False
+    return err.get('code') == 3 or str(err.get('message', '')).startswith('execution reverted')
+
 class ERC20Token:
     contract: Contract
     w3_provider: Web3Provider
@@ -64,14 +453,14 @@ class ERC20Token:
     @cache
     def decimals(self) -> int:
         info(f'{self.w3_provider.chainid}: getting decimals for {self.contract.address}')
-        retval = self.w3_provider.make_call(self.contract.functions.decimals().call)
+        retval = self.w3_provider.call_function(self.contract.functions.decimals())
         info(f'{self.w3_provider.chainid}: decimals {retval}')
         return retval
 
     @cache
     def symbol(self) -> int:
         info(f'{self.w3_provider.chainid}: getting symbol for {self.contract.address}')
-        retval = self.w3_provider.make_call(self.contract.functions.symbol().call)
+        retval = self.w3_provider.call_function(self.contract.functions.symbol())
         info(f'{self.w3_provider.chainid}: symbol {retval}')
         return retval
 
@@ -80,7 +469,7 @@ class ERC20Token:
 
     def totalSupply(self, normalize: bool = True) -> Decimal:
         info(f'{self.w3_provider.chainid}: getting total supply')
-        retval = self.w3_provider.make_call(self.contract.functions.totalSupply().call)
+        retval = self.w3_provider.call_function(self.contract.functions.totalSupply())
         if normalize:
             denominator_power = self.decimals()
             retval = Decimal(retval / 10 ** denominator_power)
@@ -91,10 +480,7 @@ class ERC20Token:
 
     def balanceOf(self, owner: str, bn: int = -1, normalize: bool = True) -> Decimal:
         info(f'{self.w3_provider.chainid}: getting balance of {owner}')
-        if bn == -1: 
-            retval = self.w3_provider.make_call(self.contract.functions.balanceOf(owner).call)
-        else:
-            retval = self.w3_provider.make_call(self.contract.functions.balanceOf(owner).call, block_identifier=bn)
+        retval = self.w3_provider.call_function(self.contract.functions.balanceOf(owner), bn)
         if normalize:
             denominator_power = self.decimals()
             retval = Decimal(retval / 10 ** denominator_power)
@@ -105,4 +491,12 @@ class ERC20Token:
 
 @cache
 class CachedERC20Token(ERC20Token):
-    pass
\ No newline at end of file
+    pass
+
+def prefetch_tokens_info(tokens: List[ERC20Token]):
+    # symbols and decimals of the tokens are requested concurrently
+    # so they are sent in the same batches
+    if len(tokens) == 0:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(tokens) * 2, 16)) as executor:
+        list(executor.map(lambda f: f(), [t.symbol for t in tokens] + [t.decimals for t in tokens]))
\ No newline at end of file